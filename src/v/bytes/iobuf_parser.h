@@ -51,6 +51,12 @@ public:
         return {val, length_size};
     }
 
+    std::pair<uint32_t, uint8_t> read_unsigned_varint() {
+        auto [val, length_size] = unsigned_vint::deserialize(_in);
+        _in.skip(length_size);
+        return {val, length_size};
+    }
+
     ss::sstring read_string(size_t len) {
         ss::sstring str = ss::uninitialized_string(len);
         _in.consume_to(str.size(), str.begin());
@@ -128,6 +134,11 @@ public:
     iobuf share_no_consume(size_t len) {
         return ref().share(bytes_consumed(), len);
     }
+
+    /// shares the bytes consumed since position `pos`
+    iobuf share_consumed_since(size_t pos) {
+        return ref().share(pos, bytes_consumed() - pos);
+    }
 };
 
 inline std::ostream& operator<<(std::ostream& o, const iobuf_parser& p) {
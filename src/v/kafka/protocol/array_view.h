@@ -0,0 +1,159 @@
+/*
+ * Copyright 2021 Vectorized, Inc.
+ *
+ * Use of this software is governed by the Business Source License
+ * included in the file licenses/BSL.md
+ *
+ * As of the Change Date specified in that file, in accordance with
+ * the Business Source License, use of this software will be governed
+ * by the Apache License, Version 2.0
+ */
+
+#pragma once
+
+#include "bytes/iobuf.h"
+#include "kafka/protocol/request_reader.h"
+#include "kafka/types.h"
+#include "reflection/type_traits.h"
+
+#include <cstddef>
+#include <iterator>
+#include <type_traits>
+
+namespace kafka {
+
+// the encoding of the iobuf elements of an array_view, which are shared with
+// the request buffer: strings have an int16 length and bytes an int32 length.
+// other element types decode the same way for every encoding.
+enum class view_encoding { none, string, bytes };
+
+namespace detail {
+
+template<typename T, typename = void>
+struct has_view_decode : std::false_type {};
+
+template<typename T>
+struct has_view_decode<
+  T,
+  std::void_t<decltype(std::declval<T&>().decode(
+    std::declval<request_reader&>(), std::declval<api_version>()))>>
+  : std::true_type {};
+
+template<typename T, view_encoding Encoding>
+T decode_view_element(request_reader& reader, api_version version) {
+    if constexpr (has_view_decode<T>::value) {
+        T v;
+        v.decode(reader, version);
+        return v;
+    } else if constexpr (std::is_same_v<T, iobuf>) {
+        static_assert(
+          Encoding != view_encoding::none,
+          "iobuf elements need a string or bytes encoding");
+        if constexpr (Encoding == view_encoding::bytes) {
+            return reader.share_bytes();
+        } else {
+            return reader.share_string();
+        }
+    } else if constexpr (reflection::is_named_type_v<T>) {
+        return T(
+          decode_view_element<typename T::type, Encoding>(reader, version));
+    } else if constexpr (std::is_same_v<T, bool>) {
+        return reader.read_bool();
+    } else if constexpr (std::is_same_v<T, int8_t>) {
+        return reader.read_int8();
+    } else if constexpr (std::is_same_v<T, int16_t>) {
+        return reader.read_int16();
+    } else if constexpr (std::is_same_v<T, int32_t>) {
+        return reader.read_int32();
+    } else {
+        static_assert(std::is_same_v<T, int64_t>, "unsupported element type");
+        return reader.read_int64();
+    }
+}
+
+} // namespace detail
+
+/*
+ * An array in a view type. The encoded elements are shared with the request
+ * buffer and are only decoded as the array is iterated, so an element that is
+ * never visited is never materialized. Iteration is single pass: each call to
+ * begin() decodes the elements again. Arrays of strings and of bytes both
+ * have iobuf elements, and `Encoding` tells them apart.
+ */
+template<typename T, view_encoding Encoding = view_encoding::none>
+class array_view {
+public:
+    class iterator {
+    public:
+        using iterator_category = std::input_iterator_tag;
+        using value_type = T;
+        using difference_type = std::ptrdiff_t;
+        // elements are handed out mutable so that the arrays of a nested
+        // view can be iterated in turn
+        using pointer = T*;
+        using reference = T&;
+
+        iterator(iobuf buf, int32_t remaining, api_version version)
+          : _reader(std::move(buf))
+          , _remaining(remaining)
+          , _version(version) {
+            advance();
+        }
+
+        reference operator*() { return _current; }
+        pointer operator->() { return &_current; }
+
+        iterator& operator++() {
+            advance();
+            return *this;
+        }
+
+        bool operator==(std::default_sentinel_t) const { return _done; }
+        bool operator!=(std::default_sentinel_t) const { return !_done; }
+
+    private:
+        void advance() {
+            if (_remaining <= 0) {
+                _done = true;
+                return;
+            }
+            --_remaining;
+            _current = detail::decode_view_element<T, Encoding>(
+              _reader, _version);
+        }
+
+        request_reader _reader;
+        int32_t _remaining;
+        api_version _version;
+        T _current{};
+        bool _done{false};
+    };
+
+    array_view() = default;
+
+    array_view(iobuf buf, int32_t size, api_version version)
+      : _buf(std::move(buf))
+      , _size(size)
+      , _version(version) {}
+
+    size_t size() const { return _size; }
+    bool empty() const { return _size == 0; }
+
+    // the encoded elements
+    const iobuf& buffer() const { return _buf; }
+
+    iterator begin() {
+        if (_size == 0) {
+            return iterator(iobuf(), 0, _version);
+        }
+        return iterator(_buf.share(0, _buf.size_bytes()), _size, _version);
+    }
+    std::default_sentinel_t end() const { return {}; }
+
+private:
+    iobuf _buf;
+    int32_t _size{0};
+    api_version _version;
+};
+
+} // namespace kafka
@@ -0,0 +1,76 @@
+// Copyright 2021 Vectorized, Inc.
+//
+// Use of this software is governed by the Business Source License
+// included in the file licenses/BSL.md
+//
+// As of the Change Date specified in that file, in accordance with
+// the Business Source License, use of this software will be governed
+// by the Apache License, Version 2.0
+
+#include "kafka/protocol/codec_probe.h"
+
+#include "config/configuration.h"
+#include "prometheus/prometheus_sanitize.h"
+
+#include <seastar/core/metrics.hh>
+
+namespace kafka {
+
+codec_probe& codec_probe::local() {
+    static thread_local codec_probe probe;
+    return probe;
+}
+
+void codec_probe::setup_metrics() {
+    if (config::shard_local_cfg().disable_metrics()) {
+        return;
+    }
+
+    namespace sm = ss::metrics;
+    auto api_key_label = sm::label("api_key");
+    auto version_label = sm::label("version");
+    auto op_label = sm::label("op");
+
+    std::vector<sm::metric_definition> defs;
+    defs.emplace_back(sm::make_derive(
+      "overflows",
+      [this] { return _overflows; },
+      sm::description(
+        "Number of messages with an api key or version outside of the "
+        "schemata")));
+
+    for (const auto& api : codec_apis) {
+        for (auto version = api.min_version; version <= api.max_version;
+             ++version) {
+            for (auto o : {op::encode, op::decode}) {
+                const auto& c
+                  = _counters[api.key][version][static_cast<size_t>(o)];
+                const std::vector<sm::label_instance> labels = {
+                  api_key_label(api.key),
+                  version_label(version),
+                  op_label(o == op::encode ? "encode" : "decode"),
+                };
+                defs.emplace_back(sm::make_derive(
+                  "calls",
+                  [&c] { return c.calls; },
+                  sm::description("Number of messages encoded or decoded"),
+                  labels));
+                defs.emplace_back(sm::make_total_bytes(
+                  "bytes",
+                  [&c] { return c.bytes; },
+                  sm::description("Number of bytes encoded or decoded"),
+                  labels));
+                defs.emplace_back(sm::make_derive(
+                  "cycles",
+                  [&c] { return c.cycles; },
+                  sm::description(
+                    "CPU cycles spent encoding or decoding messages"),
+                  labels));
+            }
+        }
+    }
+
+    _metrics.add_group(prometheus_sanitize::metrics_name("kafka:codec"), defs);
+}
+
+} // namespace kafka
@@ -0,0 +1,139 @@
+/*
+ * Copyright 2021 Vectorized, Inc.
+ *
+ * Use of this software is governed by the Business Source License
+ * included in the file licenses/BSL.md
+ *
+ * As of the Change Date specified in that file, in accordance with
+ * the Business Source License, use of this software will be governed
+ * by the Apache License, Version 2.0
+ */
+
+#pragma once
+
+#include "kafka/protocol/request_reader.h"
+#include "kafka/protocol/response_writer.h"
+#include "kafka/protocol/schemata/codec_versions.h"
+#include "kafka/types.h"
+#include "likely.h"
+#include "seastarx.h"
+
+#include <seastar/core/metrics_registration.hh>
+
+#include <array>
+#include <chrono>
+#include <cstdint>
+
+namespace kafka {
+
+/**
+ * Per-shard counters of the calls, bytes and cycles spent in the generated
+ * message codecs, keyed by api key, version and direction. Only codecs
+ * generated with `generator.py --instrument` (the KAFKA_CODEC_PROBE build
+ * option) reference the probe, so the default build pays nothing for it.
+ *
+ * The counters are sized by the api keys and versions of the schemata, and
+ * their metrics are registered by setup_metrics() when the shard starts.
+ */
+class codec_probe {
+public:
+    enum class op : uint8_t { encode = 0, decode = 1 };
+
+    static constexpr int16_t max_api_key = codec_api_key_limit;
+    static constexpr int16_t max_api_version = codec_api_version_limit;
+
+    void record(
+      api_key key, api_version version, op o, size_t bytes, uint64_t cycles) {
+        if (unlikely(
+              key() < 0 || key() >= max_api_key || version() < 0
+              || version() >= max_api_version)) {
+            ++_overflows;
+            return;
+        }
+        auto& c = _counters[key()][version()][static_cast<size_t>(o)];
+        ++c.calls;
+        c.bytes += bytes;
+        c.cycles += cycles;
+    }
+
+    // clang reads the cpu cycle counter on both x86 and arm, other compilers
+    // fall back to steady clock ticks
+    static uint64_t cycles() {
+#if __has_builtin(__builtin_readcyclecounter)
+        return __builtin_readcyclecounter();
+#else
+        return std::chrono::steady_clock::now().time_since_epoch().count();
+#endif
+    }
+
+    static codec_probe& local();
+
+    /**
+     * Export the counters of each version of the apis with generated codecs.
+     * Called once on each shard at startup, off the codec hot path.
+     */
+    void setup_metrics();
+
+private:
+    struct counters {
+        uint64_t calls{0};
+        uint64_t bytes{0};
+        uint64_t cycles{0};
+    };
+
+    // encode and decode counters of each version of an api
+    using api_counters = std::array<std::array<counters, 2>, max_api_version>;
+
+    std::array<api_counters, max_api_key> _counters{};
+    // calls with an api key or version outside of the schemata
+    uint64_t _overflows{0};
+    ss::metrics::metric_groups _metrics;
+};
+
+/**
+ * Records one call of a generated codec with the bytes that it wrote to or
+ * consumed from the stream and the cycles that it took.
+ */
+template<typename Stream>
+class codec_probe_scope {
+public:
+    codec_probe_scope(
+      api_key key, api_version version, codec_probe::op o, const Stream& s)
+      : _key(key)
+      , _version(version)
+      , _op(o)
+      , _stream(s)
+      , _start_bytes(position(s))
+      , _start_cycles(codec_probe::cycles()) {}
+
+    codec_probe_scope(const codec_probe_scope&) = delete;
+    codec_probe_scope& operator=(const codec_probe_scope&) = delete;
+    codec_probe_scope(codec_probe_scope&&) = delete;
+    codec_probe_scope& operator=(codec_probe_scope&&) = delete;
+
+    ~codec_probe_scope() {
+        codec_probe::local().record(
+          _key,
+          _version,
+          _op,
+          position(_stream) - _start_bytes,
+          codec_probe::cycles() - _start_cycles);
+    }
+
+private:
+    static size_t position(const response_writer& w) {
+        return w.bytes_written();
+    }
+    static size_t position(const request_reader& r) {
+        return r.bytes_consumed();
+    }
+
+    api_key _key;
+    api_version _version;
+    codec_probe::op _op;
+    const Stream& _stream;
+    size_t _start_bytes;
+    uint64_t _start_cycles;
+};
+
+} // namespace kafka
@@ -27,6 +27,7 @@
 
 #include <optional>
 #include <type_traits>
+#include <utility>
 
 namespace kafka {
 
@@ -47,6 +48,10 @@ public:
         auto [i, _] = _parser.read_varlong();
         return i;
     }
+    uint32_t read_unsigned_varint() {
+        auto [i, _] = _parser.read_unsigned_varint();
+        return i;
+    }
 
     ss::sstring read_string() { return do_read_string(read_int16()); }
 
@@ -60,6 +65,28 @@ public:
 
     bytes read_bytes() { return _parser.read_bytes(read_int32()); }
 
+    // compact encodings used by flexible versions (KIP-482). lengths are
+    // unsigned varints offset by one so that zero encodes null.
+    ss::sstring read_compact_string() {
+        return do_read_string(read_compact_length());
+    }
+
+    std::optional<ss::sstring> read_nullable_compact_string() {
+        auto n = read_compact_length();
+        if (n < 0) {
+            return std::nullopt;
+        }
+        return {do_read_string(n)};
+    }
+
+    bytes read_compact_bytes() {
+        auto n = read_compact_length();
+        if (unlikely(n < 0)) {
+            throw std::out_of_range("Asked to read negative compact bytes");
+        }
+        return _parser.read_bytes(n);
+    }
+
     // Stronly suggested to use read_nullable_iobuf
     std::optional<iobuf> read_fragmented_nullable_bytes() {
         auto [io, count] = read_nullable_iobuf();
@@ -104,8 +131,118 @@ public:
         return do_read_array(len, std::forward<ElementParser>(parser));
     }
 
+    template<
+      typename ElementParser,
+      typename T = std::invoke_result_t<ElementParser, request_reader&>>
+    std::vector<T> read_compact_array(ElementParser&& parser) {
+        auto len = read_compact_length();
+        if (unlikely(len < 0)) {
+            throw std::out_of_range("Asked to read a null compact array");
+        }
+        return do_read_array(len, std::forward<ElementParser>(parser));
+    }
+
+    template<
+      typename ElementParser,
+      typename T = std::invoke_result_t<ElementParser, request_reader&>>
+    std::optional<std::vector<T>>
+    read_nullable_compact_array(ElementParser&& parser) {
+        auto len = read_compact_length();
+        if (len < 0) {
+            return std::nullopt;
+        }
+        return do_read_array(len, std::forward<ElementParser>(parser));
+    }
+
+    // the tagged fields section that ends every structure in flexible
+    // versions. each field is handed to the parser with a reader limited to
+    // the field's bytes. parsers ignore tags they do not know.
+    // clang-format off
+    template<typename TagParser>
+    CONCEPT(requires requires(TagParser parser, uint32_t tag,
+                              request_reader& rr) {
+        { parser(tag, rr) } -> std::same_as<void>;
+    })
+    // clang-format on
+    void read_tagged_fields(TagParser&& parser) {
+        auto n = read_unsigned_varint();
+        while (n-- > 0) {
+            auto tag = read_unsigned_varint();
+            auto size = read_unsigned_varint();
+            request_reader field(_parser.share(size));
+            parser(tag, field);
+        }
+    }
+
+    // zero-copy reads used by view types. the returned buffers share the
+    // fragments of the request rather than copying them.
+    iobuf share_string() {
+        auto n = read_int16();
+        if (unlikely(n < 0)) {
+            throw std::out_of_range("Asked to read a negative byte string");
+        }
+        return _parser.share(n);
+    }
+
+    std::optional<iobuf> share_nullable_string() {
+        auto n = read_int16();
+        if (n < 0) {
+            return std::nullopt;
+        }
+        return _parser.share(n);
+    }
+
+    iobuf share_bytes() {
+        auto n = read_int32();
+        if (unlikely(n < 0)) {
+            throw std::out_of_range("Asked to read negative bytes");
+        }
+        return _parser.share(n);
+    }
+
+    // share the encoded elements of an array without decoding them. the
+    // skipper advances the reader past one element. returns the elements and
+    // the array length, which is negative for a null array.
+    template<typename ElementSkipper>
+    std::pair<iobuf, int32_t> share_array(ElementSkipper&& skipper) {
+        auto len = read_int32();
+        auto start = bytes_consumed();
+        for (auto i = 0; i < len; ++i) {
+            skipper(*this);
+        }
+        return {_parser.share_consumed_since(start), len};
+    }
+
+    void skip(size_t n) { _parser.skip(n); }
+
+    // skip a string or nullable string
+    void skip_string() { _parser.skip(std::max<int16_t>(0, read_int16())); }
+
+    // skip bytes, nullable bytes or records
+    void skip_bytes() { _parser.skip(std::max<int32_t>(0, read_int32())); }
+
+    template<typename ElementSkipper>
+    void skip_array(ElementSkipper&& skipper) {
+        auto len = read_int32();
+        for (auto i = 0; i < len; ++i) {
+            skipper(*this);
+        }
+    }
+
+    void skip_tagged_fields() {
+        auto n = read_unsigned_varint();
+        while (n-- > 0) {
+            read_unsigned_varint();
+            _parser.skip(read_unsigned_varint());
+        }
+    }
+
 private:
-    ss::sstring do_read_string(int16_t n) {
+    int32_t read_compact_length() {
+        return static_cast<int32_t>(read_unsigned_varint()) - 1;
+    }
+
+    ss::sstring do_read_string(int32_t n) {
         if (unlikely(n < 0)) {
             /// FIXME: maybe return empty string?
             throw std::out_of_range("Asked to read a negative byte string");
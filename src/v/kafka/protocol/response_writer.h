@@ -27,14 +27,20 @@
 
 #include <boost/range/numeric.hpp>
 
+#include <array>
 #include <optional>
 #include <string_view>
+#include <utility>
+#include <vector>
 
 namespace kafka {
 
 class response_writer;
 void writer_serialize_batch(response_writer& w, model::record_batch&& batch);
 
+// encoded tagged fields of a structure in flexible versions, ordered by tag
+using tagged_fields = std::vector<std::pair<uint32_t, iobuf>>;
+
 class response_writer {
     template<typename ExplicitIntegerType, typename IntegerType>
     // clang-format off
@@ -53,10 +59,28 @@ class response_writer {
         return x.size();
     }
 
+    uint32_t serialize_unsigned_vint(uint32_t val) {
+        std::array<uint8_t, unsigned_vint::max_length> x;
+        auto size = unsigned_vint::serialize(val, x.data());
+        _out->append(x.data(), size);
+        return size;
+    }
+
+    // compact lengths are offset by one so that zero encodes null
+    uint32_t write_compact_length(int32_t len) {
+        return serialize_unsigned_vint(len + 1);
+    }
+
 public:
     explicit response_writer(iobuf& out) noexcept
       : _out(&out) {}
 
+    size_t bytes_written() const { return _out->size_bytes(); }
+
+    // make sure the next `size` bytes are written into a single fragment,
+    // e.g. the encoded_size() of a message about to be written
+    void reserve_memory(size_t size) { _out->reserve_memory(size); }
+
     uint32_t write(bool v) { return serialize_int<int8_t>(v); }
 
     uint32_t write(int8_t v) { return serialize_int<int8_t>(v); }
@@ -81,6 +105,10 @@ public:
 
     uint32_t write_varlong(int64_t v) { return serialize_vint(v); }
 
+    uint32_t write_unsigned_varint(uint32_t v) {
+        return serialize_unsigned_vint(v);
+    }
+
     uint32_t write(std::string_view v) {
         auto size = serialize_int<int16_t>(v.size()) + v.size();
         _out->append(v.data(), v.size());
@@ -135,6 +163,46 @@ public:
         return write(std::move(*rdr).release());
     }
 
+    // compact encodings used by flexible versions (KIP-482)
+    uint32_t write_compact(std::string_view v) {
+        auto size = write_compact_length(v.size()) + v.size();
+        _out->append(v.data(), v.size());
+        return size;
+    }
+
+    uint32_t write_compact(const ss::sstring& v) {
+        return write_compact(std::string_view(v));
+    }
+
+    uint32_t write_compact(std::optional<std::string_view> v) {
+        if (!v) {
+            return write_compact_length(-1);
+        }
+        return write_compact(*v);
+    }
+
+    uint32_t write_compact(const std::optional<ss::sstring>& v) {
+        if (!v) {
+            return write_compact_length(-1);
+        }
+        return write_compact(std::string_view(*v));
+    }
+
+    uint32_t write_compact(bytes_view bv) {
+        auto size = write_compact_length(bv.size()) + bv.size();
+        _out->append(reinterpret_cast<const char*>(bv.data()), bv.size());
+        return size;
+    }
+
+    uint32_t write_compact(const model::topic& topic) {
+        return write_compact(topic());
+    }
+
+    template<typename T, typename Tag>
+    uint32_t write_compact(const named_type<T, Tag>& t) {
+        return write_compact(t());
+    }
+
     // write bytes directly to output without a length prefix
     uint32_t write_direct(iobuf&& f) {
         auto size = f.size_bytes();
@@ -199,6 +267,68 @@ public:
         return write_array(*v, std::forward<ElementWriter>(writer));
     }
 
+    // clang-format off
+    template<typename T, typename ElementWriter>
+    CONCEPT(requires requires (ElementWriter writer,
+                               response_writer& rw,
+                               const T& elem) {
+        { writer(elem, rw) } -> std::same_as<void>;
+    })
+    // clang-format on
+    uint32_t
+    write_compact_array(const std::vector<T>& v, ElementWriter&& writer) {
+        auto start_size = uint32_t(_out->size_bytes());
+        write_compact_length(v.size());
+        for (auto& elem : v) {
+            writer(elem, *this);
+        }
+        return _out->size_bytes() - start_size;
+    }
+    // clang-format off
+    template<typename T, typename ElementWriter>
+    CONCEPT(
+          requires requires(ElementWriter writer, response_writer& rw, T& elem) {
+            { writer(elem, rw) } -> std::same_as<void>;
+    })
+    // clang-format on
+    uint32_t write_compact_array(std::vector<T>& v, ElementWriter&& writer) {
+        auto start_size = uint32_t(_out->size_bytes());
+        write_compact_length(v.size());
+        for (auto& elem : v) {
+            writer(elem, *this);
+        }
+        return _out->size_bytes() - start_size;
+    }
+
+    // clang-format off
+    template<typename T, typename ElementWriter>
+    CONCEPT(
+          requires requires(ElementWriter writer, response_writer& rw, T& elem) {
+            { writer(elem, rw) } -> std::same_as<void>;
+    })
+    // clang-format on
+    uint32_t write_nullable_compact_array(
+      std::optional<std::vector<T>>& v, ElementWriter&& writer) {
+        if (!v) {
+            return write_compact_length(-1);
+        }
+        return write_compact_array(*v, std::forward<ElementWriter>(writer));
+    }
+
+    // the tagged fields section that ends every structure in flexible
+    // versions: the number of fields followed by the tag, size and value of
+    // each field
+    uint32_t write_tagged_fields(tagged_fields fields) {
+        auto start_size = uint32_t(_out->size_bytes());
+        serialize_unsigned_vint(fields.size());
+        for (auto& [tag, value] : fields) {
+            serialize_unsigned_vint(tag);
+            serialize_unsigned_vint(value.size_bytes());
+            _out->append(std::move(value));
+        }
+        return _out->size_bytes() - start_size;
+    }
+
     // wrap a writer in a kafka bytes array object. the writer should return
     // true if writing no bytes should result in the encoding as nullable bytes,
     // and false otherwise.
@@ -224,7 +354,7 @@ public:
     }
 
     uint32_t write(std::optional<produce_request_record_data>& data) {
-        if (!data) {
+        if (!data || !data->adapter.batch) {
             return write(int32_t(-1));
         }
         auto start_size = uint32_t(_out->size_bytes());
@@ -233,6 +363,128 @@ public:
         return _out->size_bytes() - start_size;
     }
 
+    // the number of bytes that the matching write() overload produces. these
+    // let generated messages compute their encoded size up front.
+    template<
+      typename T,
+      typename = std::enable_if_t<std::is_integral_v<T> || std::is_enum_v<T>>>
+    static constexpr size_t size_of(T) {
+        return sizeof(T);
+    }
+
+    static constexpr size_t size_of(model::timestamp) {
+        return sizeof(int64_t);
+    }
+
+    template<typename Rep, typename Period>
+    static constexpr size_t size_of(const std::chrono::duration<Rep, Period>&) {
+        return sizeof(int32_t);
+    }
+
+    template<typename T, typename Tag>
+    static size_t size_of(const named_type<T, Tag>& t) {
+        return size_of(t());
+    }
+
+    static size_t size_of(std::string_view v) {
+        return sizeof(int16_t) + v.size();
+    }
+
+    static size_t size_of(const ss::sstring& v) {
+        return size_of(std::string_view(v));
+    }
+
+    static size_t size_of(const std::optional<ss::sstring>& v) {
+        return v ? size_of(std::string_view(*v)) : sizeof(int16_t);
+    }
+
+    static size_t size_of(bytes_view bv) { return sizeof(int32_t) + bv.size(); }
+
+    static size_t size_of(const std::optional<iobuf>& data) {
+        return sizeof(int32_t) + (data ? data->size_bytes() : 0);
+    }
+
+    static size_t size_of(const std::optional<batch_reader>& rdr) {
+        return sizeof(int32_t) + (rdr ? rdr->size_bytes() : 0);
+    }
+
+    static size_t size_of(const std::optional<produce_request_record_data>& d) {
+        if (!d || !d->adapter.batch) {
+            return sizeof(int32_t);
+        }
+        // see writer_serialize_batch
+        return sizeof(int32_t) + d->adapter.batch->size_bytes()
+               - model::packed_record_batch_header_size
+               + internal::kafka_header_size;
+    }
+
+    static size_t compact_size_of(std::string_view v) {
+        return unsigned_vint::vint_size(v.size() + 1) + v.size();
+    }
+
+    static size_t compact_size_of(const ss::sstring& v) {
+        return compact_size_of(std::string_view(v));
+    }
+
+    static size_t compact_size_of(const std::optional<ss::sstring>& v) {
+        return v ? compact_size_of(std::string_view(*v))
+                 : unsigned_vint::vint_size(0);
+    }
+
+    static size_t compact_size_of(bytes_view bv) {
+        return unsigned_vint::vint_size(bv.size() + 1) + bv.size();
+    }
+
+    template<typename T, typename Tag>
+    static size_t compact_size_of(const named_type<T, Tag>& t) {
+        return compact_size_of(t());
+    }
+
+    template<typename T, typename ElementSize>
+    static size_t
+    array_size_of(const std::vector<T>& v, ElementSize&& element_size) {
+        size_t size = sizeof(int32_t);
+        for (auto& elem : v) {
+            size += element_size(elem);
+        }
+        return size;
+    }
+
+    template<typename T, typename ElementSize>
+    static size_t nullable_array_size_of(
+      const std::optional<std::vector<T>>& v, ElementSize&& element_size) {
+        if (!v) {
+            return sizeof(int32_t);
+        }
+        return array_size_of(*v, std::forward<ElementSize>(element_size));
+    }
+
+    template<typename T, typename ElementSize>
+    static size_t
+    compact_array_size_of(const std::vector<T>& v, ElementSize&& element_size) {
+        size_t size = unsigned_vint::vint_size(v.size() + 1);
+        for (auto& elem : v) {
+            size += element_size(elem);
+        }
+        return size;
+    }
+
+    template<typename T, typename ElementSize>
+    static size_t nullable_compact_array_size_of(
+      const std::optional<std::vector<T>>& v, ElementSize&& element_size) {
+        if (!v) {
+            return unsigned_vint::vint_size(0);
+        }
+        return compact_array_size_of(
+          *v, std::forward<ElementSize>(element_size));
+    }
+
+    // size of one entry of a tagged fields section holding `size` bytes
+    static size_t tagged_field_size_of(uint32_t tag, size_t size) {
+        return unsigned_vint::vint_size(tag) + unsigned_vint::vint_size(size)
+               + size;
+    }
+
 private:
     iobuf* _out;
 };
@@ -21,23 +21,27 @@
 #   path_type_map to override types, it would be more efficient to specify the
 #   same mapping using the field_name_type_map + a whitelist of request types.
 #
-#   - The current version does not handle flexible versions. It will be some
-#   time before we encounter clients requiring this, but in principle this
-#   generator should be extensible (see type maps below). Note that when the
-#   time comes to support flexible versions, there is a filter in the templates
-#   within this file that ignores such fields, and that filter should be
-#   removed.
+#   - Flexible versions (KIP-482) are generated with compact strings, bytes
+#   and arrays plus tagged field sections, but records (iobuf and
+#   fetch_record_set fields) do not have a compact encoding yet.
 #
 #   - Handle ignorable fields. Currently we handle nullable fields properly. The
 #   ignorable flag on a field doesn't change the wire protocol, but gives
 #   instruction on how things should behave when there is missing data.
 #
+import argparse
+import ast
+import collections
+import hashlib
 import io
+import itertools
 import json
 import functools
+import os
 import pathlib
 import re
 import sys
+import tempfile
 import textwrap
 import jsonschema
 import jinja2
@@ -280,6 +284,66 @@ basic_type_map = dict(
     fetch_record_set=("batch_reader", None, "read_nullable_batch_reader()"),
 )
 
+# primitive types whose encoding changes in flexible versions (KIP-482). the
+# tuples mirror basic_type_map. types that are not listed here are encoded the
+# same way in all versions. a None decoder marks a type without support for
+# flexible versions.
+compact_type_map = dict(
+    string=("ss::sstring", "read_compact_string()",
+            "read_nullable_compact_string()"),
+    bytes=("bytes", "read_compact_bytes()", None),
+    iobuf=("iobuf", None, None),
+    fetch_record_set=("batch_reader", None, None),
+)
+
+# messages whose codecs get one straight-line body per valid version, selected
+# by a single switch, rather than a version check around each field. this
+# trades code size for fewer branches, so it is reserved for the hot apis. the
+# version guarded codec is still generated (encode_guarded / decode_guarded)
+# and handles any version outside of validVersions.
+specialized_messages = {
+    "ProduceRequest",
+    "ProduceResponse",
+    "FetchRequest",
+    "FetchResponse",
+    "MetadataRequest",
+    "MetadataResponse",
+}
+
+# messages that also get a zero-copy view type, <struct>_view, for each of
+# their structs. strings, bytes and records in a view share the fragments of
+# the request buffer instead of being copied, and arrays are decoded lazily as
+# they are iterated (see kafka/protocol/array_view.h). the regular owning
+# types are still generated. views are only supported for versions that are
+# not flexible. the produce and fetch handlers still decode the owning types;
+# the views are exercised by the generated round trip tests only.
+view_messages = {
+    "ProduceRequest",
+    "FetchRequest",
+}
+
+# the types of view fields whose regular type owns memory. the tuples are
+# (type, decoder, nullable decoder, skipper).
+view_type_map = dict(
+    string=("iobuf", "share_string()", "share_nullable_string()",
+            "skip_string()"),
+    bytes=("iobuf", "share_bytes()", None, "skip_bytes()"),
+    iobuf=("iobuf", None, "read_fragmented_nullable_bytes()", "skip_bytes()"),
+    fetch_record_set=("iobuf", None, "read_fragmented_nullable_bytes()",
+                      "skip_bytes()"),
+)
+
+# the array_view encoding of arrays whose elements are shared iobufs
+view_encoding_map = dict(string="view_encoding::string",
+                         bytes="view_encoding::bytes")
+
+# the encoding of the fixed size primitive types, used to skip them
+fixed_size_map = dict(bool="int8_t",
+                      int8="int8_t",
+                      int16="int16_t",
+                      int32="int32_t",
+                      int64="int64_t")
+
 # apply a rename to a struct. this is useful when there is a type name conflict
 # between two request types. since we generate types in a flat namespace this
 # feature is important for resolving naming conflicts.
@@ -419,26 +483,86 @@ class VersionRange:
             max = int(match.group("max"))
             return min, max
 
-    def guard(self):
+    def guard(self, bounds=None):
         """
-        Generate the C++ bounds check.
+        Generate the C++ bounds check. Checks implied by the `bounds` that the
+        version is already known to fall within are left out.
         """
+        lo = bounds.min if bounds else 0
+        hi = bounds.max if bounds else None
         if self.min == self.max:
+            if lo == hi == self.min:
+                return ""
             cond = f"version == api_version({self.min})"
         else:
             cond = []
-            if self.min > 0:
+            if self.min > lo:
                 cond.append(f"version >= api_version({self.min})")
-            if self.max != None:
+            if self.max != None and (hi is None or self.max < hi):
                 cond.append(f"version <= api_version({self.max})")
             cond = " && ".join(cond)
         return cond
 
+    def overlaps(self, bounds):
+        """
+        True if any version within `bounds` is in this range.
+        """
+        return (bounds.max is None or self.min <= bounds.max) and \
+            (self.max is None or self.max >= bounds.min)
+
     def __repr__(self):
         max = "+inf)" if self.max is None else f"{self.max}]"
         return f"[{self.min}, {max}"
 
 
+class VersionBounds:
+    """
+    The versions [min, max] handled by one generated encode or decode body,
+    and whether those versions use the flexible encoding.
+    """
+    def __init__(self, min, max, flexible):
+        self.min = min
+        self.max = max
+        self.flexible = flexible
+
+
+def codec_bodies(flexible_versions, tagged_versions=()):
+    """
+    Return the (condition, bounds) of the bodies generated for each codec. A
+    message with flexible versions gets one body for the flexible versions and
+    one for the versions before them so that the encoding is only selected
+    once per message rather than per field. The flexible body is split again
+    at each of the `tagged_versions` in which a field becomes tagged, so that
+    every field is either tagged or not across all versions of a body.
+    """
+    if flexible_versions is None:
+        return [("", VersionBounds(0, None, False))]
+    splits = sorted(v for v in set(tagged_versions)
+                    if v > flexible_versions.min)
+    starts = [flexible_versions.min] + splits
+    ends = [v - 1 for v in splits] + [None]
+    bodies = [(VersionRange(f"{lo}+").guard(), VersionBounds(lo, hi, True))
+              for lo, hi in zip(starts, ends)]
+    bodies.reverse()
+    if flexible_versions.min == 0:
+        # the versions below are already ruled out by the earlier conditions
+        bodies[-1] = ("", bodies[-1][1])
+        return bodies
+    return bodies + [("", VersionBounds(0, flexible_versions.min - 1, False))]
+
+
+def version_bodies(valid_versions, flexible_versions):
+    """
+    Return the (version, bounds) of the bodies generated for a specialized
+    codec, one for each valid version.
+    """
+    return [(v,
+             VersionBounds(
+                 v, v, flexible_versions is not None
+                 and v >= flexible_versions.min))
+            for v in range(valid_versions.min, valid_versions.max + 1)]
+
+
 def snake_case(name):
     """Convert camel to snake case"""
     return name[0].lower() + "".join(
@@ -514,6 +638,36 @@ class StructType(FieldType):
         """Format string for output operator"""
         return " ".join(map(lambda f: f"{f.name}={{}}", self.fields))
 
+    def tagged_fields(self, bounds):
+        """
+        Fields sent in the tagged fields section for the versions within
+        `bounds`, ordered by tag.
+        """
+        return sorted(
+            (f for f in self.fields
+             if f.versions().overlaps(bounds) and f.is_tagged(bounds)),
+            key=lambda f: f.tag)
+
+    def tagged_versions(self):
+        """
+        The versions in which fields of this struct or of the structs nested
+        in it become tagged.
+        """
+        versions = set()
+        for field in self.fields:
+            if field.tagged_versions is not None:
+                versions.add(field.tagged_versions.min)
+        for struct in self.structs():
+            versions |= struct.tagged_versions()
+        return versions
+
+    def has_records(self):
+        """
+        Whether this struct or a struct nested in it holds a record set.
+        """
+        return any(f.is_records for s in self.structs() + [self]
+                   for f in s.fields)
+
     def structs(self):
         """
         Return all struct types reachable from this struct.
@@ -551,6 +705,12 @@ class Field:
         self._default_value = self._field.get("default", "")
         if self._default_value == "null":
             self._default_value = ""
+        self._tagged_versions = self._field.get("taggedVersions", None)
+        if self._tagged_versions is not None:
+            self._tagged_versions = VersionRange(self._tagged_versions)
+            # fields are assumed to stay tagged once they become tagged
+            assert self._tagged_versions.max is None
+            assert "tag" in self._field
         assert len(self._path)
 
     @staticmethod
@@ -573,6 +733,46 @@ class Field:
     def about(self):
         return self._field.get("about", "<no description>")
 
+    @property
+    def tag(self):
+        return self._field.get("tag", None)
+
+    @property
+    def tagged_versions(self):
+        return self._tagged_versions
+
+    def is_tagged(self, bounds):
+        """
+        True if the field is sent in the tagged fields section rather than in
+        order for the versions within `bounds`. Codec bodies are split where
+        fields become tagged (see `codec_bodies`), so `bounds` never has the
+        field tagged in only some of its versions.
+        """
+        tagged = self._tagged_versions
+        if not bounds.flexible or tagged is None or not tagged.overlaps(
+                bounds):
+            return False
+        assert tagged.min <= bounds.min, \
+            f"{self._path} is tagged in only some of versions {bounds.min}-{bounds.max}"
+        return True
+
+    def tagged_guard(self, bounds, fname):
+        """
+        Condition for sending a tagged field. Like kafka, tagged fields are
+        only sent when they differ from their default value.
+        """
+        if self.nullable():
+            present = f"{fname}.has_value()"
+        elif self.is_array:
+            present = f"!{fname}.empty()"
+        else:
+            name, default_value = self.type_name
+            if default_value is None:
+                default_value = self.default_value()
+            present = f"{fname} != {name}{{{default_value}}}"
+        cond = self._versions.guard(bounds)
+        return f"{cond} && {present}" if cond else present
+
     def _redpanda_path_type(self):
         """
         Resolve a redpanda field path type override.
@@ -614,37 +814,63 @@ class Field:
 
         return tn, None
 
-    def _redpanda_decoder(self):
+    def _wire_type(self):
         """
-        Resolve a redpanda type override.
+        Resolve the primitive type used on the wire and the redpanda named
+        type wrapping it, if any.
         Lookup occurs from most to least specific.
         """
         # path overrides
         path_type = self._redpanda_path_type()
         if path_type:
-            return basic_type_map[path_type[1]], path_type[0]
+            return path_type[1], path_type[0]
 
         # entity type overrides
         et = self._field.get("entityType", None)
         if et in entity_type_map:
             m = entity_type_map[et]
-            return basic_type_map[m[1]], m[0]
+            return m[1], m[0]
 
         tn = self._type.name
         fn = self._field["name"]
 
         # type/name overrides
         if (tn, fn) in field_name_type_map:
-            return basic_type_map[tn], field_name_type_map[(tn, fn)][0]
+            return tn, field_name_type_map[(tn, fn)][0]
 
         # fundamental type overrides
         if tn in basic_type_map:
-            return basic_type_map[tn], None
+            return tn, None
 
         raise Exception(f"No decoder for {(tn, fn)}")
 
+    def _redpanda_decoder(self, flexible=False):
+        wire_type, named_type = self._wire_type()
+        decoders = basic_type_map[wire_type]
+        if flexible:
+            decoders = compact_type_map.get(wire_type, decoders)
+            if decoders[1] is None and decoders[2] is None:
+                raise Exception(
+                    f"No flexible version decoder for {wire_type} field "
+                    f"{self._field['name']}")
+        return decoders, named_type
+
+    @property
+    def is_compact(self):
+        """
+        True if the field uses a compact encoding in flexible versions.
+        """
+        return self._wire_type()[0] in compact_type_map
+
     @property
     def decoder(self):
+        return self._decoder(flexible=False)
+
+    @property
+    def flexible_decoder(self):
+        return self._decoder(flexible=True)
+
+    def _decoder(self, flexible):
         """
         There are two cases:
 
@@ -658,7 +884,7 @@ class Field:
                   named_type(*tmp)
                 }
         """
-        plain_decoder, named_type = self._redpanda_decoder()
+        plain_decoder, named_type = self._redpanda_decoder(flexible)
         if self.is_array:
             # array fields never contain nullable types. so if this is an array
             # field then choose the non-nullable decoder for its element type.
@@ -694,6 +920,152 @@ class Field:
     def name(self):
         return snake_case(self._field["name"])
 
+    @property
+    def view_element_type(self):
+        """
+        The type of the field, or of its elements for an array, in a view.
+        """
+        if self.is_array and self._type.value_type().is_struct:
+            return f"{self._type.value_type().name}_view"
+        wire_type = self._wire_type()[0]
+        if wire_type in view_type_map:
+            return view_type_map[wire_type][0]
+        return self._redpanda_type()[0]
+
+    @property
+    def view_type(self):
+        name = self.view_element_type
+        if self.is_array:
+            encoding = None
+            if not self._type.value_type().is_struct:
+                encoding = view_encoding_map.get(self._wire_type()[0])
+            if encoding:
+                name = f"array_view<{name}, {encoding}>"
+            else:
+                name = f"array_view<{name}>"
+        if self.nullable():
+            return f"std::optional<{name}>"
+        return name
+
+    @property
+    def view_default(self):
+        if self.is_array or self._wire_type()[0] in view_type_map:
+            return ""
+        name, default_value = self.type_name
+        if default_value is None:
+            return self.default_value()
+        return default_value
+
+    @property
+    def view_decoder(self):
+        """
+        Expression decoding a field other than an array in a view.
+        """
+        wire_type, _ = self._wire_type()
+        if wire_type in view_type_map:
+            decoder = view_type_map[wire_type][2 if self.nullable() else 1]
+            assert decoder
+            return f"reader.{decoder}"
+        decoder, named_type = self.decoder
+        assert not self.nullable()
+        if named_type is None:
+            return f"reader.{decoder}"
+        return f"{named_type}(reader.{decoder})"
+
+    @property
+    def view_skipper(self):
+        """
+        Statement skipping the field, or one of its elements for an array of
+        primitive types, without decoding it.
+        """
+        wire_type = self._wire_type()[0]
+        if wire_type in view_type_map:
+            return f"reader.{view_type_map[wire_type][3]}"
+        return f"reader.skip(sizeof({fixed_size_map[wire_type]}))"
+
+    @property
+    def is_records(self):
+        """
+        Whether the field is a record set. Record sets are written by sharing
+        their fragments, so their size doesn't need contiguous buffer space.
+        """
+        return not self.is_array and not self._type.is_struct and \
+            self._wire_type()[0] in ("iobuf", "fetch_record_set")
+
+    @property
+    def view_checker(self):
+        """
+        The test helper comparing the field in a view to the owning type.
+        Records are only compared by size since the owning type holds them
+        as batches.
+        """
+        if self.is_records:
+            return "check_view_records"
+        return "check_view_value"
+
+    @property
+    def sample_value(self):
+        """
+        A C++ expression for a non-default value of the field's element type,
+        used by the generated tests. None for records, which aren't populated.
+        """
+        assert not self._type.is_struct
+        name = self._redpanda_type()[0]
+        wire_type = self._wire_type()[0]
+        if wire_type == "string":
+            return f'{name}("{self.name}")'
+        if wire_type == "bytes":
+            return "bytes(size_t(3), uint8_t(1))"
+        if wire_type in ("iobuf", "fetch_record_set"):
+            return None
+        if wire_type == "bool":
+            return "true"
+        return f"{name}(1)"
+
+    @property
+    def python_sample_value(self):
+        """
+        The python value of `sample_value`, used to encode the messages of the
+        generated tests with the python codecs.
+        """
+        assert not self._type.is_struct
+        wire_type = self._wire_type()[0]
+        if wire_type == "string":
+            return self.name
+        if wire_type == "bytes":
+            return bytes([1] * 3)
+        if wire_type in ("iobuf", "fetch_record_set"):
+            return None
+        if wire_type == "bool":
+            return True
+        return 1
+
+    @property
+    def random_value(self):
+        """
+        A C++ expression for a random value of the field's element type, used
+        by the generated benchmarks. None for records, which aren't populated.
+        """
+        assert not self._type.is_struct
+        name = self._redpanda_type()[0]
+        wire_type = self._wire_type()[0]
+        if wire_type == "string":
+            return f"{name}(random_generators::gen_alphanum_string(" \
+                "random_generators::get_int<size_t>(1, 32)))"
+        if wire_type == "bytes":
+            return "random_generators::get_bytes(" \
+                "random_generators::get_int<size_t>(1, 32))"
+        if wire_type in ("iobuf", "fetch_record_set"):
+            return None
+        if wire_type == "bool":
+            return "random_generators::get_int(1) == 1"
+        if wire_type == "int8":
+            # int8 fields are mostly enums, keep them within a small range
+            return f"{name}(static_cast<int8_t>(" \
+                "random_generators::get_int<int16_t>(1)))"
+        ctype = basic_type_map[wire_type][0]
+        return f"{name}(random_generators::get_int<{ctype}>())"
+
 
 HEADER_TEMPLATE = """
 #pragma once
@@ -702,6 +1074,9 @@ HEADER_TEMPLATE = """
 #include "model/metadata.h"
 #include "kafka/protocol/batch_reader.h"
 #include "kafka/protocol/errors.h"
+{%- if view %}
+#include "kafka/protocol/array_view.h"
+{%- endif %}
 #include "model/timestamp.h"
 #include "seastarx.h"
 
@@ -739,6 +1114,8 @@ class response;
 
 {% for struct in struct.structs() %}
 {{ render_struct(struct) }}
+    size_t encoded_size(api_version) const;
+
     friend std::ostream& operator<<(std::ostream&, const {{ struct.name }}&);
 };
 
@@ -746,14 +1123,316 @@ class response;
 
 {{ render_struct(struct) }}
     void encode(response_writer&, api_version);
+    size_t encoded_size(api_version) const;
 {%- if op_type == "request" %}
     void decode(request_reader&, api_version);
 {%- else %}
     void decode(iobuf, api_version);
 {%- endif %}
+{%- if specialized %}
+
+    // version guarded codec. encode and decode use it for versions without a
+    // specialized body.
+    void encode_guarded(response_writer&, api_version);
+    void decode_guarded(request_reader&, api_version);
+{%- endif %}
 
     friend std::ostream& operator<<(std::ostream&, const {{ struct.name }}&);
 };
+{%- if view %}
+{% for struct in struct.structs() + [struct] %}
+/*
+ * Zero-copy view of {{ struct.name }}. See generator.py:view_messages.
+ */
+struct {{ struct.name }}_view {
+{%- for field in struct.fields %}
+    {{ field.view_type }} {{ field.name }}{ {{- field.view_default -}} };
+{%- endfor %}
+
+    void decode(request_reader&, api_version);
+    static void skip(request_reader&, api_version);
+};
+{% endfor %}
+{%- endif %}
+
+}
+"""
+
+# round-trip tests for the generated codec. every struct is checked twice per
+# valid version: default constructed, and with strings, arrays and integers
+# populated so that variable length and tagged fields are exercised. both are
+# also compared with the bytes that the generated python codecs encode for the
+# same values (see Generator.python_encoded).
+TEST_TEMPLATE = """
+#include "kafka/protocol/schemata/{{ header }}"
+
+{% if view -%}
+#include "bytes/bytes.h"
+{% endif -%}
+#include "kafka/protocol/request_reader.h"
+#include "kafka/protocol/response_writer.h"
+
+#include <seastar/testing/thread_test_case.hh>
+
+namespace kafka {
+
+{%- for struct in struct.structs() + [struct] %}
+
+static void populate({{ struct.name }}& v) {
+{%- for field in struct.fields %}
+{%- if field.is_array %}
+{%- if field.type().value_type().is_struct %}
+{%- if field.nullable() %}
+    v.{{ field.name }}.emplace(2);
+    for (auto& e : *v.{{ field.name }}) {
+{%- else %}
+    v.{{ field.name }}.resize(2);
+    for (auto& e : v.{{ field.name }}) {
+{%- endif %}
+        populate(e);
+    }
+{%- elif field.sample_value %}
+    v.{{ field.name }} = { {{- field.sample_value }}, {{ field.sample_value -}} };
+{%- endif %}
+{%- elif field.sample_value %}
+    v.{{ field.name }} = {{ field.sample_value }};
+{%- endif %}
+{%- endfor %}
+}
+{%- endfor %}
+{%- if view %}
+
+// compare the fields of a view to those of the owning type decoded from the
+// same buffer, descending into every array of the view
+template<typename T>
+static void check_view_value(const T& view, const T& data) {
+    BOOST_REQUIRE(view == data);
+}
+
+static void check_view_value(const iobuf& view, const ss::sstring& data) {
+    BOOST_REQUIRE(view == std::string_view(data));
+}
+
+static void check_view_value(const iobuf& view, const bytes& data) {
+    BOOST_REQUIRE(iobuf_to_bytes(view) == data);
+}
+
+template<typename T, typename Tag>
+static void check_view_value(const iobuf& view, const named_type<T, Tag>& data) {
+    check_view_value(view, data());
+}
+
+template<typename V, view_encoding E, typename T>
+static void check_view_value(array_view<V, E>& view, const std::vector<T>& data) {
+    BOOST_REQUIRE_EQUAL(view.size(), data.size());
+    size_t i = 0;
+    for (auto& e : view) {
+        BOOST_REQUIRE_LT(i, data.size());
+        check_view_value(e, data[i++]);
+    }
+    BOOST_REQUIRE_EQUAL(i, data.size());
+}
+
+template<typename V, typename T>
+static void check_view_value(std::optional<V>& view, const std::optional<T>& data) {
+    BOOST_REQUIRE_EQUAL(view.has_value(), data.has_value());
+    if (data) {
+        check_view_value(*view, *data);
+    }
+}
+
+template<typename T>
+static void check_view_records(const std::optional<iobuf>& view, const T& data) {
+    BOOST_REQUIRE_EQUAL(view.has_value(), data.has_value());
+    BOOST_REQUIRE_EQUAL(response_writer::size_of(view), response_writer::size_of(data));
+}
+{%- for struct in struct.structs() + [struct] %}
+
+static void check_view_value({{ struct.name }}_view& view, const {{ struct.name }}& data) {
+{%- for field in struct.fields %}
+    {{ field.view_checker }}(view.{{ field.name }}, data.{{ field.name }});
+{%- endfor %}
+}
+{%- endfor %}
+{%- endif %}
+
+// {{ struct.name }} encoded by kafka_schemata.py in each valid version
+{%- for kind in ["empty", "populated"] %}
+static const std::vector<std::vector<uint8_t>> python_{{ kind }} = {
+{%- for data in python_encoded[kind] %}
+    {
+{%- for line in cpp_bytes(data) %}
+        {{ line }}
+{%- endfor %}
+    },
+{%- endfor %}
+};
+{%- endfor %}
+
+static void check_roundtrip(
+  {{ struct.name }}& data, api_version version, const std::vector<uint8_t>& python) {
+    auto expected = data.encoded_size(version);
+    iobuf buf;
+    response_writer writer(buf);
+    data.encode(writer, version);
+    BOOST_REQUIRE_EQUAL(expected, buf.size_bytes());
+
+    // the python codecs must encode the same bytes, which the checks below
+    // then decode with the C++ codec
+    iobuf python_buf;
+    python_buf.append(python.data(), python.size());
+    BOOST_REQUIRE(buf == python_buf);
+
+    {{ struct.name }} decoded;
+{%- if op_type == "request" %}
+    request_reader reader(buf.copy());
+    decoded.decode(reader, version);
+{%- else %}
+    decoded.decode(buf.copy(), version);
+{%- endif %}
+{%- if view %}
+
+    // the view type must consume exactly the encoded message and hold the
+    // same values as the owning type. this runs before the owning type is
+    // re-encoded below, which moves its records out.
+    {
+        request_reader view_reader(buf.copy());
+        {{ struct.name }}_view view;
+        view.decode(view_reader, version);
+        BOOST_REQUIRE_EQUAL(view_reader.bytes_left(), 0);
+        check_view_value(view, decoded);
+    }
+    {
+        request_reader view_reader(buf.copy());
+        {{ struct.name }}_view::skip(view_reader, version);
+        BOOST_REQUIRE_EQUAL(view_reader.bytes_left(), 0);
+    }
+{% endif %}
+    BOOST_REQUIRE_EQUAL(decoded.encoded_size(version), expected);
+    iobuf rebuf;
+    response_writer rewriter(rebuf);
+    decoded.encode(rewriter, version);
+    BOOST_REQUIRE(rebuf == buf);
+}
+
+SEASTAR_THREAD_TEST_CASE({{ struct.name }}_roundtrip) {
+    for (api_version version({{ versions.min }}); version <= api_version({{ versions.max }}); ++version) {
+        BOOST_TEST_CHECKPOINT("version " << version);
+        auto index = static_cast<size_t>(version() - {{ versions.min }});
+        {{ struct.name }} empty;
+        check_roundtrip(empty, version, python_empty.at(index));
+
+        {{ struct.name }} populated;
+        populate(populated);
+        check_roundtrip(populated, version, python_populated.at(index));
+    }
+}
+
+}
+"""
+
+BENCH_TEMPLATE = """
+#include "kafka/protocol/schemata/{{ header }}"
+
+#include "kafka/protocol/request_reader.h"
+#include "kafka/protocol/response_writer.h"
+#include "random/generators.h"
+
+#include <seastar/testing/perf_tests.hh>
+
+namespace kafka {
+{%- set structs = struct.structs() + [struct] %}
+{%- if structs | map(attribute="fields") | sum(start=[]) | selectattr("is_array") | list %}
+
+// number of elements in each populated array
+static constexpr size_t elements = 8;
+{%- endif %}
+
+{%- for struct in structs %}
+
+static void populate({{ struct.name }}& v) {
+{%- for field in struct.fields %}
+{%- if field.is_array %}
+{%- if field.nullable() %}
+    v.{{ field.name }}.emplace(elements);
+    for (auto& e : *v.{{ field.name }}) {
+{%- else %}
+    v.{{ field.name }}.resize(elements);
+    for (auto& e : v.{{ field.name }}) {
+{%- endif %}
+{%- if field.type().value_type().is_struct %}
+        populate(e);
+{%- else %}
+        e = {{ field.random_value }};
+{%- endif %}
+    }
+{%- elif field.random_value %}
+    v.{{ field.name }} = {{ field.random_value }};
+{%- endif %}
+{%- endfor %}
+}
+{%- endfor %}
+
+static void decode_message({{ struct.name }}& data, iobuf buf, api_version version) {
+{%- if op_type == "request" %}
+    request_reader reader(std::move(buf));
+    data.decode(reader, version);
+{%- else %}
+    data.decode(std::move(buf), version);
+{%- endif %}
+}
+
+static void bench_encode(api_version version) {
+    {{ struct.name }} data;
+    populate(data);
+    iobuf buf;
+    response_writer writer(buf);
+    perf_tests::start_measuring_time();
+    data.encode(writer, version);
+    perf_tests::do_not_optimize(buf);
+    perf_tests::stop_measuring_time();
+}
+
+static void bench_decode(api_version version) {
+    {{ struct.name }} data;
+    populate(data);
+    iobuf buf;
+    response_writer writer(buf);
+    data.encode(writer, version);
+    {{ struct.name }} decoded;
+    perf_tests::start_measuring_time();
+    decode_message(decoded, std::move(buf), version);
+    perf_tests::do_not_optimize(decoded);
+    perf_tests::stop_measuring_time();
+}
+
+static void bench_roundtrip(api_version version) {
+    {{ struct.name }} data;
+    populate(data);
+    {{ struct.name }} decoded;
+    perf_tests::start_measuring_time();
+    iobuf buf;
+    response_writer writer(buf);
+    data.encode(writer, version);
+    decode_message(decoded, std::move(buf), version);
+    perf_tests::do_not_optimize(decoded);
+    perf_tests::stop_measuring_time();
+}
+
+{%- for version in range(versions.min, versions.max + 1) %}
+
+PERF_TEST({{ struct.name }}, encode_v{{ version }}) {
+    bench_encode(api_version({{ version }}));
+}
+
+PERF_TEST({{ struct.name }}, decode_v{{ version }}) {
+    bench_decode(api_version({{ version }}));
+}
+
+PERF_TEST({{ struct.name }}, roundtrip_v{{ version }}) {
+    bench_roundtrip(api_version({{ version }}));
+}
+{%- endfor %}
 
 }
 """
@@ -764,13 +1443,28 @@ SOURCE_TEMPLATE = """
 #include "cluster/types.h"
 #include "kafka/protocol/response_writer.h"
 #include "kafka/protocol/request_reader.h"
+{%- if instrument %}
+#include "kafka/protocol/codec_probe.h"
+{%- endif %}
 
 #include <fmt/core.h>
 #include <fmt/format.h>
 #include <fmt/ostream.h>
 
-{% macro version_guard(field) %}
-{%- set cond = field.versions().guard() %}
+{%- macro reserve(struct) %}
+{%- if not struct.has_records() %}
+    writer.reserve_memory(encoded_size(version));
+{%- endif %}
+{%- endmacro %}
+
+{%- macro probe_scope(op, stream) %}
+{%- if instrument %}
+    codec_probe_scope probe(api_key({{ api_key }}), version, codec_probe::op::{{ op }}, {{ stream }});
+{%- endif %}
+{%- endmacro %}
+
+{% macro version_guard(field, bounds) %}
+{%- set cond = field.versions().guard(bounds) %}
 {%- if cond %}
 if ({{ cond }}) {
 {{- caller() | indent }}
@@ -780,47 +1474,57 @@ if ({{ cond }}) {
 {%- endif %}
 {%- endmacro %}
 
-{% macro field_encoder(field, obj) %}
+{% macro field_encoder(field, obj, bounds) %}
 {%- if obj %}
 {%- set fname = obj + "." + field.name %}
 {%- else %}
 {%- set fname = field.name %}
 {%- endif %}
+{%- set compact = "compact_" if bounds.flexible else "" %}
 {%- if field.is_array %}
 {%- if field.nullable() %}
-writer.write_nullable_array({{ fname }}, [version]({{ field.value_type }}& v, response_writer& writer) {
+writer.write_nullable_{{ compact }}array({{ fname }}, [version]({{ field.value_type }}& v, response_writer& writer) {
 {%- else %}
-writer.write_array({{ fname }}, [version]({{ field.value_type }}& v, response_writer& writer) {
+writer.write_{{ compact }}array({{ fname }}, [version]({{ field.value_type }}& v, response_writer& writer) {
 {%- endif %}
 {%- if field.type().value_type().is_struct %}
-{{- struct_serde(field.type().value_type(), field_encoder, "v") | indent }}
+{{- struct_serde(field.type().value_type(), field_encoder, tagged_encoder, "v", bounds) | indent }}
+{%- elif bounds.flexible and field.is_compact %}
+    writer.write_compact(v);
 {%- else %}
     writer.write(v);
 {%- endif %}
 });
+{%- elif bounds.flexible and field.is_compact %}
+writer.write_compact({{ fname }});
 {%- else %}
 writer.write({{ fname }});
 {%- endif %}
 {%- endmacro %}
 
-{% macro field_decoder(field, obj) %}
+{% macro field_decoder(field, obj, bounds) %}
 {%- if obj %}
 {%- set fname = obj + "." + field.name %}
 {%- else %}
 {%- set fname = field.name %}
 {%- endif %}
+{%- set compact = "compact_" if bounds.flexible else "" %}
 {%- if field.is_array %}
 {%- if field.nullable() %}
-{{ fname }} = reader.read_nullable_array([version](request_reader& reader) {
+{{ fname }} = reader.read_nullable_{{ compact }}array([version](request_reader& reader) {
 {%- else %}
-{{ fname }} = reader.read_array([version](request_reader& reader) {
+{{ fname }} = reader.read_{{ compact }}array([version](request_reader& reader) {
 {%- endif %}
 {%- if field.type().value_type().is_struct %}
     {{ field.type().value_type().name }} v;
-{{- struct_serde(field.type().value_type(), field_decoder, "v") | indent }}
+{{- struct_serde(field.type().value_type(), field_decoder, tagged_decoder, "v", bounds) | indent }}
     return v;
 {%- else %}
+{%- if bounds.flexible %}
+{%- set decoder, named_type = field.flexible_decoder %}
+{%- else %}
 {%- set decoder, named_type = field.decoder %}
+{%- endif %}
 {%- if named_type == None %}
     return reader.{{ decoder }};
 {%- elif field.nullable() %}
@@ -837,7 +1541,11 @@ writer.write({{ fname }});
 {%- endif %}
 });
 {%- else %}
+{%- if bounds.flexible %}
+{%- set decoder, named_type = field.flexible_decoder %}
+{%- else %}
 {%- set decoder, named_type = field.decoder %}
+{%- endif %}
 {%- if named_type == None %}
 {{ fname }} = reader.{{ decoder }};
 {%- elif field.nullable() %}
@@ -857,33 +1565,237 @@ writer.write({{ fname }});
 {%- endif %}
 {%- endmacro %}
 
-{% macro struct_serde(struct, field_serde, obj = "") %}
-{%- for field in struct.fields %}
-{%- call version_guard(field) %}
-{{- field_serde(field, obj) }}
-{%- endcall %}
+{%- macro tagged_encoder(struct, obj, bounds) %}
+{%- set tagged = struct.tagged_fields(bounds) %}
+{%- if tagged %}
+{
+    tagged_fields tags;
+{%- for field in tagged %}
+{%- if obj %}
+{%- set fname = obj + "." + field.name %}
+{%- else %}
+{%- set fname = field.name %}
+{%- endif %}
+    if ({{ field.tagged_guard(bounds, fname) }}) {
+        iobuf buf;
+        response_writer writer(buf);
+{{- field_encoder(field, obj, bounds) | indent(8) }}
+        tags.emplace_back({{ field.tag }}, std::move(buf));
+    }
 {%- endfor %}
-{%- endmacro %}
-
-namespace kafka {
-
-{%- if struct.fields %}
-void {{ struct.name }}::encode(response_writer& writer, [[maybe_unused]] api_version version) {
-{{- struct_serde(struct, field_encoder) | indent }}
-}
-
-{%- if op_type == "request" %}
-void {{ struct.name }}::decode(request_reader& reader, [[maybe_unused]] api_version version) {
-{{- struct_serde(struct, field_decoder) | indent }}
+    writer.write_tagged_fields(std::move(tags));
 }
 {%- else %}
-void {{ struct.name }}::decode(iobuf buf, [[maybe_unused]] api_version version) {
-    request_reader reader(std::move(buf));
-
-{{- struct_serde(struct, field_decoder) | indent }}
-}
+writer.write_tagged_fields({});
 {%- endif %}
-{%- else %}
+{%- endmacro %}
+
+{%- macro tagged_decoder(struct, obj, bounds) %}
+{%- set tagged = struct.tagged_fields(bounds) %}
+{%- if tagged %}
+reader.read_tagged_fields([&](uint32_t tag, request_reader& reader) {
+    switch (tag) {
+{%- for field in tagged %}
+    case {{ field.tag }}:
+{{- field_decoder(field, obj, bounds) | indent(8) }}
+        break;
+{%- endfor %}
+    }
+});
+{%- else %}
+reader.skip_tagged_fields();
+{%- endif %}
+{%- endmacro %}
+
+{%- macro field_sizer(field, obj, bounds) %}
+{%- if field.is_array %}
+{%- set array_compact = "compact_" if bounds.flexible else "" %}
+{%- if field.nullable() %}
+size += response_writer::nullable_{{ array_compact }}array_size_of({{ field.name }}, [version](const {{ field.value_type }}& v) {
+{%- else %}
+size += response_writer::{{ array_compact }}array_size_of({{ field.name }}, [version](const {{ field.value_type }}& v) {
+{%- endif %}
+{%- if field.type().value_type().is_struct %}
+    return v.encoded_size(version);
+{%- elif bounds.flexible and field.is_compact %}
+    return response_writer::compact_size_of(v);
+{%- else %}
+    return response_writer::size_of(v);
+{%- endif %}
+});
+{%- elif bounds.flexible and field.is_compact %}
+size += response_writer::compact_size_of({{ field.name }});
+{%- else %}
+size += response_writer::size_of({{ field.name }});
+{%- endif %}
+{%- endmacro %}
+
+{%- macro tagged_sizer(struct, obj, bounds) %}
+{%- set tagged = struct.tagged_fields(bounds) %}
+{%- if tagged %}
+{
+    uint32_t tags = 0;
+    size_t tagged_size = 0;
+{%- for field in tagged %}
+    if ({{ field.tagged_guard(bounds, field.name) }}) {
+        size_t size = 0;
+{{- field_sizer(field, obj, bounds) | indent(8) }}
+        tagged_size += response_writer::tagged_field_size_of({{ field.tag }}, size);
+        ++tags;
+    }
+{%- endfor %}
+    size += unsigned_vint::vint_size(tags) + tagged_size;
+}
+{%- else %}
+size += unsigned_vint::vint_size(0);
+{%- endif %}
+{%- endmacro %}
+
+{% macro struct_serde(struct, field_serde, tagged_serde, obj, bounds) %}
+{%- for field in struct.fields if field.versions().overlaps(bounds) and not field.is_tagged(bounds) %}
+{%- call version_guard(field, bounds) %}
+{{- field_serde(field, obj, bounds) }}
+{%- endcall %}
+{%- endfor %}
+{%- if bounds.flexible %}
+{{- tagged_serde(struct, obj, bounds) }}
+{%- endif %}
+{%- endmacro %}
+
+{#- render one body per entry of codec_bodies, selected by version #}
+{%- macro codec_bodies_serde(struct, field_serde, tagged_serde) %}
+{%- if bodies | length == 1 %}
+{{- struct_serde(struct, field_serde, tagged_serde, "", bodies[0][1]) }}
+{%- else %}
+{%- for cond, bounds in bodies %}
+{%- set body = struct_serde(struct, field_serde, tagged_serde, "", bounds) %}
+{%- if loop.first %}
+if ({{ cond }}) {
+{%- elif cond %}
+} else if ({{ cond }}) {
+{%- elif body %}
+} else {
+{%- endif %}
+{{- body | indent }}
+{%- endfor %}
+}
+{%- endif %}
+{%- endmacro %}
+
+{%- macro view_field_decoder(field, obj, bounds) %}
+{%- if field.is_array %}
+auto [{{ field.name }}_buf, {{ field.name }}_len] = reader.share_array([version](request_reader& reader) {
+    {{- view_element_skipper(field) | indent }}
+});
+{%- if field.nullable() %}
+if ({{ field.name }}_len >= 0) {
+    {{ field.name }}.emplace(std::move({{ field.name }}_buf), {{ field.name }}_len, version);
+}
+{%- else %}
+{{ field.name }} = {{ field.view_type }}(std::move({{ field.name }}_buf), {{ field.name }}_len, version);
+{%- endif %}
+{%- else %}
+{{ field.name }} = {{ field.view_decoder }};
+{%- endif %}
+{%- endmacro %}
+
+{%- macro view_element_skipper(field) %}
+{%- if field.type().value_type().is_struct %}
+{{ field.view_element_type }}::skip(reader, version);
+{%- else %}
+{{ field.view_skipper }};
+{%- endif %}
+{%- endmacro %}
+
+{%- macro view_field_skipper(field, obj, bounds) %}
+{%- if field.is_array %}
+reader.skip_array([version](request_reader& reader) {
+    {{- view_element_skipper(field) | indent }}
+});
+{%- else %}
+{{ field.view_skipper }};
+{%- endif %}
+{%- endmacro %}
+
+{#- one case per valid version. versions without a case use the fallback #}
+{%- macro specialized_serde(struct, field_serde, tagged_serde, fallback) %}
+{%- set cases = [] %}
+{%- for v, bounds in specialized %}
+{%- if cases.append((v, struct_serde(struct, field_serde, tagged_serde, "", bounds))) %}{% endif %}
+{%- endfor %}
+switch (version()) {
+{%- for v, body in cases %}
+{%- if not loop.last and body == loop.nextitem[1] %}
+case {{ v }}:
+{%- else %}
+case {{ v }}: {
+{{- body | indent }}
+    break;
+}
+{%- endif %}
+{%- endfor %}
+default:
+{%- if fallback %}
+    {{ fallback }}
+{%- else %}
+{{- codec_bodies_serde(struct, field_serde, tagged_serde) | indent }}
+{%- endif %}
+}
+{%- endmacro %}
+
+namespace kafka {
+
+{%- if struct.fields or bodies[0][1].flexible %}
+{%- if specialized %}
+void {{ struct.name }}::encode(response_writer& writer, api_version version) {
+{{- probe_scope("encode", "writer") }}
+{{- reserve(struct) }}
+{{- specialized_serde(struct, field_encoder, tagged_encoder, "encode_guarded(writer, version);") | indent }}
+}
+
+{%- if op_type == "request" %}
+void {{ struct.name }}::decode(request_reader& reader, api_version version) {
+{{- probe_scope("decode", "reader") }}
+{{- specialized_serde(struct, field_decoder, tagged_decoder, "decode_guarded(reader, version);") | indent }}
+}
+{%- else %}
+void {{ struct.name }}::decode(iobuf buf, api_version version) {
+    request_reader reader(std::move(buf));
+{{- probe_scope("decode", "reader") }}
+
+{{- specialized_serde(struct, field_decoder, tagged_decoder, "decode_guarded(reader, version);") | indent }}
+}
+{%- endif %}
+
+void {{ struct.name }}::encode_guarded(response_writer& writer, [[maybe_unused]] api_version version) {
+{{- codec_bodies_serde(struct, field_encoder, tagged_encoder) | indent }}
+}
+
+void {{ struct.name }}::decode_guarded(request_reader& reader, [[maybe_unused]] api_version version) {
+{{- codec_bodies_serde(struct, field_decoder, tagged_decoder) | indent }}
+}
+{%- else %}
+void {{ struct.name }}::encode(response_writer& writer, [[maybe_unused]] api_version version) {
+{{- probe_scope("encode", "writer") }}
+{{- reserve(struct) }}
+{{- codec_bodies_serde(struct, field_encoder, tagged_encoder) | indent }}
+}
+
+{%- if op_type == "request" %}
+void {{ struct.name }}::decode(request_reader& reader, [[maybe_unused]] api_version version) {
+{{- probe_scope("decode", "reader") }}
+{{- codec_bodies_serde(struct, field_decoder, tagged_decoder) | indent }}
+}
+{%- else %}
+void {{ struct.name }}::decode(iobuf buf, [[maybe_unused]] api_version version) {
+    request_reader reader(std::move(buf));
+{{- probe_scope("decode", "reader") }}
+
+{{- codec_bodies_serde(struct, field_decoder, tagged_decoder) | indent }}
+}
+{%- endif %}
+{%- endif %}
+{%- else %}
 {%- if op_type == "request" %}
 void {{ struct.name }}::encode(response_writer&, api_version) {}
 void {{ struct.name }}::decode(request_reader&, api_version) {}
@@ -893,7 +1805,35 @@ void {{ struct.name }}::decode(iobuf, api_version) {}
 {%- endif %}
 {%- endif %}
 
+{%- if view %}
+{%- for struct in struct.structs() + [struct] %}
+
+void {{ struct.name }}_view::decode(request_reader& reader, [[maybe_unused]] api_version version) {
+{{- struct_serde(struct, view_field_decoder, None, "", bodies[0][1]) | indent }}
+}
+
+void {{ struct.name }}_view::skip(request_reader& reader, [[maybe_unused]] api_version version) {
+{{- struct_serde(struct, view_field_skipper, None, "", bodies[0][1]) | indent }}
+}
+{%- endfor %}
+{%- endif %}
+
 {% set structs = struct.structs() + [struct] %}
+{%- for struct in structs %}
+{%- if struct.fields or bodies[0][1].flexible %}
+size_t {{ struct.name }}::encoded_size([[maybe_unused]] api_version version) const {
+    size_t size = 0;
+{%- if specialized %}
+{{- specialized_serde(struct, field_sizer, tagged_sizer, None) | indent }}
+{%- else %}
+{{- codec_bodies_serde(struct, field_sizer, tagged_sizer) | indent }}
+{%- endif %}
+    return size;
+}
+{%- else %}
+size_t {{ struct.name }}::encoded_size(api_version) const { return 0; }
+{%- endif %}
+{% endfor %}
 {% for struct in structs %}
 {%- if struct.fields %}
 std::ostream& operator<<(std::ostream& o, const {{ struct.name }}& v) {
@@ -914,6 +1854,581 @@ std::ostream& operator<<(std::ostream& o, const {{ struct.name }}&) {
 }
 """
 
+CODEC_VERSIONS_TEMPLATE = """
+#pragma once
+
+#include <array>
+#include <cstdint>
+
+namespace kafka {
+
+// the versions of an api with generated codecs, over its request and response
+struct codec_api_versions {
+    int16_t key;
+    int16_t min_version;
+    int16_t max_version;
+};
+
+inline constexpr std::array<codec_api_versions, {{ apis | length }}> codec_apis{ {
+{%- for key, (min_version, max_version) in apis %}
+  {{ "{" }}{{ key }}, {{ min_version }}, {{ max_version }}{{ "}" }},
+{%- endfor %}
+} };
+
+// one past the largest api key and version with generated codecs
+inline constexpr int16_t codec_api_key_limit = {{ key_limit }};
+inline constexpr int16_t codec_api_version_limit = {{ version_limit }};
+
+} // namespace kafka
+"""
+
+PYTHON_TEMPLATE = '''
+# Generated by generator.py from the kafka message schemata. Do not edit.
+"""
+Pure python encoders and decoders for every kafka api and version described
+by the schemata. Messages are dicts keyed by the snake case field names, the
+same names used by the generated C++ structs, and records are passed through
+as raw bytes.
+
+Runs of fixed size fields are packed and unpacked by one precompiled
+struct.Struct and arrays of fixed size values are handled in bulk rather than
+per element.
+
+random_message() builds messages with random field values in the same form,
+for tools that generate protocol traffic.
+"""
+import collections
+import functools
+import random
+import string
+import struct
+
+_INT16 = struct.Struct(">h")
+_INT32 = struct.Struct(">i")
+_REQUEST_HEADER = struct.Struct(">hhi")
+{%- for fmt in formats %}
+_S_{{ fmt | replace("?", "o") }} = struct.Struct(">{{ fmt }}")
+{%- endfor %}
+
+
+@functools.lru_cache(maxsize=None)
+def _array_struct(fmt, n):
+    return struct.Struct(">" + fmt * n)
+
+
+def _write_uvarint(buf, v):
+    while v >= 0x80:
+        buf.append((v & 0x7f) | 0x80)
+        v >>= 7
+    buf.append(v)
+
+
+def _read_uvarint(data, o):
+    v = 0
+    shift = 0
+    while True:
+        b = data[o]
+        o += 1
+        v |= (b & 0x7f) << shift
+        if b < 0x80:
+            return v, o
+        shift += 7
+
+
+def _write_len(buf, v):
+    buf += _INT32.pack(len(v))
+
+
+def _write_nullable_len(buf, v):
+    buf += _INT32.pack(-1 if v is None else len(v))
+
+
+def _write_compact_len(buf, v):
+    _write_uvarint(buf, len(v) + 1)
+
+
+def _write_nullable_compact_len(buf, v):
+    _write_uvarint(buf, 0 if v is None else len(v) + 1)
+
+
+def _read_len(data, o):
+    return _INT32.unpack_from(data, o)[0], o + 4
+
+
+_read_nullable_len = _read_len
+
+
+def _read_compact_len(data, o):
+    n, o = _read_uvarint(data, o)
+    return n - 1, o
+
+
+_read_nullable_compact_len = _read_compact_len
+
+
+def _write_string(buf, v):
+    v = v.encode("utf-8")
+    buf += _INT16.pack(len(v))
+    buf += v
+
+
+def _write_nullable_string(buf, v):
+    if v is None:
+        buf += _INT16.pack(-1)
+    else:
+        _write_string(buf, v)
+
+
+def _write_compact_string(buf, v):
+    v = v.encode("utf-8")
+    _write_uvarint(buf, len(v) + 1)
+    buf += v
+
+
+def _write_nullable_compact_string(buf, v):
+    if v is None:
+        buf.append(0)
+    else:
+        _write_compact_string(buf, v)
+
+
+def _read_string(data, o):
+    n = _INT16.unpack_from(data, o)[0]
+    o += 2
+    return str(data[o:o + n], "utf-8"), o + n
+
+
+def _read_nullable_string(data, o):
+    n = _INT16.unpack_from(data, o)[0]
+    if n < 0:
+        return None, o + 2
+    o += 2
+    return str(data[o:o + n], "utf-8"), o + n
+
+
+def _read_compact_string(data, o):
+    n, o = _read_uvarint(data, o)
+    n -= 1
+    return str(data[o:o + n], "utf-8"), o + n
+
+
+def _read_nullable_compact_string(data, o):
+    n, o = _read_uvarint(data, o)
+    if n == 0:
+        return None, o
+    n -= 1
+    return str(data[o:o + n], "utf-8"), o + n
+
+
+def _write_bytes(buf, v):
+    buf += _INT32.pack(len(v))
+    buf += v
+
+
+def _write_nullable_bytes(buf, v):
+    if v is None:
+        buf += _INT32.pack(-1)
+    else:
+        _write_bytes(buf, v)
+
+
+def _write_compact_bytes(buf, v):
+    _write_uvarint(buf, len(v) + 1)
+    buf += v
+
+
+def _write_nullable_compact_bytes(buf, v):
+    if v is None:
+        buf.append(0)
+    else:
+        _write_compact_bytes(buf, v)
+
+
+def _read_bytes(data, o):
+    n = _INT32.unpack_from(data, o)[0]
+    o += 4
+    return bytes(data[o:o + n]), o + n
+
+
+def _read_nullable_bytes(data, o):
+    n = _INT32.unpack_from(data, o)[0]
+    if n < 0:
+        return None, o + 4
+    o += 4
+    return bytes(data[o:o + n]), o + n
+
+
+def _read_compact_bytes(data, o):
+    n, o = _read_uvarint(data, o)
+    n -= 1
+    return bytes(data[o:o + n]), o + n
+
+
+def _read_nullable_compact_bytes(data, o):
+    n, o = _read_uvarint(data, o)
+    if n == 0:
+        return None, o
+    n -= 1
+    return bytes(data[o:o + n]), o + n
+
+
+def _write_tagged_fields(buf, fields):
+    _write_uvarint(buf, len(fields))
+    for tag, data in fields:
+        _write_uvarint(buf, tag)
+        _write_uvarint(buf, len(data))
+        buf += data
+
+
+def _skip_tagged_fields(data, o):
+    n, o = _read_uvarint(data, o)
+    for _ in range(n):
+        _, o = _read_uvarint(data, o)
+        size, o = _read_uvarint(data, o)
+        o += size
+    return o
+
+
+_RANDOM_FIXED = {
+    "?": lambda r: r.random() < 0.5,
+    "b": lambda r: r.randint(-2**7, 2**7 - 1),
+    "h": lambda r: r.randint(-2**15, 2**15 - 1),
+    "i": lambda r: r.randint(-2**31, 2**31 - 1),
+    "q": lambda r: r.randint(-2**63, 2**63 - 1),
+}
+
+
+def _random_null(r, nullable):
+    return nullable and r.random() < 0.1
+
+
+def _random_string(r, nullable):
+    if _random_null(r, nullable):
+        return None
+    return "".join(
+        r.choice(string.printable) for _ in range(r.randint(0, 50)))
+
+
+def _random_bytes(r, nullable):
+    if _random_null(r, nullable):
+        return None
+    return bytes(r.getrandbits(8) for _ in range(r.randint(0, 256)))
+
+
+def _random_records(r, records, nullable):
+    if records is None:
+        return None if nullable else b""
+    return records(r)
+
+
+def _random_array(r, nullable, element):
+    if _random_null(r, nullable):
+        return None
+    return [element() for _ in range(r.randint(0, 10))]
+
+{%- macro random_value(op) -%}
+{%- if op.kind == "fixed" -%}
+_RANDOM_FIXED["{{ op.fmt }}"](r)
+{%- elif op.kind == "array" -%}
+_random_array(r, {{ op.nullable }}, lambda: {{ random_element(op) }})
+{%- elif op.records -%}
+_random_records(r, records, {{ op.nullable }})
+{%- else -%}
+_random_{{ op.kind }}(r, {{ op.nullable }})
+{%- endif -%}
+{%- endmacro %}
+
+{%- macro random_element(op) -%}
+{%- if op.element == "fixed" -%}
+_RANDOM_FIXED["{{ op.fmt }}"](r)
+{%- elif op.element == "struct" -%}
+_rand_{{ op.layout }}(r, records)
+{%- elif op.element == "string" -%}
+_random_string(r, False)
+{%- else -%}
+_random_bytes(r, False)
+{%- endif -%}
+{%- endmacro %}
+
+{%- macro encode_value(op, v, buf) %}
+{%- if op.kind == "fixed" %}
+{{ buf }} += _S_{{ op.fmt | replace("?", "o") }}.pack({{ v }})
+{%- elif op.kind == "array" %}
+{{ op.writer }}({{ buf }}, {{ v }})
+{%- if op.nullable %}
+if {{ v }} is not None:
+{{- encode_elements(op, v, buf) | indent(4) }}
+{%- else %}
+{{- encode_elements(op, v, buf) }}
+{%- endif %}
+{%- else %}
+{{ op.writer }}({{ buf }}, {{ v }})
+{%- endif %}
+{%- endmacro %}
+
+{%- macro encode_elements(op, v, buf) %}
+{%- if op.element == "fixed" %}
+{{ buf }} += _array_struct("{{ op.fmt }}", len({{ v }})).pack(*{{ v }})
+{%- elif op.element == "struct" and op.fixed %}
+{{ buf }} += _array_struct("{{ op.fixed.fmt }}", len({{ v }})).pack(
+    *[x for e in {{ v }} for x in {{ python_tuple(python_format('e["{}"]', op.fixed.names)) }}])
+{%- elif op.element == "struct" %}
+for e in {{ v }}:
+    _enc_{{ op.layout }}({{ buf }}, e)
+{%- else %}
+for e in {{ v }}:
+    {{ op.element_writer }}({{ buf }}, e)
+{%- endif %}
+{%- endmacro %}
+
+{%- macro decode_value(op, t) %}
+{%- if op.kind == "fixed" %}
+{{ t }}, = _S_{{ op.fmt | replace("?", "o") }}.unpack_from(data, o)
+o += {{ op.size }}
+{%- elif op.kind == "array" %}
+n, o = {{ op.reader }}(data, o)
+{%- if op.nullable %}
+if n < 0:
+    {{ t }} = None
+else:
+{{- decode_elements(op, t) | indent(4) }}
+{%- else %}
+{{- decode_elements(op, t) }}
+{%- endif %}
+{%- else %}
+{{ t }}, o = {{ op.reader }}(data, o)
+{%- endif %}
+{%- endmacro %}
+
+{%- macro decode_elements(op, t) %}
+{%- if op.element == "fixed" %}
+{{ t }} = list(_array_struct("{{ op.fmt }}", n).unpack_from(data, o))
+o += {{ op.size }} * n
+{%- elif op.element == "struct" and op.fixed %}
+{%- set values = python_format("t{}", range(op.fixed.names | length)) %}
+end = o + {{ op.fixed.size }} * n
+{{ t }} = [dict(zip({{ python_tuple(python_format('"{}"', op.fixed.names)) }}, {{ python_tuple(values) }}))
+    for {{ values | join(", ") }}{{ "," if values | length == 1 }} in _S_{{ op.fixed.fmt | replace("?", "o") }}.iter_unpack(data[o:end])]
+o = end
+{%- else %}
+v = []
+for _ in range(n):
+{%- if op.element == "struct" %}
+    e, o = _dec_{{ op.layout }}(data, o)
+{%- else %}
+    e, o = {{ op.element_reader }}(data, o)
+{%- endif %}
+    v.append(e)
+{{ t }} = v
+{%- endif %}
+{%- endmacro %}
+{%- for codec in codecs %}
+{%- for name, (ops, tagged, flexible) in codec.layouts.items() %}
+
+
+def _enc_{{ name }}(buf, m):
+{%- for op in ops %}
+{%- if op.kind == "fixed" %}
+{%- set fields = python_format('m["{}"]', op.names) %}
+    buf += _S_{{ op.fmt | replace("?", "o") }}.pack({{ fields | join(", ") }})
+{%- elif op.kind == "array" %}
+    v = m["{{ op.names[0] }}"]
+{{- encode_value(op, "v", "buf") | indent(4) }}
+{%- else %}
+    {{ op.writer }}(buf, m["{{ op.names[0] }}"])
+{%- endif %}
+{%- endfor %}
+{%- if flexible and tagged %}
+    tagged = []
+{%- for tag, op, default_value in tagged %}
+    v = m.get("{{ op.names[0] }}", {{ default_value }})
+    if v != {{ default_value }}:
+        tb = bytearray()
+{{- encode_value(op, "v", "tb") | indent(8) }}
+        tagged.append(({{ tag }}, tb))
+{%- endfor %}
+    _write_tagged_fields(buf, tagged)
+{%- elif flexible %}
+    buf.append(0)
+{%- elif not ops %}
+    pass
+{%- endif %}
+
+
+def _dec_{{ name }}(data, o):
+    m = {}
+{%- for op in ops %}
+{%- if op.kind == "fixed" %}
+{%- set fields = python_format('m["{}"]', op.names) %}
+    {{ python_tuple(fields) }} = _S_{{ op.fmt | replace("?", "o") }}.unpack_from(data, o)
+    o += {{ op.size }}
+{%- else %}
+{{- decode_value(op, 'm["' ~ op.names[0] ~ '"]') | indent(4) }}
+{%- endif %}
+{%- endfor %}
+{%- if flexible and tagged %}
+{%- for tag, op, default_value in tagged %}
+    m["{{ op.names[0] }}"] = {{ default_value }}
+{%- endfor %}
+    count, o = _read_uvarint(data, o)
+    for _ in range(count):
+        tag, o = _read_uvarint(data, o)
+        size, o = _read_uvarint(data, o)
+{%- for tag, op, default_value in tagged %}
+        {% if not loop.first %}el{% endif %}if tag == {{ tag }}:
+{{- decode_value(op, 'm["' ~ op.names[0] ~ '"]') | indent(12) }}
+{%- endfor %}
+        else:
+            o += size
+{%- elif flexible %}
+    o = _skip_tagged_fields(data, o)
+{%- endif %}
+    return m, o
+
+
+def _rand_{{ name }}(r, records):
+    return {
+{%- for op in ops %}
+{%- if op.kind == "fixed" %}
+{%- for field in op.names %}
+        "{{ field }}": _RANDOM_FIXED["{{ op.fmt[loop.index0] }}"](r),
+{%- endfor %}
+{%- else %}
+        "{{ op.names[0] }}": {{ random_value(op) }},
+{%- endif %}
+{%- endfor %}
+{%- if flexible %}
+{%- for tag, op, default_value in tagged %}
+        "{{ op.names[0] }}": {{ random_value(op) }},
+{%- endfor %}
+{%- endif %}
+    }
+{%- endfor %}
+{%- endfor %}
+
+
+_Codec = collections.namedtuple("_Codec", [
+    "name", "min_version", "max_version", "flexible_min", "encoders",
+    "decoders", "randoms"
+])
+
+_CODECS = {
+{%- for codec in codecs %}
+    ({{ codec.api_key }}, "{{ codec.op_type }}"): _Codec(
+        "{{ codec.name }}", {{ codec.min_version }}, {{ codec.max_version }},
+        {{ codec.flexible_min }},
+        {{ python_tuple(python_format("_enc_{}", codec.versions)) }},
+        {{ python_tuple(python_format("_dec_{}", codec.versions)) }},
+        {{ python_tuple(python_format("_rand_{}", codec.versions)) }}),
+{%- endfor %}
+}
+
+# responses to api versions requests always use header v0 so that clients can
+# parse them before they know which versions the broker supports
+_API_VERSIONS_KEY = 18
+
+
+def _codec(api_key, kind, version):
+    codec = _CODECS.get((api_key, kind))
+    if codec is None:
+        raise ValueError(f"Unsupported {kind} api key {api_key}")
+    if not codec.min_version <= version <= codec.max_version:
+        raise ValueError(f"Unsupported {codec.name} version {version}")
+    return codec
+
+
+def _flexible(codec, version):
+    return codec.flexible_min is not None and version >= codec.flexible_min
+
+
+def encode(api_key, kind, version, msg):
+    """
+    Encode the body of a "request" or "response" message.
+    """
+    codec = _codec(api_key, kind, version)
+    buf = bytearray()
+    codec.encoders[version - codec.min_version](buf, msg)
+    return bytes(buf)
+
+
+def decode(api_key, kind, version, data):
+    """
+    Decode the body of a "request" or "response" message.
+    """
+    codec = _codec(api_key, kind, version)
+    msg, o = codec.decoders[version - codec.min_version](data, 0)
+    if o != len(data):
+        raise ValueError(f"{len(data) - o} trailing bytes after {codec.name}")
+    return msg
+
+
+def encode_request(api_key, version, correlation_id, client_id, msg):
+    """
+    Encode a size prefixed request frame.
+    """
+    codec = _codec(api_key, "request", version)
+    buf = bytearray(4)
+    buf += _REQUEST_HEADER.pack(api_key, version, correlation_id)
+    _write_nullable_string(buf, client_id)
+    if _flexible(codec, version):
+        buf.append(0)
+    codec.encoders[version - codec.min_version](buf, msg)
+    _INT32.pack_into(buf, 0, len(buf) - 4)
+    return bytes(buf)
+
+
+def decode_request(data):
+    """
+    Decode a request frame without its size prefix. Returns the api key,
+    version, correlation id, client id and message.
+    """
+    api_key, version, correlation_id = _REQUEST_HEADER.unpack_from(data, 0)
+    codec = _codec(api_key, "request", version)
+    client_id, o = _read_nullable_string(data, _REQUEST_HEADER.size)
+    if _flexible(codec, version):
+        o = _skip_tagged_fields(data, o)
+    msg, o = codec.decoders[version - codec.min_version](data, o)
+    return api_key, version, correlation_id, client_id, msg
+
+
+def encode_response(api_key, version, correlation_id, msg):
+    """
+    Encode a size prefixed response frame.
+    """
+    codec = _codec(api_key, "response", version)
+    buf = bytearray(4)
+    buf += _INT32.pack(correlation_id)
+    if _flexible(codec, version) and api_key != _API_VERSIONS_KEY:
+        buf.append(0)
+    codec.encoders[version - codec.min_version](buf, msg)
+    _INT32.pack_into(buf, 0, len(buf) - 4)
+    return bytes(buf)
+
+
+def decode_response(api_key, version, data):
+    """
+    Decode a response frame without its size prefix. Returns the correlation
+    id and message.
+    """
+    codec = _codec(api_key, "response", version)
+    correlation_id = _INT32.unpack_from(data, 0)[0]
+    o = _INT32.size
+    if _flexible(codec, version) and api_key != _API_VERSIONS_KEY:
+        o = _skip_tagged_fields(data, o)
+    msg, o = codec.decoders[version - codec.min_version](data, o)
+    return correlation_id, msg
+
+
+def random_message(api_key, kind, version, rng=random, records=None):
+    """
+    Build a "request" or "response" message with random field values. Record
+    fields are built by calling `records` with `rng`, since random bytes are
+    not a valid record batch. Without it they are left null or empty.
+    """
+    codec = _codec(api_key, kind, version)
+    return codec.randoms[version - codec.min_version](rng, records)
+'''
+
 # This is the schema of the json files from the kafka tree. This isn't strictly
 # necessary for the code generator, but it is useful. The schema verification
 # performed on our input files from kafka is _very_ strict. Since the json files
@@ -1048,44 +2563,488 @@ def render_struct_comment(struct):
     return f"/*\n{comment} */"
 
 
+# struct module format and size of the fixed size primitive types in the
+# generated python codecs
+python_fixed_types = dict(bool=("?", 1),
+                          int8=("b", 1),
+                          int16=("h", 2),
+                          int32=("i", 4),
+                          int64=("q", 8))
+
+# redpanda types whose default constructed value is neither zero nor the
+# minimum of an integral named type (see python_type_defaults)
+python_special_defaults = {
+    "model::timestamp": "-1",  # model::timestamp::missing()
+}
+
+
+def mapped_integral_types():
+    """
+    The redpanda types over an integral wire type in the type maps, with
+    their wire type.
+    """
+    def walk(mapping):
+        for value in mapping.values():
+            if isinstance(value, dict):
+                yield from walk(value)
+            else:
+                yield value
+
+    types = itertools.chain(walk(path_type_map), entity_type_map.values(),
+                            field_name_type_map.items())
+    res = {}
+    for key, value in types:
+        if isinstance(key, tuple):
+            # field_name_type_map is keyed by (wire type, field name)
+            (wire_type, _), name = key, value[0]
+        else:
+            name, wire_type = key, value
+        if re.fullmatch(r"int\d+", wire_type):
+            res[name] = wire_type
+    return res
+
+
+@functools.lru_cache(maxsize=None)
+def python_type_defaults():
+    """
+    The values that the redpanda types in the type maps default construct to,
+    where that isn't zero, used as the python defaults of fields without a
+    default in their schema. An integral named type (utils/named_type.h)
+    starts at the minimum of its type. Named types are found by their
+    declaration in the headers of their namespace under src/v.
+    """
+    src = pathlib.Path(__file__).resolve().parents[3]
+    defaults = dict(python_special_defaults)
+    for name, wire_type in mapped_integral_types().items():
+        namespace, _, type_name = name.rpartition("::")
+        if name in defaults or not namespace:
+            continue
+        pattern = re.compile(r"using\s+" + re.escape(type_name) +
+                             r"\s*=\s*named_type<\s*int(\d+)_t\b")
+        for header in sorted((src / namespace).glob("*.h")):
+            match = pattern.search(header.read_text())
+            if match:
+                defaults[name] = str(-2**(int(match.group(1)) - 1))
+                break
+    return defaults
+
+
+# one step of a generated python encoder or decoder:
+#
+#    fixed: a run of fixed size fields (names) packed by one struct.Struct
+#    string, bytes: a single field read and written by reader / writer
+#    array: an array whose length is read and written by reader / writer and
+#        whose elements are fixed size values (fmt, size), strings or bytes
+#        (element_reader / element_writer) or structs (layout, plus fixed if
+#        the struct is a single fixed run that can be packed in bulk)
+PythonOp = collections.namedtuple("PythonOp", [
+    "kind", "names", "fmt", "size", "reader", "writer", "nullable", "element",
+    "element_reader", "element_writer", "layout", "fixed", "records"
+],
+                                  defaults=(None, ) * 11)
+
+
+def python_default(field):
+    """
+    Python literal for the default value of a field.
+    """
+    if field.nullable():
+        return "None"
+    if field.is_array:
+        return "[]"
+    wire_type = field._wire_type()[0]
+    default_value = field.default_value()
+    # schemata give defaults either as json values or as strings
+    if wire_type == "bool":
+        return "True" if str(default_value).lower() == "true" else "False"
+    if wire_type in python_fixed_types:
+        if default_value == "":
+            return python_type_defaults().get(field.type_name[0], "0")
+        return str(int(str(default_value), 0))
+    if wire_type == "string":
+        return repr(default_value)
+    return "b''"
+
+
+def python_message(struct, populated):
+    """
+    The python codecs' dict for the struct that the generated tests build in
+    C++: default constructed, or filled in by their populate().
+    """
+    msg = {}
+    for field in struct.fields:
+        value = ast.literal_eval(python_default(field))
+        if populated and field.is_array:
+            if field.type().value_type().is_struct:
+                value = [
+                    python_message(field.type().value_type(), True)
+                    for _ in range(2)
+                ]
+            elif field.python_sample_value is not None:
+                value = [field.python_sample_value] * 2
+        elif populated and field.python_sample_value is not None:
+            value = field.python_sample_value
+        msg[field.name] = value
+    return msg
+
+
+def cpp_bytes(data):
+    """
+    The lines of a C++ initializer list holding `data`.
+    """
+    return textwrap.wrap(", ".join(f"0x{b:02x}" for b in data), 72)
+
+
+def python_codec(kind, nullable, compact):
+    """
+    Names of the runtime helpers reading and writing a string, bytes or array
+    length in the generated python module.
+    """
+    name = ("_nullable" if nullable else "") + \
+        ("_compact" if compact else "") + f"_{kind}"
+    return f"_read{name}", f"_write{name}"
+
+
+def python_format(pattern, items):
+    return [pattern.format(item) for item in items]
+
+
+def python_tuple(items):
+    return "(" + ", ".join(items) + ("," if len(items) == 1 else "") + ")"
+
+
+class PythonCodec:
+    """
+    The python encoders and decoders of one message. Each struct gets one
+    layout, a list of PythonOp followed by the tagged fields in flexible
+    versions, per distinct encoding across the valid versions so that versions
+    which encode a struct the same way share the generated functions.
+    """
+    def __init__(self, msg, struct, valid_versions, flexible_versions):
+        self.name = struct.name
+        self.api_key = msg["apiKey"]
+        self.op_type = msg["type"]
+        self.min_version = valid_versions.min
+        self.max_version = valid_versions.max
+        self.flexible_min = None
+        if flexible_versions is not None:
+            self.flexible_min = flexible_versions.min
+        self.layouts = {}
+        self._names = {}
+        self.versions = [
+            self._layout(struct, v, self._flexible(v))
+            for v in range(valid_versions.min, valid_versions.max + 1)
+        ]
+
+    def _flexible(self, version):
+        return self.flexible_min is not None and version >= self.flexible_min
+
+    def _layout(self, struct, version, flexible):
+        """
+        Register the layout of `struct` in `version` and return its name.
+        """
+        bounds = VersionBounds(version, version, flexible)
+        ops = []
+        tagged = []
+        for field in struct.fields:
+            if not field.versions().overlaps(bounds):
+                continue
+            op = self._field_op(field, version, flexible)
+            if field.is_tagged(bounds):
+                tagged.append((field.tag, op, python_default(field)))
+                continue
+            if op.kind == "fixed" and ops and ops[-1].kind == "fixed":
+                prev = ops.pop()
+                op = prev._replace(names=prev.names + op.names,
+                                   fmt=prev.fmt + op.fmt,
+                                   size=prev.size + op.size)
+            ops.append(op)
+        tagged.sort(key=lambda t: t[0])
+        key = (struct.name, tuple(ops), tuple(tagged), flexible)
+        if key not in self._names:
+            name = f"{struct.name}_{len(self.layouts)}"
+            self._names[key] = name
+            self.layouts[name] = (ops, tagged, flexible)
+        return self._names[key]
+
+    def _fixed_layout(self, name):
+        """
+        The fixed run of a layout made of fixed size fields only, or None.
+        """
+        ops, tagged, flexible = self.layouts[name]
+        if len(ops) == 1 and ops[0].kind == "fixed" and not flexible:
+            return ops[0]
+        return None
+
+    def _field_op(self, field, version, flexible):
+        if field.is_array:
+            reader, writer = python_codec("len", field.nullable(), flexible)
+            op = PythonOp("array", (field.name, ),
+                          reader=reader,
+                          writer=writer,
+                          nullable=field.nullable())
+            value_type = field.type().value_type()
+            if value_type.is_struct:
+                layout = self._layout(value_type, version, flexible)
+                return op._replace(element="struct",
+                                   layout=layout,
+                                   fixed=self._fixed_layout(layout))
+            wire_type = field._wire_type()[0]
+            if wire_type in python_fixed_types:
+                fmt, size = python_fixed_types[wire_type]
+                return op._replace(element="fixed", fmt=fmt, size=size)
+            reader, writer = python_codec(wire_type, False, flexible)
+            return op._replace(element=wire_type,
+                               element_reader=reader,
+                               element_writer=writer)
+        wire_type = field._wire_type()[0]
+        if wire_type in python_fixed_types:
+            fmt, size = python_fixed_types[wire_type]
+            return PythonOp("fixed", (field.name, ), fmt, size)
+        # records are passed through as raw bytes
+        kind = "string" if wire_type == "string" else "bytes"
+        nullable = field.nullable() or wire_type not in basic_type_map \
+            or basic_type_map[wire_type][1] is None
+        reader, writer = python_codec(kind, nullable, flexible)
+        return PythonOp(kind, (field.name, ),
+                        reader=reader,
+                        writer=writer,
+                        nullable=nullable,
+                        records=field.is_records)
+
+
+def write_if_changed(path, content):
+    """
+    Write `content` to `path` unless the file already holds the same content.
+    Leaving unchanged outputs untouched keeps their timestamps so that build
+    systems do not recompile them. The content is written to a temporary file
+    in the same directory and renamed over `path`, so an interrupted run never
+    leaves a truncated output behind. Returns True if the file was written.
+    """
+    data = content.encode("utf-8")
+    try:
+        with open(path, "rb") as f:
+            current = hashlib.sha256(f.read()).digest()
+        if current == hashlib.sha256(data).digest():
+            return False
+    except FileNotFoundError:
+        pass
+    path = pathlib.Path(path)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.chmod(tmp, 0o666 & ~_umask())
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return True
+
+
+def _umask():
+    mask = os.umask(0)
+    os.umask(mask)
+    return mask
+
+
+class Generator:
+    """
+    Renders schemata to C++. The templates and the schema validator are built
+    once so that many schemata can be processed by one run. With `instrument`
+    the top level encode and decode functions record their calls, bytes and
+    cycles in kafka::codec_probe.
+    """
+    def __init__(self, outdir, instrument=False):
+        self.outdir = outdir
+        self.instrument = instrument
+        self.header_template = jinja2.Template(HEADER_TEMPLATE)
+        self.source_template = jinja2.Template(SOURCE_TEMPLATE)
+        self.test_template = jinja2.Template(TEST_TEMPLATE)
+        self.bench_template = jinja2.Template(BENCH_TEMPLATE)
+        self.codec_versions_template = jinja2.Template(CODEC_VERSIONS_TEMPLATE)
+        self.python_template = jinja2.Template(PYTHON_TEMPLATE)
+        self.python_codecs = []
+        self.api_versions = {}
+        validator = jsonschema.validators.validator_for(SCHEMA)
+        validator.check_schema(SCHEMA)
+        self.validator = validator(SCHEMA)
+
+    def generate(self, schema_path):
+        """
+        Generate the header, source, test and benchmark for one schema.
+        Returns the paths of the outputs whose content changed.
+        """
+        src = (self.outdir / schema_path.name).with_suffix(".cc")
+        hdr = (self.outdir / schema_path.name).with_suffix(".h")
+        test = self.outdir / f"{schema_path.stem}_test.cc"
+        bench = self.outdir / f"{schema_path.stem}_bench.cc"
+
+        # remove comments from the json file. comments are a non-standard json
+        # extension that is not supported by the python json parser.
+        schema = io.StringIO()
+        with open(schema_path, "r") as f:
+            for line in f.readlines():
+                line = re.sub("\/\/.*", "", line)
+                if line.strip():
+                    schema.write(line)
+
+        # parse json and verify its schema.
+        msg = json.loads(schema.getvalue())
+        self.validator.validate(msg)
+
+        # the root struct in the schema corresponds to the root type in
+        # redpanda. but its naming in snake case will conflict with our high
+        # level request and response types so arrange for a "_data" suffix to
+        # be generated.
+        type_name = f"{msg['name']}Data"
+        struct = StructType(type_name, msg["fields"], (type_name, ))
+
+        # request or response
+        op_type = msg["type"]
+
+        valid_versions = VersionRange(msg["validVersions"])
+        # codec_versions.h covers both the request and response versions
+        low, high = self.api_versions.get(
+            msg["apiKey"], (valid_versions.min, valid_versions.max))
+        self.api_versions[msg["apiKey"]] = (min(low, valid_versions.min),
+                                            max(high, valid_versions.max))
+        flexible_versions = None
+        if msg["flexibleVersions"] != "none":
+            flexible_versions = VersionRange(msg["flexibleVersions"])
+
+        bodies = codec_bodies(flexible_versions, struct.tagged_versions())
+
+        specialized = None
+        if msg["name"] in specialized_messages:
+            specialized = version_bodies(valid_versions, flexible_versions)
+
+        view = msg["name"] in view_messages
+        if view and flexible_versions is not None:
+            raise Exception(f"View types do not support flexible versions "
+                            f"of {msg['name']}")
+
+        python_codec = PythonCodec(msg, struct, valid_versions,
+                                   flexible_versions)
+        self.python_codecs.append(python_codec)
+
+        outputs = [
+            (hdr,
+             self.header_template.render(
+                 struct=struct,
+                 render_struct_comment=render_struct_comment,
+                 op_type=op_type,
+                 specialized=specialized,
+                 view=view)),
+            (src,
+             self.source_template.render(struct=struct,
+                                         header=hdr.name,
+                                         op_type=op_type,
+                                         api_key=msg["apiKey"],
+                                         instrument=self.instrument,
+                                         bodies=bodies,
+                                         specialized=specialized,
+                                         view=view)),
+            (test,
+             self.test_template.render(struct=struct,
+                                       header=hdr.name,
+                                       op_type=op_type,
+                                       versions=valid_versions,
+                                       view=view,
+                                       python_encoded=self.python_encoded(
+                                           python_codec, struct),
+                                       cpp_bytes=cpp_bytes)),
+            (bench,
+             self.bench_template.render(struct=struct,
+                                        header=hdr.name,
+                                        op_type=op_type,
+                                        versions=valid_versions)),
+        ]
+        return [
+            path for path, content in outputs
+            if write_if_changed(path, content)
+        ]
+
+    def python_encoded(self, codec, struct):
+        """
+        Encode the messages of the generated tests, default constructed and
+        populated, in each valid version with the python codec of one message.
+        The C++ tests check that the C++ codec produces the same bytes. Each
+        encoding must also decode and encode again to the same bytes with the
+        python codec, or the run fails.
+        """
+        module = {}
+        exec(compile(self.render_python([codec]), "kafka_schemata.py", "exec"),
+             module)
+        encode, decode = module["encode"], module["decode"]
+        encoded = {}
+        for populated in (False, True):
+            msg = python_message(struct, populated)
+            vectors = []
+            for version in range(codec.min_version, codec.max_version + 1):
+                data = bytes(encode(codec.api_key, codec.op_type, version,
+                                    msg))
+                decoded = decode(codec.api_key, codec.op_type, version, data)
+                again = encode(codec.api_key, codec.op_type, version, decoded)
+                if bytes(again) != data:
+                    raise Exception(f"python codec of {codec.name} version "
+                                    f"{version} does not round trip")
+                vectors.append(data)
+            encoded["populated" if populated else "empty"] = vectors
+        return encoded
+
+    def render_python(self, codecs):
+        """
+        Render the python codecs module for `codecs`.
+        """
+        codecs = sorted(codecs, key=lambda c: (c.api_key, c.op_type))
+        formats = set()
+        for codec in codecs:
+            for ops, tagged, _ in codec.layouts.values():
+                for op in ops + [t[1] for t in tagged]:
+                    if op.kind == "fixed":
+                        formats.add(op.fmt)
+        return self.python_template.render(codecs=codecs,
+                                           formats=sorted(formats),
+                                           python_format=python_format,
+                                           python_tuple=python_tuple)
+
+    def generate_codec_versions(self):
+        """
+        Generate codec_versions.h, the api keys and versions of all of the
+        schemata processed so far. Returns True if its content changed.
+        """
+        apis = sorted(self.api_versions.items())
+        content = self.codec_versions_template.render(
+            apis=apis,
+            key_limit=max(key for key, _ in apis) + 1,
+            version_limit=max(v[1] for _, v in apis) + 1)
+        return write_if_changed(self.outdir / "codec_versions.h", content)
+
+    def generate_python(self):
+        """
+        Generate the python codecs module for all of the schemata processed
+        so far. Returns True if its content changed.
+        """
+        return write_if_changed(self.outdir / "kafka_schemata.py",
+                                self.render_python(self.python_codecs))
+
+
 if __name__ == "__main__":
-    assert len(sys.argv) == 3
-    outdir = pathlib.Path(sys.argv[1])
-    schema_path = pathlib.Path(sys.argv[2])
-    src = (outdir / schema_path.name).with_suffix(".cc")
-    hdr = (outdir / schema_path.name).with_suffix(".h")
-
-    # remove comments from the json file. comments are a non-standard json
-    # extension that is not supported by the python json parser.
-    schema = io.StringIO()
-    with open(schema_path, "r") as f:
-        for line in f.readlines():
-            line = re.sub("\/\/.*", "", line)
-            if line.strip():
-                schema.write(line)
-
-    # parse json and verify its schema.
-    msg = json.loads(schema.getvalue())
-    jsonschema.validate(instance=msg, schema=SCHEMA)
-
-    # the root struct in the schema corresponds to the root type in redpanda.
-    # but its naming in snake case will conflict with our high level request and
-    # response types so arrange for a "_data" suffix to be generated.
-    type_name = f"{msg['name']}Data"
-    struct = StructType(type_name, msg["fields"], (type_name, ))
-
-    # request or response
-    op_type = msg["type"]
-
-    with open(hdr, 'w') as f:
-        f.write(
-            jinja2.Template(HEADER_TEMPLATE).render(
-                struct=struct,
-                render_struct_comment=render_struct_comment,
-                op_type=op_type))
-
-    with open(src, 'w') as f:
-        f.write(
-            jinja2.Template(SOURCE_TEMPLATE).render(struct=struct,
-                                                    header=hdr.name,
-                                                    op_type=op_type))
+    # all schemata are generated by a single run, which also writes the api
+    # versions in codec_versions.h and the kafka_schemata.py python codecs
+    # module. outputs whose content did not change are left untouched.
+    parser = argparse.ArgumentParser(
+        description="Generate kafka message codecs")
+    parser.add_argument("--instrument",
+                        action="store_true",
+                        help="record codec calls, bytes and cycles per api "
+                        "key and version in kafka::codec_probe")
+    parser.add_argument("outdir", type=pathlib.Path)
+    parser.add_argument("schemata", type=pathlib.Path, nargs="+")
+    args = parser.parse_args()
+    generator = Generator(args.outdir, instrument=args.instrument)
+    for schema_path in args.schemata:
+        generator.generate(schema_path)
+    generator.generate_codec_versions()
+    generator.generate_python()
@@ -0,0 +1,178 @@
+// Copyright 2021 Vectorized, Inc.
+//
+// Use of this software is governed by the Business Source License
+// included in the file licenses/BSL.md
+//
+// As of the Change Date specified in that file, in accordance with
+// the Business Source License, use of this software will be governed
+// by the Apache License, Version 2.0
+
+#include "kafka/protocol/request_reader.h"
+#include "kafka/protocol/response_writer.h"
+#include "kafka/protocol/schemata/fetch_request.h"
+#include "kafka/protocol/schemata/metadata_response.h"
+#include "kafka/protocol/schemata/produce_response.h"
+
+#include <seastar/testing/perf_tests.hh>
+
+// compares the per-version specialized codecs of the hot apis against the
+// version guarded codecs that the other messages use
+
+static constexpr size_t topics = 50;
+static constexpr size_t partitions = 20;
+
+static kafka::metadata_response_data make_metadata_response() {
+    kafka::metadata_response_data data;
+    for (int i = 0; i < 5; ++i) {
+        data.brokers.push_back(kafka::metadata_response_broker{
+          .node_id = model::node_id(i),
+          .host = ss::sstring("broker.local"),
+          .port = 9092,
+          .rack = ss::sstring("rack")});
+    }
+    data.cluster_id = ss::sstring("cluster");
+    for (size_t t = 0; t < topics; ++t) {
+        kafka::metadata_response_topic topic{
+          .name = model::topic(ss::sstring("topic-") + ss::to_sstring(t))};
+        for (size_t p = 0; p < partitions; ++p) {
+            topic.partitions.push_back(kafka::metadata_response_partition{
+              .partition_index = model::partition_id(p),
+              .leader_id = model::node_id(p % 5),
+              .replica_nodes = {model::node_id(0), model::node_id(1)},
+              .isr_nodes = {model::node_id(0), model::node_id(1)}});
+        }
+        data.topics.push_back(std::move(topic));
+    }
+    return data;
+}
+
+static kafka::produce_response_data make_produce_response() {
+    kafka::produce_response_data data;
+    for (size_t t = 0; t < topics; ++t) {
+        kafka::topic_produce_response topic{
+          .name = model::topic(ss::sstring("topic-") + ss::to_sstring(t))};
+        for (size_t p = 0; p < partitions; ++p) {
+            topic.partitions.push_back(kafka::partition_produce_response{
+              .partition_index = model::partition_id(p),
+              .base_offset = model::offset(p * 100)});
+        }
+        data.responses.push_back(std::move(topic));
+    }
+    return data;
+}
+
+static kafka::fetch_request_data make_fetch_request() {
+    kafka::fetch_request_data data;
+    for (size_t t = 0; t < topics; ++t) {
+        kafka::fetch_topic topic{
+          .name = model::topic(ss::sstring("topic-") + ss::to_sstring(t))};
+        for (size_t p = 0; p < partitions; ++p) {
+            topic.fetch_partitions.push_back(kafka::fetch_partition{
+              .partition_index = model::partition_id(p),
+              .fetch_offset = model::offset(p * 100)});
+        }
+        data.topics.push_back(std::move(topic));
+    }
+    return data;
+}
+
+template<typename T, typename Encode>
+static void encode_bench(T data, kafka::api_version version, Encode encode) {
+    iobuf buf;
+    kafka::response_writer writer(buf);
+    perf_tests::start_measuring_time();
+    encode(data, writer, version);
+    perf_tests::do_not_optimize(buf);
+    perf_tests::stop_measuring_time();
+}
+
+template<typename T>
+static iobuf encode(T data, kafka::api_version version) {
+    iobuf buf;
+    kafka::response_writer writer(buf);
+    data.encode(writer, version);
+    return buf;
+}
+
+template<typename T, typename Decode>
+static void
+decode_bench(const iobuf& buf, kafka::api_version version, Decode decode) {
+    T data;
+    auto in = buf.copy();
+    perf_tests::start_measuring_time();
+    decode(data, std::move(in), version);
+    perf_tests::do_not_optimize(data);
+    perf_tests::stop_measuring_time();
+}
+
+static const auto specialized_encode =
+  [](auto& data, kafka::response_writer& writer, kafka::api_version version) {
+      data.encode(writer, version);
+  };
+
+static const auto guarded_encode =
+  [](auto& data, kafka::response_writer& writer, kafka::api_version version) {
+      data.encode_guarded(writer, version);
+  };
+
+static const auto request_decode =
+  [](auto& data, iobuf buf, kafka::api_version version) {
+      kafka::request_reader reader(std::move(buf));
+      data.decode(reader, version);
+  };
+
+static const auto response_decode =
+  [](auto& data, iobuf buf, kafka::api_version version) {
+      data.decode(std::move(buf), version);
+  };
+
+static const auto guarded_decode =
+  [](auto& data, iobuf buf, kafka::api_version version) {
+      kafka::request_reader reader(std::move(buf));
+      data.decode_guarded(reader, version);
+  };
+
+PERF_TEST(metadata_response, encode_specialized) {
+    encode_bench(
+      make_metadata_response(), kafka::api_version(8), specialized_encode);
+}
+
+PERF_TEST(metadata_response, encode_guarded) {
+    encode_bench(
+      make_metadata_response(), kafka::api_version(8), guarded_encode);
+}
+
+PERF_TEST(metadata_response, decode_specialized) {
+    static const auto buf = encode(
+      make_metadata_response(), kafka::api_version(8));
+    decode_bench<kafka::metadata_response_data>(
+      buf, kafka::api_version(8), response_decode);
+}
+
+PERF_TEST(metadata_response, decode_guarded) {
+    static const auto buf = encode(
+      make_metadata_response(), kafka::api_version(8));
+    decode_bench<kafka::metadata_response_data>(
+      buf, kafka::api_version(8), guarded_decode);
+}
+
+PERF_TEST(produce_response, encode_specialized) {
+    encode_bench(
+      make_produce_response(), kafka::api_version(7), specialized_encode);
+}
+
+PERF_TEST(produce_response, encode_guarded) {
+    encode_bench(make_produce_response(), kafka::api_version(7), guarded_encode);
+}
+
+PERF_TEST(fetch_request, decode_specialized) {
+    static const auto buf = encode(make_fetch_request(), kafka::api_version(11));
+    decode_bench<kafka::fetch_request_data>(
+      buf, kafka::api_version(11), request_decode);
+}
+
+PERF_TEST(fetch_request, decode_guarded) {
+    static const auto buf = encode(make_fetch_request(), kafka::api_version(11));
+    decode_bench<kafka::fetch_request_data>(
+      buf, kafka::api_version(11), guarded_decode);
+}
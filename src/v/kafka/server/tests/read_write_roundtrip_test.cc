@@ -7,6 +7,7 @@
 // the Business Source License, use of this software will be governed
 // by the Apache License, Version 2.0
 
+#include "kafka/protocol/kafka_batch_adapter.h"
 #include "kafka/protocol/request_reader.h"
 #include "kafka/protocol/response_writer.h"
 #include "random/generators.h"
@@ -50,3 +51,14 @@ SEASTAR_THREAD_TEST_CASE(write_and_read_value_test) {
     roundtrip_test(
       model::topic{"test_topic"}, ss::sstring, &request_reader::read_string);
 }
+
+SEASTAR_THREAD_TEST_CASE(write_record_data_without_batch) {
+    // e.g. a record set that the batch adapter could not convert
+    std::optional<produce_request_record_data> data(
+      std::in_place, std::optional<iobuf>(), api_version(3));
+    auto out = iobuf();
+    kafka::response_writer w(out);
+    BOOST_REQUIRE_EQUAL(w.write(data), response_writer::size_of(data));
+    kafka::request_reader r(std::move(out));
+    BOOST_REQUIRE_EQUAL(r.read_int32(), -1);
+}
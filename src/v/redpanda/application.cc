@@ -26,6 +26,9 @@
 #include "config/endpoint_tls_config.h"
 #include "config/seed_server.h"
 #include "kafka/client/configuration.h"
+#ifdef KAFKA_CODEC_PROBE
+#include "kafka/protocol/codec_probe.h"
+#endif
 #include "kafka/server/coordinator_ntp_mapper.h"
 #include "kafka/server/group_manager.h"
 #include "kafka/server/group_router.h"
@@ -216,6 +219,12 @@ void application::setup_metrics() {
         return;
     }
 
+#ifdef KAFKA_CODEC_PROBE
+    ss::smp::invoke_on_all([] {
+        kafka::codec_probe::local().setup_metrics();
+    }).get();
+#endif
+
     namespace sm = ss::metrics;
 
     // build info
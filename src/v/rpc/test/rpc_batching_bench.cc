@@ -0,0 +1,65 @@
+// Copyright 2021 Vectorized, Inc.
+//
+// Use of this software is governed by the Business Source License
+// included in the file licenses/BSL.md
+//
+// As of the Change Date specified in that file, in accordance with
+// the Business Source License, use of this software will be governed
+// by the Apache License, Version 2.0
+
+#include "model/timeout_clock.h"
+#include "rpc/test/rpc_integration_fixture.h"
+#include "rpc/types.h"
+
+#include <seastar/core/loop.hh>
+#include <seastar/testing/perf_tests.hh>
+
+#include <boost/range/irange.hpp>
+
+// compares concurrent calls of a batched method against the same calls sent
+// one frame each
+
+static constexpr size_t concurrent_calls = 1000;
+
+struct batching_bench_fixture : rpc_integration_fixture {
+    batching_bench_fixture()
+      : client(client_config()) {
+        configure_server();
+        register_services();
+        start_server();
+        client.connect(model::no_timeout).get();
+    }
+
+    ~batching_bench_fixture() override { client.stop().get(); }
+
+    template<typename Func>
+    ss::future<> run(Func f) {
+        return ss::parallel_for_each(
+          boost::irange<size_t>(0, concurrent_calls),
+          [f = std::move(f)](size_t) {
+              return f(echo::echo_req{.str = "ping"})
+                .then([](result<rpc::client_context<echo::echo_resp>> r) {
+                    if (!r) {
+                        throw std::system_error(r.error());
+                    }
+                    perf_tests::do_not_optimize(r.value().data);
+                });
+          });
+    }
+
+    rpc::client<echo::echo_client_protocol> client;
+};
+
+PERF_TEST_F(batching_bench_fixture, echo_unbatched) {
+    return run([this](echo::echo_req r) {
+        return client.batched_echo_unbatched(
+          std::move(r), rpc::client_opts(rpc::no_timeout));
+    });
+}
+
+PERF_TEST_F(batching_bench_fixture, echo_batched) {
+    return run([this](echo::echo_req r) {
+        return client.batched_echo(
+          std::move(r), rpc::client_opts(rpc::no_timeout));
+    });
+}
@@ -89,6 +89,12 @@ struct echo_impl final : echo::echo_service {
         }
     }
 
+    ss::future<echo::echo_resp>
+    batched_echo(echo::echo_req&& req, rpc::streaming_context&) final {
+        return ss::make_ready_future<echo::echo_resp>(
+          echo::echo_resp{.str = req.str});
+    }
+
     uint64_t cnt = 0;
 };
 
@@ -182,6 +182,38 @@ transport::send(netbuf b, rpc::client_opts opts) {
     return do_send(_seq++, std::move(b), std::move(opts));
 }
 
+ss::future<>
+transport::schedule_batch_flush(uint32_t method_id, bool immediate) {
+    // the flush holds the dispatch gate so that stop() waits for the batched
+    // callers to be resolved
+    return ss::with_gate(_dispatch_gate, [this, method_id, immediate] {
+        if (immediate) {
+            return flush_batch(method_id);
+        }
+        // let the tasks that are already runnable join the batch first
+        return ss::later().then(
+          [this, method_id] { return flush_batch(method_id); });
+    });
+}
+
+ss::future<> transport::flush_batch(uint32_t method_id) {
+    auto it = _batches.find(method_id);
+    if (it == _batches.end()) {
+        // already flushed when the batch got full
+        return ss::now();
+    }
+    auto batch = std::move(it->second);
+    _batches.erase(it);
+    auto& b = *batch;
+    // errors that the send does not deliver to the callers itself, e.g. when
+    // the request cannot be registered, fail the callers of the batch here
+    return ss::futurize_invoke([this, &b, method_id] {
+               return b.send(*this, method_id);
+           })
+      .handle_exception([&b](std::exception_ptr e) { b.set_exception(e); })
+      .finally([batch = std::move(batch)] {});
+}
+
 ss::future<result<std::unique_ptr<streaming_context>>>
 transport::make_response_handler(netbuf& b, const rpc::client_opts& opts) {
     if (_correlations.find(_correlation_idx + 1) != _correlations.end()) {
@@ -29,18 +29,40 @@
 #include <seastar/core/semaphore.hh>
 #include <seastar/net/api.hh>
 #include <seastar/net/tls.hh>
+#include <seastar/util/later.hh>
 
 #include <absl/container/btree_map.h>
 #include <absl/container/flat_hash_map.h>
 #include <bits/stdint-uintn.h>
 
+#include <algorithm>
 #include <cstdint>
 #include <memory>
 #include <optional>
 #include <utility>
+#include <vector>
 
 namespace rpc {
 struct client_context_impl;
+class transport;
+
+namespace internal {
+/// type erased set of calls to the same batched method that are waiting to be
+/// sent as a single request
+class batched_call_base {
+public:
+    batched_call_base() noexcept = default;
+    batched_call_base(batched_call_base&&) noexcept = default;
+    batched_call_base& operator=(batched_call_base&&) noexcept = default;
+    batched_call_base(const batched_call_base&) = delete;
+    batched_call_base& operator=(const batched_call_base&) = delete;
+    virtual ~batched_call_base() noexcept = default;
+
+    virtual ss::future<> send(transport&, uint32_t) = 0;
+    /// fails the callers of a batch that could not be sent
+    virtual void set_exception(std::exception_ptr) = 0;
+};
+} // namespace internal
 
 class base_transport {
 public:
@@ -106,6 +128,18 @@ public:
     ss::future<result<client_context<Output>>>
       send_typed(Input, uint32_t, rpc::client_opts);
 
+    /**
+     * Coalesces concurrent calls to the same method into a single request
+     * carrying a std::vector<Input>. Calls issued before the reactor gets to
+     * run the flush task (or until max_batched_calls is reached) share one
+     * frame, the server replies with a std::vector<Output> in request order.
+     */
+    template<typename Input, typename Output>
+    ss::future<result<client_context<Output>>>
+      send_batched(Input, uint32_t, rpc::client_opts);
+
+    static constexpr size_t max_batched_calls = 1024;
+
 private:
     using sequence_t = named_type<uint64_t, struct sequence_tag>;
     using requests_queue_t
@@ -123,6 +157,9 @@ private:
     ss::future<result<std::unique_ptr<streaming_context>>>
     make_response_handler(netbuf&, const rpc::client_opts&);
 
+    ss::future<> schedule_batch_flush(uint32_t, bool immediate);
+    ss::future<> flush_batch(uint32_t);
+
     ss::semaphore _memory;
     absl::flat_hash_map<uint32_t, std::unique_ptr<internal::response_handler>>
       _correlations;
@@ -134,6 +171,9 @@ private:
      * ususally contains only few elements.
      */
     requests_queue_t _requests_queue;
+    /// batched calls that were not sent yet, keyed by the batch method id
+    absl::flat_hash_map<uint32_t, std::unique_ptr<internal::batched_call_base>>
+      _batches;
     sequence_t _seq;
     sequence_t _last_seq;
     friend std::ostream& operator<<(std::ostream&, const transport&);
@@ -199,6 +239,102 @@ transport::send_typed(Input r, uint32_t method_id, rpc::client_opts opts) {
       });
 }
 
+namespace internal {
+template<typename Input, typename Output>
+class batched_call final : public batched_call_base {
+public:
+    using ret_t = result<client_context<Output>>;
+
+    explicit batched_call(const rpc::client_opts& opts) noexcept
+      : _opts(opts.timeout, opts.compression, opts.min_compression_bytes) {}
+
+    ss::future<ret_t> add(Input r, const rpc::client_opts& opts) {
+        // the batch must not outlive the most impatient of the callers
+        _opts.timeout = std::min(_opts.timeout, opts.timeout);
+        _requests.push_back(std::move(r));
+        return _replies.emplace_back().get_future();
+    }
+
+    size_t size() const { return _requests.size(); }
+
+    ss::future<> send(transport& t, uint32_t method_id) final {
+        return t
+          .send_typed<std::vector<Input>, std::vector<Output>>(
+            std::move(_requests), method_id, std::move(_opts))
+          .then_wrapped(
+            [this](
+              ss::future<result<client_context<std::vector<Output>>>> f) {
+                try {
+                    set_replies(f.get0());
+                } catch (...) {
+                    set_exception(std::current_exception());
+                }
+            });
+    }
+
+    void set_exception(std::exception_ptr e) final {
+        for (auto& p : _replies) {
+            p.set_exception(e);
+        }
+    }
+
+private:
+    void set_replies(result<client_context<std::vector<Output>>> r) {
+        if (!r) {
+            set_error(r.error());
+            return;
+        }
+        auto& ctx = r.value();
+        if (ctx.data.size() != _replies.size()) {
+            set_error(errc::service_error);
+            return;
+        }
+        for (size_t i = 0; i < _replies.size(); ++i) {
+            client_context<Output> reply(ctx.hdr);
+            reply.data = std::move(ctx.data[i]);
+            _replies[i].set_value(ret_t(std::move(reply)));
+        }
+    }
+
+    void set_error(std::error_code ec) {
+        for (auto& p : _replies) {
+            p.set_value(ret_t(ec));
+        }
+    }
+
+    std::vector<Input> _requests;
+    std::vector<ss::promise<ret_t>> _replies;
+    rpc::client_opts _opts;
+};
+} // namespace internal
+
+template<typename Input, typename Output>
+inline ss::future<result<client_context<Output>>>
+transport::send_batched(Input r, uint32_t method_id, rpc::client_opts opts) {
+    using ret_t = result<client_context<Output>>;
+    using batch_t = internal::batched_call<Input, Output>;
+    if (_dispatch_gate.is_closed()) {
+        return ss::make_ready_future<ret_t>(errc::disconnected_endpoint);
+    }
+    auto it = _batches.find(method_id);
+    const bool created = it == _batches.end();
+    if (created) {
+        it = _batches.emplace(method_id, std::make_unique<batch_t>(opts))
+               .first;
+    }
+    auto& batch = static_cast<batch_t&>(*it->second);
+    auto f = batch.add(std::move(r), opts);
+    // the caller that starts a batch waits for its flush, and so does the
+    // caller that fills it up and flushes it right away
+    auto flush = ss::now();
+    if (batch.size() >= max_batched_calls) {
+        flush = schedule_batch_flush(method_id, true);
+    } else if (created) {
+        flush = schedule_batch_flush(method_id, false);
+    }
+    return flush.then([f = std::move(f)]() mutable { return std::move(f); });
+}
+
 // clang-format off
 CONCEPT(
 template<typename Protocol>
@@ -17,6 +17,7 @@
 #include <array>
 #include <cstdint>
 #include <iostream>
+#include <limits>
 #include <random>
 
 namespace {
@@ -31,8 +32,27 @@ void check_roundtrip_sweep(int64_t count) {
     }
 }
 
+void check_unsigned_roundtrip_sweep(uint32_t count) {
+    for (uint32_t i = 0; i < count; i += 1000) {
+        const auto b = unsigned_vint::to_bytes(i);
+        const auto view = bytes_view(b);
+        const auto [deserialized, size] = unsigned_vint::deserialize(view);
+        BOOST_REQUIRE_EQUAL(deserialized, i);
+        BOOST_REQUIRE_EQUAL(size, b.size());
+        BOOST_REQUIRE_EQUAL(b.size(), unsigned_vint::vint_size(i));
+    }
+}
+
 } // namespace
 
 SEASTAR_THREAD_TEST_CASE(sanity_signed_sweep_64) {
     check_roundtrip_sweep(100000000);
 }
+
+SEASTAR_THREAD_TEST_CASE(sanity_unsigned_sweep_32) {
+    check_unsigned_roundtrip_sweep(100000000);
+    const auto max = std::numeric_limits<uint32_t>::max();
+    const auto b = unsigned_vint::to_bytes(max);
+    BOOST_REQUIRE_EQUAL(b.size(), unsigned_vint::max_length);
+    BOOST_REQUIRE_EQUAL(unsigned_vint::deserialize(bytes_view(b)).first, max);
+}
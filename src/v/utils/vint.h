@@ -98,3 +98,49 @@ inline std::pair<int64_t, size_t> deserialize(Range&& r) noexcept {
 }
 
 } // namespace vint
+
+// unsigned varints without zigzag encoding. kafka uses these for the lengths
+// and tags of the compact encodings of flexible versions (KIP-482).
+namespace unsigned_vint {
+inline constexpr size_t max_length = 5;
+inline size_t serialize(uint32_t value, uint8_t* out) noexcept {
+    size_t bytes_used = 0;
+    while (value >= 0x80) {
+        out[bytes_used++] = static_cast<uint8_t>(value | 0x80);
+        value >>= 7;
+    }
+    out[bytes_used++] = static_cast<uint8_t>(value);
+    return bytes_used;
+}
+inline constexpr size_t vint_size(uint32_t value) noexcept {
+    size_t len = 1;
+    while (value >= 128) {
+        value >>= 7;
+        len++;
+    }
+    return len;
+}
+inline bytes to_bytes(uint32_t value) noexcept {
+    auto out = ss::uninitialized_string<bytes>(max_length);
+    auto sz = serialize(value, out.data());
+    out.resize(sz);
+    return out;
+}
+template<typename Range>
+inline std::pair<uint32_t, size_t> deserialize(Range&& r) noexcept {
+    uint32_t result = 0;
+    size_t bytes_read = 0;
+    uint32_t shift = 0;
+    for (auto src = r.begin(); shift <= 28 && src != r.end(); ++src) {
+        uint32_t byte = static_cast<uint8_t>(*src);
+        bytes_read++;
+        result |= (byte & 127) << shift;
+        if (!(byte & 128)) {
+            break;
+        }
+        shift += 7;
+    }
+    return {result, bytes_read};
+}
+
+} // namespace unsigned_vint
@@ -11,131 +11,103 @@
 #
 # pip install kafka-python
 #
+# requests are encoded by kafka_schemata.py, the python codecs that the kafka
+# codegen writes next to the generated C++ codecs. kafka-python only builds the
+# record batches carried by produce requests.
+#
+import argparse
+import importlib.util
 import random
-import functools
 import string
-from kafka.protocol import api, types, group, fetch, metadata, produce
 from kafka.record.default_records import DefaultRecordBatch, DefaultRecordBatchBuilder
 
-request_types = \
-        group.JoinGroupRequest + \
-        group.SyncGroupRequest + \
-        group.HeartbeatRequest + \
-        group.LeaveGroupRequest + \
-        [fetch.FetchRequest_v4] + \
-        metadata.MetadataRequest + \
-        [produce.ProduceRequest_v3,
-            produce.ProduceRequest_v4,
-            produce.ProduceRequest_v5]
+# api key and versions of the requests to generate
+request_versions = [
+    (11, range(0, 3)),  # join group
+    (14, range(0, 2)),  # sync group
+    (12, range(0, 2)),  # heartbeat
+    (13, range(0, 2)),  # leave group
+    (1, range(4, 5)),  # fetch
+    (3, range(0, 6)),  # metadata
+    (0, range(3, 6)),  # produce
+]
+
 
+def load_schemata(path):
+    spec = importlib.util.spec_from_file_location("kafka_schemata", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
 
-def random_int16():
-    return random.randint(-2**15, 2**15 - 1)
 
+def random_int16(r):
+    return r.randint(-2**15, 2**15 - 1)
 
-def random_int32():
-    return random.randint(-2**31, 2**31 - 1)
 
+def random_int32(r):
+    return r.randint(-2**31, 2**31 - 1)
 
-def random_int64():
-    return random.randint(-2**63, 2**63 - 1)
 
+def random_int64(r):
+    return r.randint(-2**63, 2**63 - 1)
 
-def random_string():
-    return "".join(random.choice(string.printable) for _ in range(50))
 
+def random_string(r):
+    return "".join(r.choice(string.printable) for _ in range(50))
 
-def random_bytes(allow_none=False):
-    if allow_none and random.choice((True, False)):
+
+def random_bytes(r, allow_none=False):
+    if allow_none and r.choice((True, False)):
         return None
-    return bytes(
-        bytearray(
-            random.getrandbits(8) for _ in range(random.randint(0, 256))))
+    return bytes(bytearray(r.getrandbits(8) for _ in range(r.randint(0, 256))))
 
 
-def random_record_batch():
+def random_record_batch(r):
+    # only generate a single batch per topic-partition since that is a
+    # restriction baked into the protocol for versions >= 3
     builder = DefaultRecordBatchBuilder(
         magic=2,
         compression_type=DefaultRecordBatch.CODEC_NONE,
         is_transactional=False,
         producer_id=-1,  #random_int64(), disable idempotent
-        producer_epoch=random_int16(),
-        base_sequence=random_int32(),
+        producer_epoch=random_int16(r),
+        base_sequence=random_int32(r),
         batch_size=9999999999)
 
-    builder.append(offset=random_int32(),
-                   timestamp=random_int64(),
-                   key=random_bytes(True),
-                   value=random_bytes(True),
+    builder.append(offset=random_int32(r),
+                   timestamp=random_int64(r),
+                   key=random_bytes(r, True),
+                   value=random_bytes(r, True),
                    headers=())
 
-    return builder.build()
-
-
-def random_field_value(field, req_type):
-    if field is types.Int8:
-        return random.randint(-2**7, 2**7 - 1)
-
-    elif field is types.Int16:
-        return random_int16()
-
-    elif field is types.Int32:
-        return random_int32()
-
-    elif field is types.Int64:
-        return random_int64()
+    return bytes(builder.build())
 
-    elif isinstance(field, types.String):
-        return random_string()
 
-    elif field is types.Bytes:
-        # generate a random record batch. this is a special case because record
-        # batches show up in the schema as opaque bytes. in this instance the
-        # only field of type Bytes in a produce request is the record batch.
-        if any(map(lambda t: issubclass(req_type, t), produce.ProduceRequest)):
-            # only generate a single batch per topic-partition since that is a
-            # restriction baked into the protocol for versions >= 3
-            return random_record_batch()
-
-        return random_bytes()
-
-    elif field is types.Boolean:
-        return random.choice((True, False))
-
-    elif isinstance(field, types.Array):
-        if isinstance(field.array_of, types.Schema):
-            generator = lambda: tuple(
-                map(functools.partial(random_field_value, req_type=req_type),
-                    field.array_of.fields))
-        else:
-            generator = lambda: random_field_value(field.array_of, req_type)
-        return tuple(generator() for _ in range(random.randint(0, 10)))
-
-    raise Exception("unhandled type: {}".format(field))
-
-
-def random_request():
-    req_type = random.choice(request_types)
-    req_args = map(functools.partial(random_field_value, req_type=req_type),
-                   req_type.SCHEMA.fields)
-    request = req_type(*req_args)
-    correlation_id = random_int32()
-    client_id = random_string()
-    header = api.RequestHeader(request, correlation_id, client_id)
-    return header, request
+def random_request(schemata, r):
+    api_key, versions = r.choice(request_versions)
+    version = r.choice(versions)
+    request = schemata.random_message(api_key,
+                                      "request",
+                                      version,
+                                      r,
+                                      records=random_record_batch)
+    return schemata.encode_request(api_key, version, random_int32(r),
+                                   random_string(r), request)
 
 
 if __name__ == "__main__":
     import sys
 
-    msg_count = 1
-    if len(sys.argv) > 1:
-        msg_count = int(sys.argv[1])
-
-    for _ in range(msg_count):
-        header, request = random_request()
-        message = b''.join([header.encode(), request.encode()])
-        size = types.Int32.encode(len(message))
-        payload = size + message
-
-        sys.stdout.buffer.write(payload)
+    parser = argparse.ArgumentParser(
+        description="Write random size prefixed kafka requests to stdout")
+    parser.add_argument("--schemata",
+                        required=True,
+                        help="path of the generated kafka_schemata.py")
+    parser.add_argument("--seed", type=int, help="random seed")
+    parser.add_argument("count", type=int, nargs="?", default=1)
+    options = parser.parse_args()
+
+    schemata = load_schemata(options.schemata)
+    r = random.Random(options.seed)
+    for _ in range(options.count):
+        sys.stdout.buffer.write(random_request(schemata, r))
@@ -25,6 +25,9 @@ RPC_TEMPLATE = """
 #pragma once
 
 #include "reflection/adl.h"
+{%- if batched_methods %}
+#include "reflection/std/vector.h"
+{%- endif %}
 #include "rpc/types.h"
 #include "rpc/netbuf.h"
 #include "rpc/parse_utils.h"
@@ -44,6 +47,10 @@ RPC_TEMPLATE = """
 #include <seastar/core/reactor.hh>
 #include <seastar/core/sleep.hh>
 #include <seastar/core/scheduling.hh>
+{%- if batched_methods %}
+#include <seastar/core/do_with.hh>
+#include <seastar/core/when_all.hh>
+{%- endif %}
 
 #include <functional>
 #include <chrono>
@@ -84,6 +91,9 @@ public:
        switch(idx) {
        {%- for method in methods %}
          case {{method.id}}: return &_methods[{{loop.index - 1}}];
+       {%- endfor %}
+       {%- for method in batched_methods %}
+         case {{method.batch_id}}: return &_methods[{{methods|length + loop.index - 1}}];
        {%- endfor %}
          default: return nullptr;
        }
@@ -104,13 +114,45 @@ public:
        throw std::runtime_error("unimplemented method");
     }
     {%- endfor %}
+    {%- for method in batched_methods %}
+    /// \\brief std::vector<{{method.input_type}}> -> std::vector<{{method.output_type}}>
+    ///
+    /// calls coalesced by the client are fanned out to {{method.name}}() and
+    /// the replies are returned in request order
+    virtual ss::future<rpc::netbuf>
+    raw_{{method.name}}_batch(ss::input_stream<char>& in, rpc::streaming_context& ctx) {
+      return execution_helper<std::vector<{{method.input_type}}>,
+                              std::vector<{{method.output_type}}>>::exec(in, ctx, {{method.batch_id}},
+      [this](
+          std::vector<{{method.input_type}}>&& batch, rpc::streaming_context& ctx) -> ss::future<std::vector<{{method.output_type}}>> {
+          // the handlers take their request by reference, so the batch must
+          // outlive all of the replies
+          return ss::do_with(std::move(batch), [this, &ctx](
+              std::vector<{{method.input_type}}>& batch) {
+              std::vector<ss::future<{{method.output_type}}>> replies;
+              replies.reserve(batch.size());
+              for (auto& t : batch) {
+                  replies.push_back(ss::futurize_invoke([this, &t, &ctx] {
+                      return {{method.name}}(std::move(t), ctx);
+                  }));
+              }
+              return ss::when_all_succeed(replies.begin(), replies.end());
+          });
+      });
+    }
+    {%- endfor %}
 private:
     ss::scheduling_group _sc;
     ss::smp_service_group _ssg;
-    std::array<rpc::method, {{methods|length}}> _methods{%raw %}{{{% endraw %}
+    std::array<rpc::method, {{methods|length + batched_methods|length}}> _methods{%raw %}{{{% endraw %}
       {%- for method in methods %}
       rpc::method([this] (ss::input_stream<char>& in, rpc::streaming_context& ctx) {
          return raw_{{method.name}}(in, ctx);
+      }){{ "," if not loop.last or batched_methods }}
+      {%- endfor %}
+      {%- for method in batched_methods %}
+      rpc::method([this] (ss::input_stream<char>& in, rpc::streaming_context& ctx) {
+         return raw_{{method.name}}_batch(in, ctx);
       }){{ "," if not loop.last }}
       {%- endfor %}
     {% raw %}}}{% endraw %};
@@ -124,10 +166,24 @@ public:
     virtual ~{{service_name}}_client_protocol() = default;
 
     {%- for method in methods %}
+    {%- if method.batched %}
+    /// concurrent calls are coalesced by the transport into a single
+    /// {{method.name}} batch frame
+    virtual inline ss::future<result<rpc::client_context<{{method.output_type}}>>>
+    {{method.name}}({{method.input_type}}&& r, rpc::client_opts opts) {
+       return _transport.send_batched<{{method.input_type}}, {{method.output_type}}>(std::move(r), {{method.batch_id}}, std::move(opts));
+    }
+    /// one frame per call, i.e. for peers that do not serve the batch method
+    virtual inline ss::future<result<rpc::client_context<{{method.output_type}}>>>
+    {{method.name}}_unbatched({{method.input_type}}&& r, rpc::client_opts opts) {
+       return _transport.send_typed<{{method.input_type}}, {{method.output_type}}>(std::move(r), {{method.id}}, std::move(opts));
+    }
+    {%- else %}
     virtual inline ss::future<result<rpc::client_context<{{method.output_type}}>>>
     {{method.name}}({{method.input_type}}&& r, rpc::client_opts opts) {
        return _transport.send_typed<{{method.input_type}}, {{method.output_type}}>(std::move(r), {{method.id}}, std::move(opts));
     }
+    {%- endif %}
     {%- endfor %}
 
 private:
@@ -210,8 +266,20 @@ def _enrich_methods(service):
             [m["name"], m["input_type"], m["output_type"]])
         return service["id"] ^ zlib.crc32(bytes(mid, 'utf-8'))
 
+    def _xor_batch_id(m):
+        mid = ("%s:" % service["namespace"]).join(
+            [m["name"], m["input_type"], m["output_type"], "batch"])
+        return service["id"] ^ zlib.crc32(bytes(mid, 'utf-8'))
+
     for m in service["methods"]:
         m["id"] = _xor_id(m)
+        m["batched"] = m.get("batched", False)
+        if m["batched"]:
+            m["batch_id"] = _xor_batch_id(m)
+
+    service["batched_methods"] = [
+        m for m in service["methods"] if m["batched"]
+    ]
 
     return service
 
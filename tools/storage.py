@@ -1,12 +1,56 @@
 #!/usr/bin/env python3
 import os
 import sys
+import bisect
 import collections
+import concurrent.futures
+import datetime
 import glob
+import gzip
+import hashlib
+import hmac
+import io
+import itertools
+import json
+import mmap
 import re
 import struct
 import crc32c
+import ctypes
+import ctypes.util
 import logging
+import math
+import select
+import shutil
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import xml.etree.ElementTree as ElementTree
+
+# compression libraries are only needed to decode the records of compressed
+# batches. header scans and verification work without them.
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+try:
+    import snappy
+except ImportError:
+    snappy = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+# numpy is only needed to export batch headers
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 logger = logging.getLogger('rp')
 
@@ -30,28 +74,281 @@ HDR_FMT_CRC = "hiqqqhii"
 HDR_FMT_RP = HDR_FMT_RP_PREFIX + HDR_FMT_CRC
 HEADER_SIZE = struct.calcsize(HDR_FMT_RP)
 
+# precompiled codecs used by the zero-copy scanner. the header crc covers every
+# header byte following the crc field itself, and since the on-disk layout is
+# already little endian the crc can be computed directly over the mapped bytes.
+HDR_STRUCT_RP = struct.Struct(HDR_FMT_RP)
+HDR_STRUCT_CRC_BE = struct.Struct(">" + HDR_FMT_CRC)
+HEADER_CRC_START = struct.calcsize("<I")
+
 Header = collections.namedtuple(
     'Header', ('header_crc', 'batch_size', 'base_offset', 'type', 'crc',
                'attrs', 'delta', 'first_ts', 'max_ts', 'producer_id',
                'producer_epoch', 'base_seq', 'record_count'))
 
+# model::record_batch_type of user data
+RAFT_DATA_BATCH_TYPE = 1
+
+# batch attribute bits
+ATTR_COMPRESSION_MASK = 0x07
+ATTR_LOG_APPEND_TIME = 0x08
+
+# compression codecs stored in the low attribute bits
+CODEC_NONE = 0
+CODEC_GZIP = 1
+CODEC_SNAPPY = 2
+CODEC_LZ4 = 3
+CODEC_ZSTD = 4
+CODEC_NAMES = {
+    CODEC_NONE: "none",
+    CODEC_GZIP: "gzip",
+    CODEC_SNAPPY: "snappy",
+    CODEC_LZ4: "lz4",
+    CODEC_ZSTD: "zstd",
+}
+
+# java clients wrap snappy data in the xerial framing format
+XERIAL_SNAPPY_MAGIC = b"\x82SNAPPY\x00"
+XERIAL_SNAPPY_HEADER_SIZE = 16
+
+# a decoded kafka v2 record. key, value and header keys/values are memoryviews
+# into the buffer holding the batch (or None for null keys and values).
+Record = collections.namedtuple(
+    'Record', ('offset', 'timestamp', 'attrs', 'key', 'value', 'headers'))
+
+
+def read_varint(buf, pos):
+    """
+    Decode a zig-zag encoded varint from `buf` at `pos`. Returns the value and
+    the position following the varint.
+    """
+    shift = 0
+    result = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7f) << shift
+        if not b & 0x80:
+            return (result >> 1) ^ -(result & 1), pos
+        shift += 7
+
+
+def read_varbytes(buf, pos):
+    """
+    Decode a varint length-prefixed byte string without copying it. A negative
+    length denotes null.
+    """
+    size, pos = read_varint(buf, pos)
+    if size < 0:
+        return None, pos
+    return buf[pos:pos + size], pos + size
+
+
+def batch_in_range(header,
+                   min_offset=None,
+                   max_offset=None,
+                   min_ts=None,
+                   max_ts=None):
+    """
+    Returns False if no record of the batch can fall into the given offset and
+    timestamp ranges. Used to skip batches without touching their records.
+    """
+    last_offset = header.base_offset + header.delta
+    if min_offset is not None and last_offset < min_offset:
+        return False
+    if max_offset is not None and header.base_offset > max_offset:
+        return False
+    # some clients leave max timestamp unset for single record batches
+    last_ts = max(header.first_ts, header.max_ts)
+    if min_ts is not None and last_ts < min_ts:
+        return False
+    if max_ts is not None and header.first_ts > max_ts:
+        return False
+    return True
+
+
+def decode_records(buf,
+                   header,
+                   min_offset=None,
+                   max_offset=None,
+                   min_ts=None,
+                   max_ts=None):
+    """
+    Lazily decode the kafka v2 records of a batch.
+
+    `buf` holds the uncompressed records of the batch (see
+    `Decompressor.records`). Records are yielded one at a
+    time and their keys and values are slices of `buf`. Records outside of the
+    offset and timestamp ranges are skipped using their length prefix without
+    decoding their key, value or headers.
+    """
+    log_append_time = header.attrs & ATTR_LOG_APPEND_TIME
+    pos = 0
+    for _ in range(header.record_count):
+        size, pos = read_varint(buf, pos)
+        next_pos = pos + size
+        attrs = buf[pos]
+        ts_delta, pos = read_varint(buf, pos + 1)
+        offset_delta, pos = read_varint(buf, pos)
+        offset = header.base_offset + offset_delta
+        if max_offset is not None and offset > max_offset:
+            # offsets are increasing within a batch
+            return
+        if log_append_time:
+            timestamp = header.max_ts
+        else:
+            timestamp = header.first_ts + ts_delta
+        if (min_offset is not None and offset < min_offset) or \
+           (min_ts is not None and timestamp < min_ts) or \
+           (max_ts is not None and timestamp > max_ts):
+            pos = next_pos
+            continue
+        key, pos = read_varbytes(buf, pos)
+        value, pos = read_varbytes(buf, pos)
+        count, pos = read_varint(buf, pos)
+        headers = []
+        for _ in range(count):
+            hkey, pos = read_varbytes(buf, pos)
+            hvalue, pos = read_varbytes(buf, pos)
+            headers.append((hkey, hvalue))
+        yield Record(offset, timestamp, attrs, key, value, headers)
+        pos = next_pos
+
+
+class Decompressor:
+    """
+    Inflates the records of compressed batches.
+
+    Output is written into a buffer owned by the decompressor and reused for
+    every batch, so a single instance should be created per worker. The view
+    returned by `records` is only valid until the next call. The compressed
+    and uncompressed byte counts are tracked per codec.
+    """
+    INITIAL_BUFFER_SIZE = 1 << 20
+
+    def __init__(self):
+        self._buf = bytearray(self.INITIAL_BUFFER_SIZE)
+        self._zstd = None
+        # codec -> [batches, compressed bytes, uncompressed bytes]
+        self.stats = {}
+
+    def records(self, header, data):
+        """
+        Returns the uncompressed records section of a batch given its header
+        and raw records section.
+        """
+        codec = header.attrs & ATTR_COMPRESSION_MASK
+        if codec == CODEC_NONE:
+            return data
+        if codec == CODEC_GZIP:
+            size = self._readinto(gzip.GzipFile(fileobj=io.BytesIO(data)))
+        elif codec == CODEC_SNAPPY:
+            size = self._snappy(data)
+        elif codec == CODEC_LZ4:
+            self._require(lz4, "lz4")
+            size = self._readinto(lz4.frame.LZ4FrameFile(io.BytesIO(data)))
+        elif codec == CODEC_ZSTD:
+            self._require(zstandard, "zstandard")
+            if self._zstd is None:
+                self._zstd = zstandard.ZstdDecompressor()
+            size = self._readinto(self._zstd.stream_reader(data))
+        else:
+            raise ValueError("unknown compression codec {}".format(codec))
+        stats = self.stats.setdefault(CODEC_NAMES[codec], [0, 0, 0])
+        stats[0] += 1
+        stats[1] += len(data)
+        stats[2] += size
+        return memoryview(self._buf)[:size]
+
+    def ratios(self):
+        """
+        Returns the uncompressed to compressed size ratio of each codec seen.
+        """
+        return {
+            codec: uncompressed / compressed if compressed else 0
+            for codec, (_, compressed, uncompressed) in self.stats.items()
+        }
+
+    @staticmethod
+    def _require(module, name):
+        if module is None:
+            raise RuntimeError(
+                "python module '{}' is required to decode this batch".format(
+                    name))
+
+    def _grow(self, used):
+        # replace rather than resize the buffer. views from a previous batch
+        # may still be alive and would make an in-place resize fail.
+        buf = bytearray(len(self._buf) * 2)
+        buf[:used] = self._buf[:used]
+        self._buf = buf
+
+    def _readinto(self, stream):
+        size = 0
+        with stream:
+            while True:
+                if size == len(self._buf):
+                    self._grow(size)
+                read = stream.readinto(memoryview(self._buf)[size:])
+                if not read:
+                    return size
+                size += read
+
+    def _write(self, size, chunk):
+        while size + len(chunk) > len(self._buf):
+            self._grow(size)
+        self._buf[size:size + len(chunk)] = chunk
+        return size + len(chunk)
+
+    def _snappy(self, data):
+        self._require(snappy, "snappy")
+        if data[:len(XERIAL_SNAPPY_MAGIC)] != XERIAL_SNAPPY_MAGIC:
+            return self._write(0, snappy.uncompress(data))
+        # xerial framing: 16 byte header then big endian length prefixed
+        # blocks of raw snappy data
+        size = 0
+        pos = XERIAL_SNAPPY_HEADER_SIZE
+        while pos < len(data):
+            (block_size, ) = struct.unpack_from(">i", data, pos)
+            pos += 4
+            block = snappy.uncompress(data[pos:pos + block_size])
+            size = self._write(size, block)
+            pos += block_size
+        return size
+
+
+_decompressor = None
+
+
+def default_decompressor():
+    """
+    Returns the decompressor of the current process, which pool workers share
+    across all of the segments they are handed.
+    """
+    global _decompressor
+    if _decompressor is None:
+        _decompressor = Decompressor()
+    return _decompressor
+
 
 class CorruptBatchError(Exception):
     def __init__(self, batch):
         self.batch = batch
 
 
+class TornBatchError(Exception):
+    """
+    The segment ends inside a batch, e.g. after an unclean shutdown.
+    """
+
+
 class Batch:
     def __init__(self, index, header, records):
         self.index = index
         self.header = header
+        self.records = records
 
-        header_crc_bytes = struct.pack(
-            "<" + HDR_FMT_RP_PREFIX_NO_CRC + HDR_FMT_CRC, *self.header[1:])
-        header_crc = crc32c.crc32(header_crc_bytes)
-        if self.header.header_crc != header_crc:
-            raise CorruptBatchError(self)
-
+        # the header crc is checked by `from_file` before the records are read
         crc = crc32c.crc32(self._crc_header_be_bytes())
         crc = crc32c.crc32(records, crc)
         if self.header.crc != crc:
@@ -60,55 +357,1777 @@ class Batch:
     def last_offset(self):
         return self.header.base_offset + self.header.record_count - 1
 
+    def iter_records(self, decompressor=None, **filters):
+        decompressor = decompressor or default_decompressor()
+        yield from decode_records(
+            decompressor.records(self.header, memoryview(self.records)),
+            self.header, **filters)
+
     def _crc_header_be_bytes(self):
         # encode header back to big-endian for crc calculation
         return struct.pack(">" + HDR_FMT_CRC, *self.header[5:])
 
     @staticmethod
     def from_file(f, index):
+        """
+        Returns the next batch of `f`, or None at the end of the segment.
+        Follows the same stopping rules as `SegmentScanner` and raises
+        TornBatchError where the scanner would set `torn`.
+        """
+        position = f.tell()
         data = f.read(HEADER_SIZE)
-        if len(data) == HEADER_SIZE:
-            header = Header(*struct.unpack(HDR_FMT_RP, data))
+        if len(data) < HEADER_SIZE:
+            # a short tail is only torn if it isn't preallocated space
+            if any(data):
+                raise TornBatchError()
+            return
+        header = Header(*struct.unpack(HDR_FMT_RP, data))
+        # it appears that we may have hit a truncation point if all of the
+        # fields in the header are zeros
+        if all(map(lambda v: v == 0, header)):
+            return
+        if header.header_crc != crc32c.crc32(data[HEADER_CRC_START:]):
+            raise CorruptBatchError(BatchView(None, index, position, header))
+        records_size = header.batch_size - HEADER_SIZE
+        if records_size < 0:
+            raise TornBatchError()
+        data = f.read(records_size)
+        if len(data) < records_size:
+            raise TornBatchError()
+        return Batch(index, header, data)
+
+
+class BatchView:
+    """
+    Lightweight descriptor of a batch found by `SegmentScanner`.
+
+    Nothing is copied out of the segment. The `records` property returns a
+    slice of the scanner's memory map, which is only valid while the scanner
+    is open.
+    """
+    __slots__ = ('index', 'position', 'header', '_view')
+
+    def __init__(self, view, index, position, header):
+        self._view = view
+        self.index = index
+        self.position = position
+        self.header = header
+
+    @property
+    def size(self):
+        return self.header.batch_size
+
+    @property
+    def records(self):
+        return self._view[self.position + HEADER_SIZE:self.position +
+                          self.header.batch_size]
+
+    def last_offset(self):
+        return self.header.base_offset + self.header.record_count - 1
+
+    def iter_records(self, decompressor=None, **filters):
+        """
+        Lazily decode the records of this batch. See `decode_records` for the
+        supported offset and timestamp filters. Compressed batches are only
+        inflated once iteration starts.
+        """
+        decompressor = decompressor or default_decompressor()
+        yield from decode_records(
+            decompressor.records(self.header, self.records), self.header,
+            **filters)
+
+
+class SegmentScanner:
+    """
+    Zero-copy batch scanner for a single segment file.
+
+    The segment is memory-mapped and batch headers are decoded in place with
+    `struct.unpack_from`. CRCs are computed over slices of the mapping so that
+    record payloads are never copied into Python objects.
+
+    Scanning stops at the end of the file, at a zeroed region (preallocated
+    space) or at a batch that extends past the end of the file. In the last
+    case `torn` is set. After iteration `position` is the file offset just past
+    the last complete batch. `index` is the index of the batch found at the
+    starting position, so that batches keep their segment-wide index when a
+    scan is resumed.
+    """
+    def __init__(self, path, position=0, verify=True, index=1):
+        self.path = path
+        self.position = position
+        self.verify = verify
+        self.index = index
+        self.torn = False
+        self._file = None
+        self._mmap = None
+        self._view = None
+
+    @classmethod
+    def from_buffer(cls, name, data, verify=True):
+        """
+        Returns a scanner over an in-memory buffer rather than a file. It is
+        ready for iteration and must not be opened.
+        """
+        scanner = cls(name, verify=verify)
+        scanner._view = memoryview(data)
+        return scanner
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __iter__(self):
+        return self.batches()
+
+    def open(self):
+        self._file = open(self.path, "rb")
+        # mmap refuses to map empty files
+        if os.fstat(self._file.fileno()).st_size > 0:
+            self._mmap = mmap.mmap(self._file.fileno(),
+                                   0,
+                                   access=mmap.ACCESS_READ)
+            self._view = memoryview(self._mmap)
+
+    def close(self):
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # record views handed out to the caller are still alive. the
+                # mapping is released when they are garbage collected.
+                pass
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _check_header_crc(self, batch):
+        pos = batch.position
+        header_crc = crc32c.crc32(self._view[pos + HEADER_CRC_START:pos +
+                                             HEADER_SIZE])
+        if batch.header.header_crc != header_crc:
+            raise CorruptBatchError(batch)
+
+    def _check_records_crc(self, batch):
+        crc = crc32c.crc32(HDR_STRUCT_CRC_BE.pack(*batch.header[5:]))
+        crc = crc32c.crc32(batch.records, crc)
+        if batch.header.crc != crc:
+            raise CorruptBatchError(batch)
+
+    def batches(self):
+        view = self._view
+        if view is None:
+            return
+        end = len(view)
+        index = self.index
+        while True:
+            pos = self.position
+            remaining = end - pos
+            if remaining < HEADER_SIZE:
+                # a short tail is only torn if it isn't preallocated space
+                self.torn = any(view[pos:end])
+                return
+            header = Header._make(HDR_STRUCT_RP.unpack_from(view, pos))
             # it appears that we may have hit a truncation point if all of the
             # fields in the header are zeros
-            if all(map(lambda v: v == 0, header)):
+            if not any(header):
                 return
-            records_size = header.batch_size - HEADER_SIZE
-            data = f.read(records_size)
-            assert len(data) == records_size
-            return Batch(index, header, data)
-        assert len(data) == 0
+            batch = BatchView(view, index, pos, header)
+            if self.verify:
+                self._check_header_crc(batch)
+            if header.batch_size < HEADER_SIZE or header.batch_size > remaining:
+                self.torn = True
+                return
+            if self.verify:
+                self._check_records_crc(batch)
+            self.position = pos + header.batch_size
+            index += 1
+            yield batch
+
+
+def scan_records(path, position=0, verify=True, decompressor=None, **filters):
+    """
+    Stream the records of a segment starting at file `position`, skipping
+    whole batches whose header shows they cannot match the offset and
+    timestamp filters.
+    """
+    with SegmentScanner(path, position=position, verify=verify) as scanner:
+        for batch in scanner:
+            if batch_in_range(batch.header, **filters):
+                yield from batch.iter_records(decompressor=decompressor,
+                                              **filters)
+
+
+# segment offset index (storage::index_state) header:
+#   - little endian encoded
+#   - version, size, checksum, bitflags, base offset, max offset, base
+#     timestamp, max timestamp, entry count
+# followed by the relative offset (u32), relative time (u32) and file position
+# (u64) columns. the checksum is an xxhash64 over everything after it.
+INDEX_VERSION = 3
+INDEX_HDR_STRUCT = struct.Struct("<bIQIqqqqI")
+INDEX_CHECKSUM_START = struct.calcsize("<bIQ")
+
+
+class SegmentIndex:
+    """
+    Reader for the `.base_index` file that redpanda keeps next to each segment.
+
+    The index holds a sparse set of (relative offset, relative time, file
+    position) entries. The columns are exposed as zero-copy views over the
+    file contents and are binary searched by `lookup_offset`/`lookup_time`.
+    """
+    def __init__(self, path, data):
+        self.path = path
+        (self.version, self.size, self.checksum, self.bitflags,
+         self.base_offset, self.max_offset, self.base_timestamp,
+         self.max_timestamp, count) = INDEX_HDR_STRUCT.unpack_from(data, 0)
+        view = memoryview(data)
+        pos = INDEX_HDR_STRUCT.size
+        self.relative_offsets = view[pos:pos + 4 * count].cast("I")
+        pos += 4 * count
+        self.relative_times = view[pos:pos + 4 * count].cast("I")
+        pos += 4 * count
+        self.positions = view[pos:pos + 8 * count].cast("Q")
+
+    def __len__(self):
+        return len(self.positions)
+
+    @staticmethod
+    def load(path):
+        """
+        Returns the index stored at `path`, or None if it is missing, has an
+        unsupported version or fails its size or checksum check. Like the
+        broker, callers are expected to fall back to scanning the segment.
+        """
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        if len(data) < INDEX_HDR_STRUCT.size:
+            return None
+        version, size, checksum = struct.unpack_from("<bIQ", data)
+        if version != INDEX_VERSION:
+            logger.debug("unsupported index version {}: {}".format(
+                version, path))
+            return None
+        if len(data) - struct.calcsize("<bI") != size:
+            logger.debug("index size mismatch: {}".format(path))
+            return None
+        if xxhash is not None and checksum != xxhash.xxh64_intdigest(
+                data[INDEX_CHECKSUM_START:]):
+            logger.debug("index checksum mismatch: {}".format(path))
+            return None
+        return SegmentIndex(path, data)
+
+    def lookup_offset(self, offset):
+        """
+        Returns the file position of the last indexed batch starting at or
+        below `offset`, or None if `offset` is below the indexed range.
+        """
+        if offset < self.base_offset or not len(self):
+            return None
+        target = offset - self.base_offset
+        i = bisect.bisect_right(self.relative_offsets, target) - 1
+        return self.positions[i] if i >= 0 else None
+
+    def lookup_time(self, timestamp):
+        """
+        Returns the file position of the last indexed batch whose timestamps
+        are all below `timestamp`, which is a safe point to start scanning for
+        the first batch at or after `timestamp`.
+        """
+        if timestamp <= self.base_timestamp or not len(self):
+            return None
+        target = timestamp - self.base_timestamp
+        i = bisect.bisect_left(self.relative_times, target) - 1
+        return self.positions[i] if i >= 0 else None
+
+
+# compaction index (storage::compacted_index) layout:
+#   - entries of: u16 size (excluding itself), u8 type, vint offset, vint
+#     delta, key bytes
+#   - footer: u32 size, u32 keys, u32 flags, u32 crc32c, i8 version
+# all little endian. the crc covers the entries including their size prefix.
+COMPACTION_FOOTER_STRUCT = struct.Struct("<IIIIb")
+COMPACTION_ENTRY_SIZE_STRUCT = struct.Struct("<H")
+COMPACTION_ENTRY_KEY = 1
+COMPACTION_ENTRY_TRUNCATION = 2
+
+CompactionFooter = collections.namedtuple(
+    'CompactionFooter', ('size', 'keys', 'flags', 'crc', 'version'))
+
+CompactionEntry = collections.namedtuple('CompactionEntry',
+                                         ('type', 'offset', 'delta', 'key'))
+
+
+class CorruptIndexError(Exception):
+    def __init__(self, path, reason):
+        super().__init__("{}: {}".format(path, reason))
+        self.path = path
+
+
+class CompactionIndex:
+    """
+    Streaming reader for the `.compaction_index` of a compacted segment.
+
+    The file is memory-mapped and entries are decoded one at a time, with keys
+    returned as views into the mapping.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.footer = None
+        self._file = None
+        self._mmap = None
+        self._view = None
+
+    def __enter__(self):
+        self._file = open(self.path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        if size < COMPACTION_FOOTER_STRUCT.size:
+            raise CorruptIndexError(self.path, "file too small for footer")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+        self.footer = CompactionFooter._make(
+            COMPACTION_FOOTER_STRUCT.unpack_from(
+                self._view, size - COMPACTION_FOOTER_STRUCT.size))
+        if self.footer.size != size - COMPACTION_FOOTER_STRUCT.size:
+            raise CorruptIndexError(self.path, "footer size mismatch")
+        return self
+
+    def __exit__(self, *exc):
+        self._view.release()
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass
+        self._file.close()
+
+    def verify(self):
+        crc = crc32c.crc32(self._view[:self.footer.size])
+        if crc != self.footer.crc:
+            raise CorruptIndexError(self.path, "crc mismatch")
+
+    def __iter__(self):
+        view = self._view
+        end = self.footer.size
+        pos = 0
+        while pos < end:
+            (size, ) = COMPACTION_ENTRY_SIZE_STRUCT.unpack_from(view, pos)
+            pos += COMPACTION_ENTRY_SIZE_STRUCT.size
+            next_pos = pos + size
+            entry_type = view[pos]
+            offset, key_pos = read_varint(view, pos + 1)
+            delta, key_pos = read_varint(view, key_pos)
+            yield CompactionEntry(entry_type, offset, delta,
+                                  view[key_pos:next_pos])
+            pos = next_pos
+
+
+def hash64(data):
+    if xxhash is not None:
+        return xxhash.xxh64_intdigest(data)
+    return int.from_bytes(
+        hashlib.blake2b(data, digest_size=8).digest(), "little")
+
+
+class HyperLogLog:
+    """
+    Fixed memory distinct counter. With the default precision of 14 it uses
+    16KiB of registers and has a standard error of about 0.8%.
+    """
+    def __init__(self, precision=14):
+        self.precision = precision
+        self.m = 1 << precision
+        self.registers = bytearray(self.m)
+
+    def add(self, data):
+        h = hash64(data)
+        index = h & (self.m - 1)
+        w = h >> self.precision
+        rank = 64 - self.precision - w.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        assert self.precision == other.precision
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def cardinality(self):
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0**-r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # small range correction: linear counting
+            return m * math.log(m / zeros)
+        return estimate
+
+
+CompactionReport = collections.namedtuple(
+    'CompactionReport', ('name', 'keys', 'distinct', 'records', 'bytes',
+                         'duplicate_ratio', 'reclaimable_bytes'))
+
+
+def compaction_report(name, hll, keys, records, size):
+    """
+    Summarize a key population. Each record beyond the number of distinct keys
+    is assumed to be reclaimable, and to cost the average record size.
+    """
+    distinct = min(int(round(hll.cardinality())), records or keys)
+    duplicate_ratio = 1 - distinct / records if records else 0
+    return CompactionReport(name, keys, distinct, records, size,
+                            duplicate_ratio, int(size * duplicate_ratio))
+
+
+def segment_data_size(path):
+    """
+    Returns the number of records and bytes in user data batches of a segment
+    using a header-only scan.
+    """
+    records = size = 0
+    with SegmentScanner(path, verify=False) as scanner:
+        for batch in scanner:
+            if batch.header.type == RAFT_DATA_BATCH_TYPE:
+                records += batch.header.record_count
+                size += batch.header.batch_size
+    return records, size
+
+
+# segment files are named <base offset>-<term>-v<version>.log
+SEGMENT_NAME_RE = re.compile(r"^(?P<base_offset>\d+)-(?P<term>\d+)-v\d+\.log$")
+
+
+def parse_segment_name(path):
+    """
+    Returns the (base offset, term) encoded in a segment file name, or None
+    if the name does not follow the segment naming scheme.
+    """
+    match = SEGMENT_NAME_RE.match(os.path.basename(path))
+    if match is None:
+        return None
+    return int(match.group("base_offset")), int(match.group("term"))
 
 
 class Segment:
     def __init__(self, path):
         self.path = path
-        self.__read_batches()
+        self.torn = False
+        name = parse_segment_name(path)
+        self.base_offset, self.term = name if name else (None, None)
+        self.index_path = os.path.splitext(path)[0] + ".base_index"
+        self.compaction_index_path = os.path.splitext(
+            path)[0] + ".compaction_index"
+        self._index = None
+
+    def verify(self, use_mmap=False):
+        """
+        Read and CRC every batch, raising CorruptBatchError on the first bad
+        batch.
+        """
+        if use_mmap:
+            self.__scan_batches()
+        else:
+            self.__read_batches()
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = SegmentIndex.load(self.index_path)
+        return self._index
+
+    def seek(self, offset):
+        """
+        Returns the file position of the first batch whose last offset is at
+        or above `offset`, which is the batch containing `offset` when the
+        segment holds it, or None if the segment ends before it. The index
+        narrows the search down to a short bounded scan of batch headers.
+        """
+        start = self.index.lookup_offset(offset) if self.index else None
+        return self.__seek(start, lambda h: h.base_offset + h.delta >= offset)
+
+    def seek_time(self, timestamp):
+        """
+        Returns the file position of the first batch containing a timestamp at
+        or after `timestamp`, or None if there is no such batch.
+        """
+        start = self.index.lookup_time(timestamp) if self.index else None
+        return self.__seek(start,
+                           lambda h: max(h.first_ts, h.max_ts) >= timestamp)
+
+    def __seek(self, start, pred):
+        with SegmentScanner(self.path, position=start or 0,
+                            verify=False) as scanner:
+            for batch in scanner:
+                if pred(batch.header):
+                    return batch.position
+        return None
+
+    def __scan_batches(self):
+        with SegmentScanner(self.path) as scanner:
+            for _ in scanner:
+                pass
+            self.torn = scanner.torn
 
     def __read_batches(self):
         index = 1
         with open(self.path, "rb") as f:
             while True:
-                batch = Batch.from_file(f, index)
+                try:
+                    batch = Batch.from_file(f, index)
+                except TornBatchError:
+                    self.torn = True
+                    break
                 if not batch:
                     break
                 index += 1
 
-    def dump(self):
-        if self.batches:
-            next_offset = self.batches[0].header.base_offset
-        index = 0
-        for batch in self.batches:
-            if index < 3 or index == (len(self.batches) - 1):
-                logger.info(batch.header.base_offset)
-            if index == 3 and len(self.batches) > 4:
-                logger.info("...")
-            if batch.header.base_offset != next_offset:
-                logger.info("hole discovered at offset {} expected {}".format(
-                    batch.header.base_offset, next_offset))
+
+SegmentReport = collections.namedtuple(
+    'SegmentReport',
+    ('path', 'inode', 'size', 'mtime', 'start', 'batches', 'total_batches',
+     'bytes', 'position', 'last_offset', 'torn', 'corrupt_index',
+     'corrupt_position', 'corrupt_header'))
+
+
+def verify_segment(path, position=0, verified_batches=0):
+    """
+    Verify the batches of a segment from file `position` onwards with the
+    zero-copy scanner and summarize the result. `verified_batches` is the
+    number of batches before `position`, which keeps batch indexes and the
+    `total_batches` count relative to the start of the segment. This is the
+    unit of work handed to pool workers, so it returns a picklable report
+    rather than raising on corruption.
+    """
+    st = os.stat(path)
+    batches = 0
+    last_offset = None
+    corrupt = (None, None, None)
+    with SegmentScanner(path, position=position,
+                        index=verified_batches + 1) as scanner:
+        try:
+            for batch in scanner:
+                batches += 1
+                last_offset = batch.last_offset()
+        except CorruptBatchError as e:
+            corrupt = (e.batch.index, e.batch.position, e.batch.header)
+        return SegmentReport(path, st.st_ino, st.st_size, st.st_mtime_ns,
+                             position, batches, verified_batches + batches,
+                             scanner.position - position, scanner.position,
+                             last_offset, scanner.torn, *corrupt)
+
+
+def _verify_segment(args):
+    return verify_segment(*args)
+
+
+def report_failed(report):
+    """
+    A torn tail fails verification just like a corrupt batch does, in every
+    verification mode.
+    """
+    return report.corrupt_index is not None or report.torn
+
+
+def verify_segments(work, jobs):
+    """
+    Verify segments given as `verify_segment` argument tuples, i.e. a path
+    and start position optionally followed by the number of batches before
+    it, across a pool of `jobs` processes, or inline when `jobs` is 1.
+
+    Segments are submitted with the most bytes left to verify first so that
+    the long tail of the run is made up of small amounts of work. Reports are
+    yielded as they complete. Once a corrupt or torn segment is reported the
+    remaining queued work is cancelled.
+    """
+    work = sorted(work,
+                  key=lambda w: os.path.getsize(w[0]) - w[1],
+                  reverse=True)
+    if jobs == 1:
+        for report in map(_verify_segment, work):
+            yield report
+            if report_failed(report):
+                return
+        return
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(_verify_segment, w) for w in work]
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                report = future.result()
+                yield report
+                if report_failed(report):
+                    break
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+class VerificationCache:
+    """
+    Persistent record of how far each segment has been verified, so periodic
+    runs over a live data directory only check what was appended since.
+
+    Entries are keyed by path and remember the inode, size and mtime of the
+    file along with the position just past the last verified batch, the
+    number of batches up to it, that batch's last offset and whether the
+    segment had a torn tail. A segment whose inode, size and mtime are
+    unchanged is skipped, unless its tail was torn. A segment with the same
+    inode is resumed from the recorded position, which covers the active
+    segment being appended to and re-checks a torn tail. Anything else, such
+    as a replaced or truncated file, is verified from scratch.
+    """
+    VERSION = 2
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self._updated = {}
+        try:
+            with open(path, "r") as f:
+                cache = json.load(f)
+            if cache.get("version") == self.VERSION:
+                self.entries = cache["segments"]
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError):
+            logger.warning(
+                "ignoring unreadable verification cache: {}".format(path))
+
+    def resume_point(self, path):
+        """
+        Returns the position to resume verification of `path` from and the
+        number of batches before it, or None if it has not changed since it
+        was last verified.
+        """
+        entry = self.entries.get(path)
+        if entry is None:
+            return 0, 0
+        st = os.stat(path)
+        if st.st_ino != entry["inode"] or st.st_size < entry["position"]:
+            return 0, 0
+        if st.st_size == entry["size"] and st.st_mtime_ns == entry[
+                "mtime"] and not entry["torn"]:
+            self._updated[path] = entry
+            return None
+        return entry["position"], entry["batches"]
+
+    def update(self, report):
+        self._updated[report.path] = dict(inode=report.inode,
+                                          size=report.size,
+                                          mtime=report.mtime,
+                                          position=report.position,
+                                          batches=report.total_batches,
+                                          last_offset=report.last_offset,
+                                          torn=report.torn)
+
+    def save(self):
+        """
+        Persist the entries recorded during this run. Segments that were not
+        visited, e.g. because they were deleted, are dropped.
+        """
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(dict(version=self.VERSION, segments=self._updated), f)
+        os.replace(tmp, self.path)
+
+
+def header_dtype():
+    """
+    NumPy structured dtype with the exact layout of an on-disk batch header
+    (HDR_FMT_RP), so that raw header bytes can be viewed as records.
+    """
+    dtype = np.dtype([
+        ('header_crc', '<u4'),
+        ('batch_size', '<i4'),
+        ('base_offset', '<i8'),
+        ('type', 'i1'),
+        ('crc', '<u4'),
+        ('attrs', '<i2'),
+        ('delta', '<i4'),
+        ('first_ts', '<i8'),
+        ('max_ts', '<i8'),
+        ('producer_id', '<i8'),
+        ('producer_epoch', '<i2'),
+        ('base_seq', '<i4'),
+        ('record_count', '<i4'),
+    ])
+    assert dtype.itemsize == HEADER_SIZE
+    assert dtype.names == Header._fields
+    return dtype
+
+
+def _batch_sizes(view):
+    """
+    Yields the size field of consecutive batch headers in a mapped segment,
+    following the same stopping rules as SegmentScanner.
+    """
+    end = len(view)
+    pos = 0
+    size_at = struct.Struct("<i").unpack_from
+    while end - pos >= HEADER_SIZE:
+        (size, ) = size_at(view, pos + HEADER_CRC_START)
+        if size < HEADER_SIZE or size > end - pos:
+            return
+        yield size
+        pos += size
+
+
+def header_positions(view):
+    """
+    Returns the file positions of the batches in a mapped segment. Each
+    header's batch_size is read where the previous batch ends, and the
+    positions are the exclusive cumulative sum of those sizes.
+    """
+    sizes = np.fromiter(_batch_sizes(view), dtype=np.int64)
+    return np.cumsum(sizes) - sizes
+
+
+def export_segment_headers(path, chunk=1 << 16):
+    """
+    Decode all batch headers of a segment into a structured array. Headers
+    are gathered from the memory-mapped file with vectorised fancy indexing
+    in bounded chunks. Returns the headers and their file positions.
+    """
+    dtype = header_dtype()
+    with SegmentScanner(path, verify=False) as scanner:
+        if scanner._view is None:
+            return np.empty(0, dtype=dtype), np.empty(0, dtype=np.int64)
+        raw = np.frombuffer(scanner._view, dtype=np.uint8)
+        positions = header_positions(scanner._view)
+        headers = np.empty(len(positions), dtype=dtype)
+        columns = np.arange(HEADER_SIZE)
+        for i in range(0, len(positions), chunk):
+            rows = positions[i:i + chunk, None] + columns
+            headers[i:i + chunk] = raw[rows].view(dtype).reshape(-1)
+        del raw
+    return headers, positions
+
+
+def summarize_headers(headers):
+    """
+    Vectorised batch statistics over an array from `export_segment_headers`.
+    Offset gaps are counted between consecutive batches in offset order.
+    """
+    if not len(headers):
+        return dict(batches=0)
+    sizes = headers['batch_size']
+    headers = headers[np.argsort(headers['base_offset'], kind='stable')]
+    next_offsets = headers['base_offset'][:-1] + headers['delta'][:-1] + 1
+    gaps = headers['base_offset'][1:] - next_offsets
+    p50, p90, p99 = np.percentile(sizes, [50, 90, 99])
+    return dict(batches=len(headers),
+                records=int(headers['record_count'].sum()),
+                bytes=int(sizes.sum()),
+                batch_size_p50=float(p50),
+                batch_size_p90=float(p90),
+                batch_size_p99=float(p99),
+                batch_size_max=int(sizes.max()),
+                offset_gaps=int(np.count_nonzero(gaps > 0)),
+                offset_overlaps=int(np.count_nonzero(gaps < 0)),
+                first_ts=int(headers['first_ts'].min()),
+                max_ts=int(headers['max_ts'].max()))
+
+
+def list_segments(path):
+    """
+    Returns the segments of the ntp directory `path` in base offset order.
+    Files that don't follow the segment naming scheme sort last.
+    """
+    return sorted(glob.iglob(os.path.join(path, "*.log")),
+                  key=lambda p: parse_segment_name(p) or (math.inf, math.inf))
+
+
+ContinuityIssue = collections.namedtuple(
+    'ContinuityIssue', ('kind', 'path', 'position', 'expected', 'found'))
+
+HOLE = "hole"
+OVERLAP = "overlap"
+TERM_REGRESSION = "term_regression"
+
+
+def check_continuity(paths):
+    """
+    Walk the batch headers of a sequence of segments in base offset order and
+    yield a ContinuityIssue for every offset hole, offset overlap and term
+    regression, both within and across segment boundaries.
+
+    Only the expected next offset and the previous segment term are carried
+    between batches, and each segment is read once with a header-only scan.
+    Note that compaction legitimately leaves holes in compacted topics.
+    """
+    next_offset = None
+    last_term = None
+    for path in paths:
+        segment = Segment(path)
+        if last_term is not None and segment.term is not None and \
+           segment.term < last_term:
+            yield ContinuityIssue(TERM_REGRESSION, path, 0, last_term,
+                                  segment.term)
+        if segment.term is not None:
+            last_term = segment.term
+        with SegmentScanner(path, verify=False) as scanner:
+            for batch in scanner:
+                base_offset = batch.header.base_offset
+                if next_offset is not None and base_offset != next_offset:
+                    kind = HOLE if base_offset > next_offset else OVERLAP
+                    yield ContinuityIssue(kind, path, batch.position,
+                                          next_offset, base_offset)
+                next_offset = base_offset + batch.header.delta + 1
+
+
+ChainEntry = collections.namedtuple('ChainEntry',
+                                    ('base_offset', 'term', 'crc', 'digest'))
+
+CHAIN_LINK_STRUCT = struct.Struct("<qqI")
+CHAIN_DIGEST_SIZE = 8
+CHAIN_CHECKPOINT_INTERVAL = 4096
+
+
+class HashChain:
+    """
+    Rolling hash chain over the batches of a replica's log.
+
+    Link i is the hash of link i-1 together with the base offset, term and
+    crc of batch i, so two replicas agree on link i exactly when they agree
+    on every batch up to and including batch i. This makes it possible to
+    bisect for the first divergent batch by comparing single digests. The
+    term of a batch is the term of its segment, since segments are rolled on
+    term changes.
+
+    Only a checkpoint every `interval` batches is kept: the previous link
+    and the segment and file position of the batch. The links of an interval
+    are rebuilt from its checkpoint when one of its entries is requested, so
+    memory grows with the number of checkpoints rather than batches, and a
+    bisection rescans a few intervals.
+    """
+    def __init__(self, paths, interval=None):
+        self.paths = paths
+        self.interval = interval or CHAIN_CHECKPOINT_INTERVAL
+        self.checkpoints = []
+        self.length = 0
+        self._window = None
+        start = (bytes(CHAIN_DIGEST_SIZE), 0, 0)
+        for checkpoint, _ in self._links(start):
+            if self.length % self.interval == 0:
+                self.checkpoints.append(checkpoint)
+            self.length += 1
+
+    def _links(self, checkpoint):
+        """
+        Yields the checkpoint and chain entry of every batch from
+        `checkpoint` on. Entry digests are raw bytes.
+        """
+        digest, first, position = checkpoint
+        for segment in range(first, len(self.paths)):
+            path = self.paths[segment]
+            term = Segment(path).term or 0
+            with SegmentScanner(path, position, verify=False) as scanner:
+                for batch in scanner:
+                    header = batch.header
+                    checkpoint = (digest, segment, batch.position)
+                    digest = hashlib.blake2b(
+                        digest + CHAIN_LINK_STRUCT.pack(
+                            header.base_offset, term, header.crc),
+                        digest_size=CHAIN_DIGEST_SIZE).digest()
+                    yield checkpoint, ChainEntry(header.base_offset, term,
+                                                 header.crc, digest)
+            position = 0
+
+    def __len__(self):
+        return self.length
+
+    def entry(self, i):
+        window = i // self.interval
+        if self._window is None or self._window[0] != window:
+            links = self._links(self.checkpoints[window])
+            self._window = (window, [
+                entry for _, entry in itertools.islice(links, self.interval)
+            ])
+            links.close()
+        entry = self._window[1][i % self.interval]
+        return entry._replace(digest=entry.digest.hex())
+
+
+class LocalReplica:
+    """
+    A replica whose ntp directory is readable from this host.
+    """
+    def __init__(self, path):
+        self.name = path
+        self.chain = HashChain(list_segments(path))
+
+    def length(self):
+        return len(self.chain)
+
+    def entry(self, i):
+        return self.chain.entry(i)
+
+    def close(self):
+        pass
+
+
+class RemoteReplica:
+    """
+    A replica on another host. The hash chain is built there by running this
+    tool over ssh with --chain-server, and only the entries requested during
+    the bisection cross the network.
+    """
+    def __init__(self, host, path, tool):
+        import subprocess
+        self.name = "{}:{}".format(host, path)
+        self._proc = subprocess.Popen(
+            ["ssh", host, "python3", tool, "--chain-server", "--path", path],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            universal_newlines=True)
+
+    def _call(self, request):
+        self._proc.stdin.write(json.dumps(request) + "\n")
+        self._proc.stdin.flush()
+        reply = self._proc.stdout.readline()
+        if not reply:
+            raise RuntimeError("chain server for {} exited".format(self.name))
+        return json.loads(reply)
+
+    def length(self):
+        return self._call(dict(op="length"))
+
+    def entry(self, i):
+        return ChainEntry(*self._call(dict(op="entry", index=i)))
+
+    def close(self):
+        self._proc.stdin.close()
+        self._proc.wait()
+
+
+def open_replica(spec, tool):
+    """
+    Open a replica given as a local ntp directory or as `host:directory`.
+    """
+    host, sep, path = spec.partition(":")
+    if sep and not os.path.exists(spec):
+        return RemoteReplica(host, path, tool)
+    return LocalReplica(spec)
+
+
+def serve_chain(path, infile=sys.stdin, outfile=sys.stdout):
+    """
+    Answer hash chain queries for the ntp directory `path`, one JSON request
+    and reply per line. Used by RemoteReplica.
+    """
+    replica = LocalReplica(path)
+    for line in infile:
+        request = json.loads(line)
+        if request["op"] == "length":
+            reply = replica.length()
+        elif request["op"] == "entry":
+            reply = replica.entry(request["index"])
+        else:
+            raise ValueError("unknown chain request {}".format(request))
+        outfile.write(json.dumps(reply) + "\n")
+        outfile.flush()
+
+
+def find_divergence(replicas):
+    """
+    Bisect for the first batch at which the replicas' hash chains differ.
+    Returns the batch index and the length of each replica. The index equals
+    the shortest length if the replicas agree on their common prefix.
+    """
+    lengths = [r.length() for r in replicas]
+    lo, hi = 0, min(lengths)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        digests = set(r.entry(mid).digest for r in replicas)
+        if len(digests) == 1:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo, lengths
+
+
+# copied from model::record_batch_type in src/v/model/record_batch_types.h.
+# tests/test_storage.py checks it against the header.
+BATCH_TYPE_NAMES = {
+    1: 'raft_data',
+    2: 'raft_configuration',
+    3: 'controller',
+    4: 'kvstore',
+    5: 'checkpoint',
+    6: 'topic_management_cmd',
+    7: 'ghost_batch',
+    8: 'id_allocator',
+    9: 'tx_prepare',
+    10: 'tx_fence',
+    11: 'tm_update',
+    12: 'user_management_cmd',
+    13: 'acl_management_cmd',
+    14: 'group_prepare_tx',
+    15: 'group_commit_tx',
+    16: 'group_abort_tx',
+    17: 'node_management_cmd',
+}
+KVSTORE_BATCH_TYPE = 4
+
+# copied from storage::kvstore::key_space in src/v/storage/kvstore.h
+KVSTORE_KEY_SPACES = {
+    0: 'testing',
+    1: 'consensus',
+    2: 'storage',
+    3: 'controller'
+}
+
+
+class AdlReader:
+    """
+    Reader for the little endian `reflection::adl` encoding used by
+    controller commands and kvstore values.
+    """
+    def __init__(self, buf):
+        self.buf = buf
+        self.pos = 0
+
+    def _unpack(self, fmt):
+        (value, ) = struct.unpack_from(fmt, self.buf, self.pos)
+        self.pos += struct.calcsize(fmt)
+        return value
+
+    def int8(self):
+        return self._unpack("<b")
+
+    def uint8(self):
+        return self._unpack("<B")
+
+    def int16(self):
+        return self._unpack("<h")
+
+    def int32(self):
+        return self._unpack("<i")
+
+    def uint32(self):
+        return self._unpack("<I")
+
+    def int64(self):
+        return self._unpack("<q")
+
+    def uint64(self):
+        return self._unpack("<Q")
+
+    def string(self):
+        size = self.int32()
+        value = bytes(self.buf[self.pos:self.pos + size])
+        self.pos += size
+        return value.decode('utf-8', errors='replace')
+
+    def vector(self, item):
+        return [item(self) for _ in range(self.int32())]
+
+    def optional(self, item):
+        return item(self) if self.int8() else None
+
+    def tristate(self, item):
+        state = self.int8()
+        if state == -1:
+            return 'disabled'
+        return item(self) if state == 1 else None
+
+    def remaining(self):
+        return len(self.buf) - self.pos
+
+
+def _adl_topic_namespace(r):
+    return {'ns': r.string(), 'topic': r.string()}
+
+
+def _adl_ntp(r):
+    return {'ns': r.string(), 'topic': r.string(), 'partition': r.int32()}
+
+
+def _adl_broker_shard(r):
+    return {'node_id': r.int32(), 'shard': r.uint32()}
+
+
+def _adl_replicas(r):
+    return {'replicas': r.vector(_adl_broker_shard)}
+
+
+def _adl_partition_assignment(r):
+    return {
+        'group': r.int64(),
+        'id': r.int32(),
+        'replicas': r.vector(_adl_broker_shard)
+    }
+
+
+def _adl_topic_configuration_assignment(r):
+    cfg = _adl_topic_namespace(r)
+    cfg['partition_count'] = r.int32()
+    cfg['replication_factor'] = r.int16()
+    cfg['compression'] = r.optional(AdlReader.uint8)
+    cfg['cleanup_policy_bitflags'] = r.optional(AdlReader.uint8)
+    cfg['compaction_strategy'] = r.optional(AdlReader.int8)
+    cfg['timestamp_type'] = r.optional(AdlReader.uint8)
+    cfg['segment_size'] = r.optional(AdlReader.uint64)
+    cfg['retention_bytes'] = r.tristate(AdlReader.uint64)
+    cfg['retention_duration_ms'] = r.tristate(AdlReader.int64)
+    cfg['assignments'] = r.vector(_adl_partition_assignment)
+    return cfg
+
+
+def _adl_credential_user(r):
+    return {'user': r.string()}
+
+
+def _adl_acls_cmd(r):
+    # only the version and binding count are decoded, the bindings themselves
+    # are reported by size
+    return {'version': r.int8(), 'bindings': r.int32()}
+
+
+def _adl_node_id(r):
+    return {'node_id': r.int32()}
+
+
+def _adl_opaque(r):
+    return {}
+
+
+# (batch type, command type) -> (name, key decoder, value decoder), copied
+# from the controller_command aliases and *_cmd_type constants in
+# src/v/cluster/commands.h. value decoders run after the command type byte.
+CONTROLLER_COMMANDS = {
+    (6, 0): ('create_topic', _adl_topic_namespace,
+             _adl_topic_configuration_assignment),
+    (6, 1): ('delete_topic', _adl_topic_namespace, _adl_topic_namespace),
+    (6, 2): ('move_partition_replicas', _adl_ntp, _adl_replicas),
+    (6, 3): ('finish_moving_partition_replicas', _adl_ntp, _adl_replicas),
+    (6, 4): ('update_topic_properties', _adl_topic_namespace, _adl_opaque),
+    (12, 5): ('create_user', _adl_credential_user, _adl_opaque),
+    (12, 6): ('delete_user', _adl_credential_user, _adl_opaque),
+    (12, 7): ('update_user', _adl_credential_user, _adl_opaque),
+    (13, 8): ('create_acls', _adl_acls_cmd, _adl_opaque),
+    (13, 9): ('delete_acls', _adl_acls_cmd, _adl_opaque),
+    (17, 0): ('decommission_node', _adl_node_id, _adl_opaque),
+    (17, 1): ('recommission_node', _adl_node_id, _adl_opaque),
+}
+CONTROLLER_BATCH_TYPES = {t for t, _ in CONTROLLER_COMMANDS}
+
+
+def decode_controller_command(batch_type, record):
+    """
+    Decode a controller command record into a dict. Commands are stored one
+    per batch with the adl encoded key as the record key and the command type
+    followed by the adl encoded value as the record value.
+    """
+    value = AdlReader(record.value or b'')
+    command_type = value.int8()
+    entry = {'command_type': command_type}
+    command = CONTROLLER_COMMANDS.get((batch_type, command_type))
+    if command is None:
+        entry['command'] = 'unknown'
+        return entry
+    name, key_decoder, value_decoder = command
+    entry['command'] = name
+    try:
+        entry['key'] = key_decoder(AdlReader(record.key or b''))
+        entry['value'] = value_decoder(value)
+    except struct.error as e:
+        entry['error'] = str(e)
+    return entry
+
+
+def decode_kvstore_entry(record):
+    """
+    Decode a kvstore record. The key is prefixed by the key space byte and the
+    value is an adl `std::optional<iobuf>` which is absent for deletions.
+    """
+    key = bytes(record.key or b'')
+    entry = {
+        'command': 'kvstore_put',
+        'key_space': KVSTORE_KEY_SPACES.get(key[0], key[0]) if key else None,
+        'key': key[1:].hex(),
+    }
+    value = AdlReader(record.value or b'')
+    try:
+        if value.int8():
+            entry['value_size'] = value.int32()
+        else:
+            entry['command'] = 'kvstore_delete'
+    except struct.error as e:
+        entry['error'] = str(e)
+    return entry
+
+
+def decode_internal_batch(batch, decompressor=None):
+    """
+    Yield one dict per record of an internal batch. Controller commands and
+    kvstore entries are decoded, other batch types only report their size.
+    """
+    batch_type = batch.header.type
+    type_name = BATCH_TYPE_NAMES.get(batch_type, str(batch_type))
+    for record in batch.iter_records(decompressor):
+        if batch_type == KVSTORE_BATCH_TYPE:
+            entry = decode_kvstore_entry(record)
+        elif batch_type in CONTROLLER_BATCH_TYPES:
+            entry = decode_controller_command(batch_type, record)
+        else:
+            entry = {'command': type_name}
+        entry['offset'] = record.offset
+        entry['timestamp'] = record.timestamp
+        entry['batch_type'] = type_name
+        entry['size'] = (0 if record.key is None else len(
+            record.key)) + (0 if record.value is None else len(record.value))
+        yield entry
+
+
+USAGE_COLUMNS = ('batches', 'records', 'bytes', 'header_bytes',
+                 'avg_batch_size', 'compression_ratio')
+
+
+class UsageStats:
+    """
+    Disk usage accumulated over a group of batches. The compression ratio
+    only covers compressed batches that were inflated.
+    """
+    __slots__ = ('batches', 'records', 'bytes', 'compressed_bytes',
+                 'uncompressed_bytes')
+
+    def __init__(self):
+        self.batches = 0
+        self.records = 0
+        self.bytes = 0
+        self.compressed_bytes = 0
+        self.uncompressed_bytes = 0
+
+    def add(self, header, uncompressed_size=None):
+        self.batches += 1
+        self.records += header.record_count
+        self.bytes += header.batch_size
+        if uncompressed_size is not None:
+            self.compressed_bytes += header.batch_size - HEADER_SIZE
+            self.uncompressed_bytes += uncompressed_size
+
+    def merge(self, other):
+        for field in self.__slots__:
+            setattr(self, field, getattr(self, field) + getattr(other, field))
+
+    def to_dict(self):
+        ratio = None
+        if self.compressed_bytes:
+            ratio = round(self.uncompressed_bytes / self.compressed_bytes, 3)
+        return {
+            'batches': self.batches,
+            'records': self.records,
+            'bytes': self.bytes,
+            'header_bytes': self.batches * HEADER_SIZE,
+            'avg_batch_size':
+            self.bytes // self.batches if self.batches else 0,
+            'compression_ratio': ratio,
+        }
+
+
+def partition_usage(paths, decompressor=None, inflate_every=0):
+    """
+    Returns a dict of batch type to `UsageStats` for the given segments,
+    reading them in a single pass with the memory-mapped scanner. By default
+    only the batch headers are read. With `inflate_every` set to n, every
+    n-th compressed batch is inflated into the decompressor's reusable buffer
+    and the compression ratio is estimated from that sample.
+    """
+    decompressor = decompressor or default_decompressor()
+    usage = collections.defaultdict(UsageStats)
+    compressed = 0
+    for path in paths:
+        with SegmentScanner(path, verify=False) as scanner:
+            for batch in scanner.batches():
+                size = None
+                if inflate_every and batch.header.attrs & ATTR_COMPRESSION_MASK:
+                    compressed += 1
+                    if compressed % inflate_every == 0:
+                        try:
+                            size = len(
+                                decompressor.records(batch.header,
+                                                     batch.records))
+                        except (RuntimeError, ValueError, OSError) as e:
+                            logger.debug(
+                                "cannot inflate batch {} of {}: {}".format(
+                                    batch.index, path, e))
+                usage[batch.header.type].add(batch.header, size)
+    return usage
+
+
+class Inotify:
+    """
+    Minimal ctypes binding of the linux inotify API.
+    """
+    IN_MODIFY = 0x2
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_Q_OVERFLOW = 0x4000
+    EVENT_STRUCT = struct.Struct("iIII")
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError("inotify is not available on this platform")
+        self._libc = libc
+        self._fd = libc.inotify_init1(os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+    def add_watch(self, path, mask):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_add_watch failed", path)
+        return wd
+
+    def read(self, timeout):
+        """
+        Wait up to `timeout` seconds and return the pending events as
+        (watch descriptor, mask, name) tuples.
+        """
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return []
+        data = os.read(self._fd, 1 << 16)
+        events = []
+        pos = 0
+        while pos < len(data):
+            wd, mask, _, size = self.EVENT_STRUCT.unpack_from(data, pos)
+            pos += self.EVENT_STRUCT.size
+            name = data[pos:pos + size].rstrip(b"\0").decode()
+            pos += size
+            events.append((wd, mask, name))
+        return events
+
+    def close(self):
+        os.close(self._fd)
+
+
+class SegmentFollower:
+    """
+    Incrementally verifies the active segment of an ntp as it grows.
+
+    Only bytes appended since the last call are scanned. The tail of an active
+    segment may be torn, or fail its crc because the broker has not flushed
+    all of it yet. Neither is an error until the segment rolls or, for crc
+    failures, the batch stays corrupt for longer than `grace` seconds.
+    """
+    def __init__(self, ntp, grace):
+        self.ntp = ntp
+        self.grace = grace
+        self.path = None
+        self.position = 0
+        self.batches = 0
+        self.torn = False
+        self._corrupt = None
+        self._corrupt_since = None
+        segments = [
+            p for p in list_segments(ntp.path)
+            if parse_segment_name(p) is not None
+        ]
+        if segments:
+            self.path = segments[-1]
+
+    def advance(self, final=False):
+        """
+        Verify the batches appended since the last call. Raises
+        CorruptBatchError once a corrupt batch is known not to be in flight.
+        """
+        if self.path is None:
+            return
+        try:
+            with SegmentScanner(self.path, position=self.position) as scanner:
+                try:
+                    for _ in scanner:
+                        self.batches += 1
+                    self._corrupt = None
+                except CorruptBatchError as e:
+                    self._corrupt = e
+                self.position = scanner.position
+                self.torn = scanner.torn
+        except FileNotFoundError:
+            logger.info("segment removed: {}".format(self.path))
+            self.path = None
+            self._corrupt = None
+        self.check(final)
+
+    @property
+    def suspect(self):
+        """True while a crc failure at the tail waits out the grace period"""
+        return self._corrupt is not None
+
+    def check(self, final=False):
+        if self._corrupt is None:
+            self._corrupt_since = None
+            return
+        if self._corrupt_since is None:
+            self._corrupt_since = time.monotonic()
+        if final or time.monotonic() - self._corrupt_since >= self.grace:
+            raise self._corrupt
+
+    def roll(self, path):
+        """
+        Finish verifying the current segment and switch to `path`.
+        """
+        if self.path is not None:
+            self.advance(final=True)
+            if self.torn:
+                log_torn_tail(self.path)
+            logger.info("segment rolled: {} ({} batches)".format(
+                self.path, self.batches))
+        self.path = path
+        self.position = 0
+        self.batches = 0
+        self.torn = False
+
+
+S3_PART_SIZE = 8 << 20
+S3_HEADER_READAHEAD = 4096
+# ranged GETs kept in flight for each segment being verified
+S3_SEGMENT_WINDOW = 4
+S3_EMPTY_PAYLOAD_HASH = hashlib.sha256(b"").hexdigest()
+S3_XML_NS = "{http://s3.amazonaws.com/doc/2006-03-01/}"
+
+
+class S3Client:
+    """
+    Minimal S3 client for reading archived segments. Requests are signed
+    with AWS signature version 4 when credentials are given and use path
+    style addressing, which S3 stand-ins such as minio also accept.
+    """
+    def __init__(self, endpoint, region, access_key=None, secret_key=None):
+        self.endpoint = endpoint.rstrip("/")
+        self.host = urllib.parse.urlsplit(self.endpoint).netloc
+        self.region = region
+        self.access_key = access_key
+        self.secret_key = secret_key
+
+    def _signing_key(self, date):
+        key = ("AWS4" + self.secret_key).encode()
+        for part in (date, self.region, "s3", "aws4_request"):
+            key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+        return key
+
+    def _sign(self, method, path, query, headers):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        amz_date = now.strftime("%Y%m%dT%H%M%SZ")
+        date = now.strftime("%Y%m%d")
+        headers["host"] = self.host
+        headers["x-amz-date"] = amz_date
+        headers["x-amz-content-sha256"] = S3_EMPTY_PAYLOAD_HASH
+        signed = sorted(headers)
+        canonical = "\n".join([
+            method,
+            path,
+            query,
+            "".join("{}:{}\n".format(h, headers[h].strip()) for h in signed),
+            ";".join(signed),
+            S3_EMPTY_PAYLOAD_HASH,
+        ])
+        scope = "{}/{}/s3/aws4_request".format(date, self.region)
+        to_sign = "\n".join([
+            "AWS4-HMAC-SHA256", amz_date, scope,
+            hashlib.sha256(canonical.encode()).hexdigest()
+        ])
+        signature = hmac.new(self._signing_key(date), to_sign.encode(),
+                             hashlib.sha256).hexdigest()
+        headers["Authorization"] = (
+            "AWS4-HMAC-SHA256 Credential={}/{}, SignedHeaders={}, "
+            "Signature={}".format(self.access_key, scope, ";".join(signed),
+                                  signature))
+
+    def _request(self, bucket, key="", query=None, byte_range=None):
+        path = urllib.parse.quote("/{}/{}".format(bucket, key), safe="/-_.~")
+        query = "&".join("{}={}".format(urllib.parse.quote(k, safe="-_.~"),
+                                        urllib.parse.quote(v, safe="-_.~"))
+                         for k, v in sorted((query or {}).items()))
+        headers = {}
+        if self.access_key:
+            self._sign("GET", path, query, headers)
+        if byte_range is not None:
+            headers["Range"] = "bytes={}-{}".format(*byte_range)
+        url = self.endpoint + path + ("?" + query if query else "")
+        request = urllib.request.Request(url, headers=headers)
+        with urllib.request.urlopen(request) as response:
+            return response.read()
+
+    def list_objects(self, bucket, prefix=""):
+        """
+        Yields the (key, size) of every object under `prefix`.
+        """
+        query = {"list-type": "2", "prefix": prefix}
+        while True:
+            root = ElementTree.fromstring(self._request(bucket, query=query))
+            for item in root.iter(S3_XML_NS + "Contents"):
+                yield (item.findtext(S3_XML_NS + "Key"),
+                       int(item.findtext(S3_XML_NS + "Size")))
+            token = root.findtext(S3_XML_NS + "NextContinuationToken")
+            if root.findtext(S3_XML_NS + "IsTruncated") != "true" or not token:
+                return
+            query["continuation-token"] = token
+
+    def get_range(self, bucket, key, start, end):
+        """
+        Returns bytes [start, end) of an object.
+        """
+        return self._request(bucket, key, byte_range=(start, end - 1))
+
+
+def remote_parts(client, bucket, key, size, executor, window):
+    """
+    Yields the content of an object in order as `S3_PART_SIZE` parts, keeping
+    up to `window` ranged GETs in flight on the executor.
+    """
+    ranges = ((start, min(start + S3_PART_SIZE, size))
+              for start in range(0, size, S3_PART_SIZE))
+    inflight = collections.deque()
+    for start, end in ranges:
+        inflight.append(
+            executor.submit(client.get_range, bucket, key, start, end))
+        if len(inflight) >= window:
+            yield inflight.popleft().result()
+    while inflight:
+        yield inflight.popleft().result()
+
+
+def verify_remote_segment(client, bucket, key, size, executor, window):
+    """
+    Verify an archived segment while it streams in. Only the parts in flight
+    and the unfinished batch at the end of the last part are held in memory.
+    Returns a `SegmentReport` whose positions are offsets into the object.
+    """
+    buf = bytearray()
+    base = batches = 0
+    last_offset = None
+    torn = False
+    corrupt = (None, None, None)
+    for part in remote_parts(client, bucket, key, size, executor, window):
+        buf += part
+        scanner = SegmentScanner.from_buffer(key, buf)
+        try:
+            for batch in scanner:
+                batches += 1
+                last_offset = batch.last_offset()
+        except CorruptBatchError as e:
+            corrupt = (batches + 1, base + e.batch.position, e.batch.header)
+            torn = False
+            break
+        finally:
+            scanner.close()
+        # a batch that is only partially downloaded looks torn until the
+        # next part arrives
+        torn = scanner.torn
+        # the scanner has released its view, so the buffer can be resized
+        del buf[:scanner.position]
+        base += scanner.position
+        if not torn and len(buf) >= HEADER_SIZE:
+            break
+    return SegmentReport(key, None, size, None, 0, batches, batches, base,
+                         base, last_offset, torn, *corrupt)
+
+
+class RemoteReadahead:
+    """
+    Reads small ranges of an object through consecutive windows of
+    `S3_HEADER_READAHEAD` bytes that are fetched ahead of the reader on an
+    executor.
+
+    While reads move forward into the next window, the number of windows in
+    flight doubles up to `window`, so walking the headers of small batches
+    is not bound by round trips. A read beyond the prefetched windows, i.e.
+    past a large batch, restarts the pipeline at that position with a single
+    window so that large batches are not downloaded.
+    """
+    def __init__(self, client, bucket, key, size, executor, window):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.size = size
+        self.executor = executor
+        self.window = window
+        self._depth = 1
+        self._next = 0
+        # (start, end, future) of the windows in flight, in object order
+        self._windows = collections.deque()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._cancel()
+
+    def _cancel(self):
+        for _, _, future in self._windows:
+            future.cancel()
+        self._windows.clear()
+
+    def _submit(self):
+        end = min(self.size, self._next + S3_HEADER_READAHEAD)
+        self._windows.append(
+            (self._next, end,
+             self.executor.submit(self.client.get_range, self.bucket, self.key,
+                                  self._next, end)))
+        self._next = end
+
+    def read(self, pos, size):
+        """
+        Returns bytes [pos, pos + size) of the object.
+        """
+        start = self._windows[0][0] if self._windows else self._next
+        if pos < start or pos >= self._next + S3_HEADER_READAHEAD:
+            self._cancel()
+            self._depth = 1
+            self._next = pos
+        while self._windows and self._windows[0][1] <= pos:
+            self._windows.popleft()
+            self._depth = min(self.window, self._depth * 2)
+        while self._next < self.size and (
+                len(self._windows) < self._depth
+                or self._next < min(self.size, pos + size)):
+            self._submit()
+        parts = []
+        for start, end, future in self._windows:
+            if start >= pos + size:
                 break
-            next_offset = batch.last_offset() + 1
-            index += 1
+            parts.append(future.result()[max(0, pos - start):pos + size -
+                                         start])
+        return b"".join(parts)
+
+
+def walk_remote_headers(client, bucket, key, size, executor, window):
+    """
+    Walk and check the batch headers of an archived segment without fetching
+    the records. Headers are read through a `RemoteReadahead` that keeps up
+    to `window` ranged GETs in flight on the executor.
+    """
+    pos = batches = 0
+    last_offset = None
+    torn = False
+    corrupt = (None, None, None)
+    with RemoteReadahead(client, bucket, key, size, executor,
+                         window) as reader:
+        while pos < size:
+            if size - pos < HEADER_SIZE:
+                torn = True
+                break
+            buf = reader.read(pos, HEADER_SIZE)
+            header = Header._make(HDR_STRUCT_RP.unpack_from(buf))
+            if not any(header):
+                break
+            crc = crc32c.crc32(buf[HEADER_CRC_START:])
+            if crc != header.header_crc:
+                corrupt = (batches + 1, pos, header)
+                break
+            if header.batch_size < HEADER_SIZE or \
+               pos + header.batch_size > size:
+                torn = True
+                break
+            batches += 1
+            last_offset = header.base_offset + header.record_count - 1
+            pos += header.batch_size
+    return SegmentReport(key, None, size, None, 0, batches, batches, pos, pos,
+                         last_offset, torn, *corrupt)
+
+
+RepairAction = collections.namedtuple(
+    'RepairAction',
+    ('action', 'path', 'reason', 'size', 'truncate_to', 'last_offset'))
+
+REPAIR_TRUNCATE = "truncate"
+REPAIR_REMOVE = "remove"
+REPAIR_REASON_TORN = "torn_tail"
+REPAIR_REASON_CORRUPT = "corrupt_batch"
+REPAIR_REASON_STALE_INDEX = "stale_index"
+REPAIR_REASON_AFTER_TRUNCATION = "after_truncation"
+
+
+def _remove_segment_actions(path, reason):
+    segment = Segment(path)
+    actions = [
+        RepairAction(REPAIR_REMOVE, path, reason, os.path.getsize(path), None,
+                     None)
+    ]
+    for index in (segment.index_path, segment.compaction_index_path):
+        if os.path.exists(index):
+            actions.append(
+                RepairAction(REPAIR_REMOVE, index, REPAIR_REASON_STALE_INDEX,
+                             os.path.getsize(index), None, None))
+    return actions
+
+
+def plan_repair(paths):
+    """
+    Plan the repair of the segments of one ntp, ordered by base offset. The
+    first torn or corrupt segment is cut just past its last valid batch, or
+    removed when it has none, and its indexes are dropped because they may
+    point past the cut. Later segments are removed so that what remains is a
+    gap free prefix of the log. Returns an empty list for a healthy ntp.
+    """
+    for i, path in enumerate(paths):
+        cut = reason = last_offset = None
+        try:
+            with SegmentScanner(path) as scanner:
+                for batch in scanner:
+                    last_offset = batch.last_offset()
+                if scanner.torn:
+                    cut, reason = scanner.position, REPAIR_REASON_TORN
+        except CorruptBatchError as e:
+            cut, reason = e.batch.position, REPAIR_REASON_CORRUPT
+        if cut is None:
+            continue
+        actions = _remove_segment_actions(path, reason)
+        if cut > 0:
+            actions[0] = RepairAction(REPAIR_TRUNCATE, path, reason,
+                                      actions[0].size, cut, last_offset)
+        for later in paths[i + 1:]:
+            actions.extend(
+                _remove_segment_actions(later, REPAIR_REASON_AFTER_TRUNCATION))
+        return actions
+    return []
+
+
+def repair_in_place(actions):
+    for action in actions:
+        if action.action == REPAIR_TRUNCATE:
+            os.truncate(action.path, action.truncate_to)
+        else:
+            os.remove(action.path)
+        logger.info("{} {}".format(action.action, action.path))
+
+
+def write_repaired_copy(src_dir, dst_dir, actions, chunk=1 << 20):
+    """
+    Copy the files of an ntp directory to `dst_dir` with the repair applied,
+    leaving the original untouched.
+    """
+    planned = {action.path: action for action in actions}
+    os.makedirs(dst_dir, exist_ok=True)
+    for name in sorted(os.listdir(src_dir)):
+        src = os.path.join(src_dir, name)
+        action = planned.get(src)
+        if not os.path.isfile(src) or (action
+                                       and action.action == REPAIR_REMOVE):
+            continue
+        dst = os.path.join(dst_dir, name)
+        if action is None:
+            shutil.copyfile(src, dst)
+            continue
+        remaining = action.truncate_to
+        with open(src, "rb") as fin, open(dst, "wb") as fout:
+            while remaining:
+                data = fin.read(min(chunk, remaining))
+                fout.write(data)
+                remaining -= len(data)
 
 
 class Ntp:
@@ -120,8 +2139,7 @@ class Ntp:
         self.ntp_id = ntp_id
         self.path = os.path.join(self.base_dir, self.nspace, self.topic,
                                  f"{self.partition}_{self.ntp_id}")
-        pattern = os.path.join(self.path, "*.log")
-        self.segments = glob.iglob(pattern)
+        self.segments = list_segments(self.path)
 
     def __str__(self):
         return "{0.nspace}/{0.topic}/{0.partition}_{0.ntp_id}".format(self)
@@ -150,31 +2168,663 @@ def main():
 
     def generate_options():
         parser = argparse.ArgumentParser(description='Redpanda log analyzer')
+        # each of these selects what the tool does instead of verifying the
+        # segments under --path, so at most one of them may be given
+        modes = parser.add_mutually_exclusive_group()
         parser.add_argument('--path',
                             type=str,
                             help='Path to the log desired to be analyzed')
+        parser.add_argument(
+            '--mmap',
+            action='store_true',
+            help='Use the zero-copy memory-mapped scanner to read segments')
+        parser.add_argument(
+            '--jobs',
+            type=int,
+            default=1,
+            help='Number of processes used to verify segments in parallel')
+        modes.add_argument('--records',
+                           action='store_true',
+                           help='Decode and print individual records')
+        parser.add_argument('--min-offset',
+                            type=int,
+                            help='Only print records at or above this offset')
+        parser.add_argument('--max-offset',
+                            type=int,
+                            help='Only print records at or below this offset')
+        parser.add_argument(
+            '--min-timestamp',
+            type=int,
+            help='Only print records at or after this timestamp (ms)')
+        parser.add_argument(
+            '--max-timestamp',
+            type=int,
+            help='Only print records at or before this timestamp (ms)')
+        modes.add_argument(
+            '--compaction-report',
+            action='store_true',
+            help='Estimate key cardinality and compaction savings from the '
+            'compaction indexes')
+        parser.add_argument(
+            '--hll-precision',
+            type=int,
+            default=14,
+            help='HyperLogLog precision used by --compaction-report')
+        parser.add_argument(
+            '--cache',
+            type=str,
+            help='Verification cache file. Segments verified by a previous run '
+            'are skipped and growing segments are resumed where the last run '
+            'stopped')
+        modes.add_argument(
+            '--export-headers',
+            type=str,
+            help='Directory to write per-ntp NumPy archives of batch headers')
+        modes.add_argument(
+            '--continuity',
+            action='store_true',
+            help='Check offset continuity and term order across the segments '
+            'of each ntp')
+        modes.add_argument(
+            '--diff-replicas',
+            nargs='+',
+            help='Find where replicas of one ntp diverge. Each replica is an '
+            'ntp directory, local or as host:directory (read over ssh)')
+        parser.add_argument(
+            '--remote-tool',
+            type=str,
+            default=os.path.abspath(__file__),
+            help='Path of this tool on remote hosts used by --diff-replicas')
+        modes.add_argument(
+            '--chain-server',
+            action='store_true',
+            help='Serve hash chain queries for the ntp directory at --path on '
+            'stdin/stdout (used by --diff-replicas)')
+        modes.add_argument(
+            '--decode-internal',
+            action='store_true',
+            help='Decode controller commands and kvstore entries as JSON lines '
+            'followed by a summary of the command types')
+        modes.add_argument(
+            '--usage',
+            action='store_true',
+            help='Report disk usage per ntp, topic and batch type')
+        parser.add_argument(
+            '--usage-format',
+            choices=['table', 'json'],
+            default='table',
+            help='Output format of --usage. Table rows are whitespace '
+            'separated so they can be ordered with sort -k')
+        modes.add_argument(
+            '--follow',
+            action='store_true',
+            help='Keep verifying the active segment of each ntp as it is '
+            'written, following segment rolls')
+        parser.add_argument(
+            '--usage-inflate-every',
+            type=int,
+            default=0,
+            help='With --usage, inflate every n-th compressed batch to '
+            'estimate compression ratios. By default only batch headers are '
+            'read')
+        parser.add_argument(
+            '--follow-grace',
+            type=float,
+            default=5.0,
+            help='Seconds a crc failure at the tail of an active segment may '
+            'persist before it is reported as corruption')
+        modes.add_argument(
+            '--s3-bucket',
+            type=str,
+            help='Verify the archived segments of this bucket instead of a '
+            'local data directory. Credentials are read from '
+            'AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY')
+        parser.add_argument('--s3-prefix',
+                            type=str,
+                            default='',
+                            help='Only verify objects under this key prefix')
+        parser.add_argument('--s3-region',
+                            type=str,
+                            default=os.environ.get('AWS_REGION', 'us-east-1'),
+                            help='Region used to sign requests')
+        parser.add_argument(
+            '--endpoint',
+            type=str,
+            help='S3 endpoint URL, e.g. http://localhost:9000 for minio. '
+            'Defaults to the AWS endpoint of --s3-region')
+        parser.add_argument(
+            '--s3-concurrency',
+            type=int,
+            default=16,
+            help='Number of ranged GETs kept in flight with --s3-bucket')
+        parser.add_argument(
+            '--headers-only',
+            action='store_true',
+            help='With --s3-bucket, only fetch and check batch headers '
+            'instead of downloading and verifying whole segments')
+        modes.add_argument(
+            '--repair',
+            action='store_true',
+            help='Print a JSON plan that truncates each ntp to its last valid '
+            'batch. Nothing is changed unless --repair-output or '
+            '--repair-in-place is also given')
+        repair = parser.add_mutually_exclusive_group()
+        repair.add_argument(
+            '--repair-output',
+            type=str,
+            help='Write repaired copies of the ntps that need repair to this '
+            'directory')
+        repair.add_argument(
+            '--repair-in-place',
+            action='store_true',
+            help='Apply the repair plan to the data directory itself')
         return parser
 
     parser = generate_options()
     options, program_options = parser.parse_known_args()
+    if (options.repair_output
+            or options.repair_in_place) and not options.repair:
+        parser.error("--repair-output and --repair-in-place require --repair")
+    parallel = options.jobs > 1 or options.cache
+    if options.mmap and parallel:
+        parser.error("--mmap cannot be combined with --jobs or --cache, which "
+                     "always use the memory-mapped scanner")
+    if (options.mmap or parallel) and any(
+            getattr(options, dest)
+            for dest in ('records', 'compaction_report', 'export_headers',
+                         'continuity', 'diff_replicas', 'chain_server',
+                         'decode_internal', 'usage', 'follow', 's3_bucket',
+                         'repair')):
+        parser.error("--mmap, --jobs and --cache only apply to segment "
+                     "verification")
     logger.info("%s" % options)
+    if options.diff_replicas:
+        report_divergence(options.diff_replicas, options.remote_tool)
+        return
+    if options.s3_bucket:
+        endpoint = options.endpoint or "https://s3.{}.amazonaws.com".format(
+            options.s3_region)
+        client = S3Client(endpoint, options.s3_region,
+                          os.environ.get('AWS_ACCESS_KEY_ID'),
+                          os.environ.get('AWS_SECRET_ACCESS_KEY'))
+        verify_bucket(client, options.s3_bucket, options.s3_prefix,
+                      options.s3_concurrency, options.headers_only)
+        return
     if not os.path.exists(options.path):
         logger.error("Path doesn't exist %s" % options.path)
         sys.exit(1)
+    if options.chain_server:
+        serve_chain(options.path)
+        return
     store = Store(options.path)
+    if options.follow:
+        follow_store(store, options.follow_grace)
+        return
+    if options.repair:
+        repair_store(store, options.repair_output, options.repair_in_place)
+        return
+    if options.decode_internal:
+        decode_internal(store)
+        return
+    if options.usage:
+        report_usage(store, options.usage_format, options.usage_inflate_every)
+        return
+    if options.continuity:
+        report_continuity(store)
+        return
+    if options.export_headers:
+        export_headers(store, options.export_headers)
+        return
+    if options.compaction_report:
+        report_compaction(store, options.hll_precision)
+        return
+    if options.records:
+        dump_records(store, options)
+        return
+    if parallel:
+        cache = VerificationCache(options.cache) if options.cache else None
+        verify_store(store, options.jobs, cache)
+        return
     for ntp in store.ntps:
         for path in ntp.segments:
+            s = Segment(path)
             try:
-                s = Segment(path)
+                s.verify(use_mmap=options.mmap)
             except CorruptBatchError as e:
-                logger.error(
-                    "corruption detected in batch {} of segment: {}".format(
-                        e.batch.index, path))
-                logger.error("header of corrupt batch: {}".format(
-                    e.batch.header))
+                log_corruption(path, e.batch.index, e.batch.header)
+                sys.exit(1)
+            if s.torn:
+                log_torn_tail(path, fatal=True)
                 sys.exit(1)
             logger.info("successfully decoded segment: {}".format(path))
 
 
+def dump_records(store, options):
+    filters = dict(min_offset=options.min_offset,
+                   max_offset=options.max_offset,
+                   min_ts=options.min_timestamp,
+                   max_ts=options.max_timestamp)
+    for ntp in store.ntps:
+        for path in ntp.segments:
+            segment = Segment(path)
+            # use the offset index to skip straight to the first candidate
+            position = 0
+            if options.min_offset is not None:
+                position = segment.seek(options.min_offset)
+            elif options.min_timestamp is not None:
+                position = segment.seek_time(options.min_timestamp)
+            if position is None:
+                continue
+            try:
+                for record in scan_records(path, position, **filters):
+                    key = None if record.key is None else bytes(record.key)
+                    value_size = 0 if record.value is None else len(
+                        record.value)
+                    print("{} offset={} timestamp={} key={} value_size={}".
+                          format(ntp, record.offset, record.timestamp, key,
+                                 value_size))
+            except CorruptBatchError as e:
+                log_corruption(path, e.batch.index, e.batch.header)
+                sys.exit(1)
+    decompressor = default_decompressor()
+    for codec, ratio in sorted(decompressor.ratios().items()):
+        batches, compressed, uncompressed = decompressor.stats[codec]
+        print("codec={} batches={} compressed={} uncompressed={} ratio={:.2f}".
+              format(codec, batches, compressed, uncompressed, ratio))
+
+
+def print_compaction_report(report):
+    print("{} keys={} distinct={} records={} bytes={} duplicate_ratio={:.3f} "
+          "reclaimable_bytes={}".format(*report))
+
+
+def report_compaction(store, precision):
+    """
+    Estimate compaction savings per segment and per partition. Key
+    cardinality is tracked with HyperLogLog, so memory use is bounded no
+    matter how many keys a partition holds.
+    """
+    for ntp in store.ntps:
+        ntp_hll = HyperLogLog(precision)
+        ntp_keys = ntp_records = ntp_size = 0
+        for path in ntp.segments:
+            segment = Segment(path)
+            if not os.path.exists(segment.compaction_index_path):
+                continue
+            hll = HyperLogLog(precision)
+            keys = 0
+            try:
+                with CompactionIndex(segment.compaction_index_path) as index:
+                    index.verify()
+                    for entry in index:
+                        if entry.type == COMPACTION_ENTRY_KEY:
+                            hll.add(entry.key)
+                            keys += 1
+            except CorruptIndexError as e:
+                logger.error("skipping corrupt compaction index: {}".format(e))
+                continue
+            records, size = segment_data_size(path)
+            print_compaction_report(
+                compaction_report(path, hll, keys, records, size))
+            ntp_hll.merge(hll)
+            ntp_keys += keys
+            ntp_records += records
+            ntp_size += size
+        if ntp_keys:
+            print_compaction_report(
+                compaction_report(str(ntp), ntp_hll, ntp_keys, ntp_records,
+                                  ntp_size))
+
+
+def export_headers(store, outdir):
+    """
+    Write the batch headers of every ntp to `<outdir>/<ntp>.npz`. Each file
+    holds the structured `headers` array, the file `positions` of the batches,
+    and a `segment` column indexing into the `segments` array of paths.
+    """
+    if np is None:
+        logger.error("header export requires numpy")
+        sys.exit(1)
+    for ntp in store.ntps:
+        headers = []
+        positions = []
+        segment_ids = []
+        # base offset order, so the concatenated headers are in log order
+        paths = ntp.segments
+        for i, path in enumerate(paths):
+            h, p = export_segment_headers(path)
+            headers.append(h)
+            positions.append(p)
+            segment_ids.append(np.full(len(h), i, dtype=np.int32))
+        if not paths:
+            continue
+        headers = np.concatenate(headers)
+        out = os.path.join(outdir, str(ntp) + ".npz")
+        os.makedirs(os.path.dirname(out), exist_ok=True)
+        np.savez(out,
+                 headers=headers,
+                 positions=np.concatenate(positions),
+                 segment=np.concatenate(segment_ids),
+                 segments=np.array(paths))
+        summary = summarize_headers(headers)
+        print("{} {}".format(
+            ntp, " ".join("{}={}".format(k, v) for k, v in summary.items())))
+
+
+def decode_internal(store):
+    """
+    Stream the decoded records of internal batches as JSON lines, followed by
+    one summary line per command type with its count and bytes, ordered by the
+    bytes replayed at startup.
+    """
+    summary = collections.defaultdict(lambda: [0, 0])
+    for ntp in store.ntps:
+        for path in ntp.segments:
+            try:
+                with SegmentScanner(path) as scanner:
+                    for batch in scanner.batches():
+                        if batch.header.type == RAFT_DATA_BATCH_TYPE:
+                            continue
+                        for entry in decode_internal_batch(batch):
+                            entry['ntp'] = str(ntp)
+                            print(json.dumps(entry))
+                            stats = summary[(str(ntp), entry['command'])]
+                            stats[0] += 1
+                            stats[1] += entry['size']
+            except CorruptBatchError as e:
+                log_corruption(path, e.batch.index, e.batch.header)
+                sys.exit(1)
+    for (ntp, command), (count, size) in sorted(summary.items(),
+                                                key=lambda i: -i[1][1]):
+        print(
+            json.dumps({
+                'summary': True,
+                'ntp': ntp,
+                'command': command,
+                'count': count,
+                'bytes': size
+            }))
+
+
+def report_usage(store, fmt, inflate_every=0):
+    """
+    Print disk usage per ntp as each one is scanned, then per topic and for
+    the whole store. Only the topic totals are kept in memory.
+    """
+    def emit(scope, batch_type, stats):
+        row = stats.to_dict()
+        if fmt == 'json':
+            print(json.dumps(dict(scope=scope, batch_type=batch_type, **row)))
+        else:
+            print("{:<48} {:<22} ".format(scope, batch_type) +
+                  " ".join("{:>17}".format(str(row[c]))
+                           for c in USAGE_COLUMNS))
+
+    def emit_all(scope, usage):
+        total = UsageStats()
+        for batch_type, stats in sorted(usage.items()):
+            emit(scope, BATCH_TYPE_NAMES.get(batch_type, str(batch_type)),
+                 stats)
+            total.merge(stats)
+        emit(scope, 'all', total)
+
+    if fmt == 'table':
+        print("{:<48} {:<22} ".format('scope', 'batch_type') +
+              " ".join("{:>17}".format(c) for c in USAGE_COLUMNS))
+    topics = collections.defaultdict(
+        lambda: collections.defaultdict(UsageStats))
+    for ntp in store.ntps:
+        usage = partition_usage(ntp.segments, inflate_every=inflate_every)
+        emit_all(str(ntp), usage)
+        topic = topics["{}/{}".format(ntp.nspace, ntp.topic)]
+        for batch_type, stats in usage.items():
+            topic[batch_type].merge(stats)
+    total = collections.defaultdict(UsageStats)
+    for name, usage in sorted(topics.items()):
+        emit_all(name, usage)
+        for batch_type, stats in usage.items():
+            total[batch_type].merge(stats)
+    emit_all('*', total)
+
+
+def follow_store(store, grace):
+    """
+    Watch the ntp directories of the store with inotify and verify batches as
+    they are appended to the active segments. Events are coalesced per ntp so
+    the work done follows the write rate rather than the number of writes.
+    """
+    def corruption(follower, e):
+        log_corruption(follower.path, follower.batches + 1, e.batch.header)
+        logger.error("corrupt batch starts at file position {}".format(
+            e.batch.position))
+        sys.exit(1)
+
+    mask = (Inotify.IN_MODIFY | Inotify.IN_CLOSE_WRITE | Inotify.IN_CREATE
+            | Inotify.IN_MOVED_TO)
+    try:
+        inotify = Inotify()
+    except OSError as e:
+        logger.error("follow mode requires inotify: {}".format(e))
+        sys.exit(1)
+    followers = {}
+    for ntp in store.ntps:
+        followers[inotify.add_watch(ntp.path,
+                                    mask)] = SegmentFollower(ntp, grace)
+    logger.info("following {} ntps".format(len(followers)))
+    try:
+        pending = set(followers)
+        while True:
+            for wd in pending:
+                follower = followers[wd]
+                try:
+                    follower.advance()
+                except CorruptBatchError as e:
+                    corruption(follower, e)
+            pending = set()
+            events = inotify.read(timeout=min(grace, 1.0))
+            for wd, event, name in events:
+                if event & Inotify.IN_Q_OVERFLOW:
+                    pending.update(followers)
+                    continue
+                follower = followers.get(wd)
+                segment = parse_segment_name(name)
+                if follower is None or segment is None:
+                    continue
+                path = os.path.join(follower.ntp.path, name)
+                active = follower.path and parse_segment_name(follower.path)
+                if active is None or segment[0] > active[0]:
+                    try:
+                        follower.roll(path)
+                    except CorruptBatchError as e:
+                        corruption(follower, e)
+                if path == follower.path:
+                    pending.add(wd)
+            # re-check followers waiting out the grace period of a crc failure
+            pending.update(wd for wd, f in followers.items() if f.suspect)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        inotify.close()
+
+
+def verify_bucket(client, bucket, prefix, concurrency, headers_only):
+    """
+    Verify the archived segments of a bucket. Segments are read concurrently
+    and each one is streamed through a window of ranged GETs, so nothing is
+    written to local disk and memory use is bounded by `concurrency` parts.
+    """
+    segments = [(key, size)
+                for key, size in client.list_objects(bucket, prefix)
+                if parse_segment_name(key) is not None]
+    segments.sort(key=lambda s: -s[1])
+    window = min(concurrency, S3_SEGMENT_WINDOW)
+    walkers = max(1, concurrency // window)
+    batches = size = 0
+    with concurrent.futures.ThreadPoolExecutor(concurrency) as fetchers, \
+            concurrent.futures.ThreadPoolExecutor(walkers) as pool:
+        if headers_only:
+            futures = [
+                pool.submit(walk_remote_headers, client, bucket, key, length,
+                            fetchers, window) for key, length in segments
+            ]
+        else:
+            futures = [
+                pool.submit(verify_remote_segment, client, bucket, key, length,
+                            fetchers, window) for key, length in segments
+            ]
+        for future in concurrent.futures.as_completed(futures):
+            report = future.result()
+            if report.corrupt_index is not None:
+                for f in futures:
+                    f.cancel()
+                log_corruption(report.path, report.corrupt_index,
+                               report.corrupt_header)
+                logger.error("corrupt batch starts at object offset {}".format(
+                    report.corrupt_position))
+                sys.exit(1)
+            if report.torn:
+                # uploaded segments are never appended to, so unlike the
+                # active segment of a local ntp a torn tail is not in flight
+                for f in futures:
+                    f.cancel()
+                log_torn_tail(report.path, fatal=True)
+                sys.exit(1)
+            batches += report.batches
+            size += report.bytes
+            logger.info(
+                "successfully decoded segment: {} ({} batches, {} bytes)".
+                format(report.path, report.batches, report.bytes))
+    logger.info(
+        "verified {} segments in s3://{}/{}: {} batches, {} bytes".format(
+            len(segments), bucket, prefix, batches, size))
+
+
+def repair_store(store, output=None, in_place=False):
+    """
+    Print the repair plan of every ntp as JSON lines, then apply all of it
+    either to copies under `output` or, with `in_place`, to the store.
+    """
+    plans = []
+    for ntp in store.ntps:
+        actions = plan_repair(ntp.segments)
+        if actions:
+            plans.append((ntp, actions))
+        print(
+            json.dumps({
+                'ntp': str(ntp),
+                'path': ntp.path,
+                'actions': [action._asdict() for action in actions]
+            }))
+    sys.stdout.flush()
+    for ntp, actions in plans:
+        if in_place:
+            repair_in_place(actions)
+        elif output:
+            dst = os.path.join(output, os.path.relpath(ntp.path,
+                                                       store.base_dir))
+            write_repaired_copy(ntp.path, dst, actions)
+            logger.info("wrote repaired copy of {} to {}".format(ntp, dst))
+
+
+def report_continuity(store):
+    issues = 0
+    for ntp in store.ntps:
+        for issue in check_continuity(ntp.segments):
+            issues += 1
+            print(
+                "{} {} in {} at file position {}: expected {} found {}".format(
+                    ntp, issue.kind, issue.path, issue.position,
+                    issue.expected, issue.found))
+    if issues:
+        logger.error("found {} continuity issues".format(issues))
+        sys.exit(1)
+
+
+def report_divergence(specs, tool):
+    replicas = [open_replica(spec, tool) for spec in specs]
+    try:
+        index, lengths = find_divergence(replicas)
+        for replica, length in zip(replicas, lengths):
+            print("{} batches={}".format(replica.name, length))
+        if index == min(lengths):
+            print("replicas agree on their first {} batches".format(index))
+            return
+        print("replicas diverge at batch {}".format(index))
+        for replica in replicas:
+            entry = replica.entry(index)
+            print("{} base_offset={} term={} crc={}".format(
+                replica.name, entry.base_offset, entry.term, entry.crc))
+        sys.exit(1)
+    finally:
+        for replica in replicas:
+            replica.close()
+
+
+def log_corruption(path, index, header):
+    logger.error("corruption detected in batch {} of segment: {}".format(
+        index, path))
+    logger.error("header of corrupt batch: {}".format(header))
+
+
+def log_torn_tail(path, fatal=False):
+    log = logger.error if fatal else logger.warning
+    log("segment ends with a partially written batch: {}".format(path))
+
+
+def verify_store(store, jobs, cache=None):
+    """
+    Verify every segment of `store`. With a cache, a torn tail on the active
+    (last) segment of an ntp is expected while it is being written: it is
+    logged and recorded, and the next pass resumes from the last complete
+    batch instead of failing.
+    """
+    work = []
+    skipped = 0
+    active = set()
+    for ntp in store.ntps:
+        if ntp.segments:
+            active.add(ntp.segments[-1])
+        for path in ntp.segments:
+            resume = cache.resume_point(path) if cache else (0, 0)
+            if resume is None:
+                logger.info(
+                    "segment unchanged since last verification: {}".format(
+                        path))
+                skipped += 1
+                continue
+            work.append((path, ) + resume)
+    segments = batches = size = 0
+    try:
+        for report in verify_segments(work, jobs):
+            segments += 1
+            batches += report.batches
+            size += report.bytes
+            if report.corrupt_index is not None:
+                log_corruption(report.path, report.corrupt_index,
+                               report.corrupt_header)
+                logger.error("corrupt batch starts at file position {}".format(
+                    report.corrupt_position))
+                sys.exit(1)
+            if cache:
+                cache.update(report)
+            if report.torn and cache and report.path in active:
+                log_torn_tail(report.path)
+                logger.info("will retry the tail of the active segment on "
+                            "the next pass: {}".format(report.path))
+                continue
+            if report.torn:
+                log_torn_tail(report.path, fatal=True)
+                sys.exit(1)
+            logger.info(
+                "successfully decoded segment: {} ({} batches, {} bytes)".
+                format(report.path, report.batches, report.bytes))
+    finally:
+        if cache:
+            cache.save()
+    logger.info(
+        "verified {} segments: {} batches, {} bytes ({} unchanged)".format(
+            segments, batches, size, skipped))
+
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,447 @@
+#!/usr/bin/env python3
+# Copyright 2021 Vectorized, Inc.
+#
+# Use of this software is governed by the Business Source License
+# included in the file licenses/BSL.md
+#
+# As of the Change Date specified in that file, in accordance with
+# the Business Source License, use of this software will be governed
+# by the Apache License, Version 2.0
+
+import os
+import sys
+import collections
+import gzip
+import logging
+import random
+import shutil
+import struct
+import tempfile
+import time
+
+import crc32c
+
+sys.path.append(os.path.dirname(__file__))
+import storage
+from storage import (HEADER_SIZE, HDR_FMT_CRC, HDR_FMT_RP_PREFIX_NO_CRC,
+                     HDR_STRUCT_CRC_BE, INDEX_VERSION, CODEC_NONE, CODEC_GZIP,
+                     CODEC_SNAPPY, CODEC_LZ4, CODEC_ZSTD, CODEC_NAMES)
+
+logger = logging.getLogger('rp')
+
+HDR_STRUCT_NO_HEADER_CRC = struct.Struct("<" + HDR_FMT_RP_PREFIX_NO_CRC +
+                                         HDR_FMT_CRC)
+
+# the broker adds an index entry roughly every 32KiB of batches
+DEFAULT_INDEX_STEP = 32 * 1024
+
+
+def encode_varint(value):
+    """
+    Zig-zag varint encoding, the inverse of storage.read_varint.
+    """
+    value = (value << 1) ^ (value >> 63)
+    out = bytearray()
+    while True:
+        b = value & 0x7f
+        value >>= 7
+        if value:
+            out.append(b | 0x80)
+        else:
+            out.append(b)
+            return bytes(out)
+
+
+def encode_varbytes(data):
+    if data is None:
+        return encode_varint(-1)
+    return encode_varint(len(data)) + data
+
+
+def encode_record(offset_delta, timestamp_delta, key, value, headers=()):
+    """
+    Encode a single kafka v2 record, including its length prefix.
+    """
+    body = b"".join([
+        b"\x00",
+        encode_varint(timestamp_delta),
+        encode_varint(offset_delta),
+        encode_varbytes(key),
+        encode_varbytes(value),
+        encode_varint(len(headers)),
+    ] + [encode_varbytes(k) + encode_varbytes(v) for k, v in headers])
+    return encode_varint(len(body)) + body
+
+
+def compress(codec, data):
+    if codec == CODEC_NONE:
+        return data
+    if codec == CODEC_GZIP:
+        return gzip.compress(data)
+    if codec == CODEC_SNAPPY:
+        return storage.snappy.compress(data)
+    if codec == CODEC_LZ4:
+        return storage.lz4.frame.compress(data)
+    if codec == CODEC_ZSTD:
+        return storage.zstandard.ZstdCompressor().compress(data)
+    raise ValueError("unknown compression codec {}".format(codec))
+
+
+def encode_batch(base_offset,
+                 records,
+                 record_count,
+                 first_ts,
+                 max_ts,
+                 codec=CODEC_NONE,
+                 batch_type=storage.RAFT_DATA_BATCH_TYPE):
+    """
+    Encode a batch in the on-disk redpanda format. `records` is the
+    uncompressed records section. Both crcs are computed exactly the way
+    storage.Batch verifies them.
+    """
+    records = compress(codec, records)
+    batch_size = HEADER_SIZE + len(records)
+    tail = (codec, record_count - 1, first_ts, max_ts, -1, -1, -1,
+            record_count)
+    crc = crc32c.crc32(HDR_STRUCT_CRC_BE.pack(*tail))
+    crc = crc32c.crc32(records, crc)
+    header = HDR_STRUCT_NO_HEADER_CRC.pack(batch_size, base_offset, batch_type,
+                                           crc, *tail)
+    return struct.pack("<I", crc32c.crc32(header)) + header + records
+
+
+class SegmentWriter:
+    """
+    Appends encoded batches to a segment file and builds the matching
+    `.base_index` the same way storage::index_state::maybe_index does. The
+    index is only written when the xxhash module is available to checksum
+    it.
+    """
+    def __init__(self, path, index_step=DEFAULT_INDEX_STEP):
+        self.path = path
+        self.index_step = index_step
+        self.size = 0
+        self._file = open(path, "wb")
+        self._accumulator = 0
+        self._base_offset = None
+        self._base_ts = None
+        self._max_offset = 0
+        self._max_ts = 0
+        self._entries = []
+
+    def append(self, batch, base_offset, last_offset, first_ts, max_ts):
+        if self._base_offset is None:
+            self._base_offset = base_offset
+            self._base_ts = first_ts
+            self._max_ts = first_ts
+        last_ts = max(first_ts, max_ts)
+        self._max_offset = last_offset
+        self._max_ts = max(self._max_ts, last_ts)
+        if not self._entries or self._accumulator >= self.index_step:
+            self._entries.append((base_offset - self._base_offset,
+                                  last_ts - self._base_ts, self.size))
+            self._accumulator = 0
+        self._file.write(batch)
+        self.size += len(batch)
+        self._accumulator += len(batch)
+
+    def close(self):
+        self._file.close()
+        if storage.xxhash is None or not self._entries:
+            return
+        rel_offsets, rel_times, positions = zip(*self._entries)
+        count = len(self._entries)
+        body = struct.pack("<IqqqqI", 0, self._base_offset, self._max_offset,
+                           self._base_ts, self._max_ts, count)
+        body += struct.pack("<{}I".format(count), *rel_offsets)
+        body += struct.pack("<{}I".format(count), *rel_times)
+        body += struct.pack("<{}Q".format(count), *positions)
+        checksum = storage.xxhash.xxh64_intdigest(body)
+        index_path = os.path.splitext(self.path)[0] + ".base_index"
+        with open(index_path, "wb") as f:
+            f.write(
+                struct.pack("<bIQ", INDEX_VERSION,
+                            len(body) + 8, checksum) + body)
+
+
+Workload = collections.namedtuple(
+    'Workload',
+    ('partitions', 'partition_bytes', 'segment_bytes', 'records_per_batch',
+     'key_size', 'value_size', 'key_cardinality', 'codec', 'start_ts',
+     'ts_step', 'term', 'corrupt_every', 'gap_every', 'seed'))
+
+DEFAULT_WORKLOAD = Workload(partitions=4,
+                            partition_bytes=64 << 20,
+                            segment_bytes=16 << 20,
+                            records_per_batch=10,
+                            key_size=16,
+                            value_size=1024,
+                            key_cardinality=10000,
+                            codec=CODEC_NONE,
+                            start_ts=1600000000000,
+                            ts_step=1,
+                            term=1,
+                            corrupt_every=0,
+                            gap_every=0,
+                            seed=0)
+
+# number of distinct record sections generated per partition. batches cycle
+# through them, which keeps generation fast while still varying keys.
+PAYLOAD_VARIANTS = 16
+
+
+def _payloads(workload, rng):
+    payloads = []
+    for variant in range(PAYLOAD_VARIANTS):
+        records = []
+        for i in range(workload.records_per_batch):
+            key = None
+            if workload.key_cardinality:
+                key = "{:0{}d}".format(rng.randrange(workload.key_cardinality),
+                                       workload.key_size).encode()
+            value = rng.randbytes(workload.value_size)
+            records.append(encode_record(i, i * workload.ts_step, key, value))
+        payloads.append(b"".join(records))
+    return payloads
+
+
+def generate_ntp(path, workload):
+    """
+    Write the segments of one partition into directory `path`. Returns the
+    number of batches written.
+
+    Every `corrupt_every`-th batch has a byte of its records flipped after the
+    crc is computed, and every `gap_every`-th batch skips a batch worth of
+    offsets.
+    """
+    os.makedirs(path, exist_ok=True)
+    rng = random.Random(workload.seed)
+    payloads = _payloads(workload, rng)
+    count = workload.records_per_batch
+    offset = 0
+    ts = workload.start_ts
+    written = 0
+    batches = 0
+    writer = None
+    while written < workload.partition_bytes:
+        if writer is None or writer.size >= workload.segment_bytes:
+            if writer:
+                writer.close()
+            writer = SegmentWriter(
+                os.path.join(path,
+                             "{}-{}-v1.log".format(offset, workload.term)))
+        batches += 1
+        if workload.gap_every and batches % workload.gap_every == 0:
+            offset += count
+        max_ts = ts + (count - 1) * workload.ts_step
+        batch = encode_batch(offset, payloads[batches % len(payloads)], count,
+                             ts, max_ts, workload.codec)
+        if workload.corrupt_every and batches % workload.corrupt_every == 0:
+            batch = bytearray(batch)
+            batch[-1] ^= 0xff
+            batch = bytes(batch)
+        writer.append(batch, offset, offset + count - 1, ts, max_ts)
+        written += len(batch)
+        offset += count
+        ts = max_ts + workload.ts_step
+    if writer:
+        writer.close()
+    return batches
+
+
+def generate_store(root, workload, namespace="kafka", topic="bench"):
+    """
+    Write a data directory with `workload.partitions` partitions of `topic`.
+    """
+    for partition in range(workload.partitions):
+        path = os.path.join(root, namespace, topic, "{}_1".format(partition))
+        generate_ntp(path, workload._replace(seed=workload.seed + partition))
+
+
+def _store_bytes(store):
+    return sum(
+        os.path.getsize(path) for ntp in store.ntps for path in ntp.segments)
+
+
+def _consume(iterable):
+    for _ in iterable:
+        pass
+
+
+def _bench_read(store):
+    for ntp in store.ntps:
+        for path in ntp.segments:
+            storage.Segment(path).verify(use_mmap=False)
+
+
+def _bench_mmap(store):
+    for ntp in store.ntps:
+        for path in ntp.segments:
+            storage.Segment(path).verify(use_mmap=True)
+
+
+def _bench_headers(store):
+    for ntp in store.ntps:
+        for path in ntp.segments:
+            with storage.SegmentScanner(path, verify=False) as scanner:
+                _consume(scanner)
+
+
+def _bench_jobs(store, jobs):
+    work = [(path, 0) for ntp in store.ntps for path in ntp.segments]
+    _consume(storage.verify_segments(work, jobs))
+
+
+def _bench_records(store):
+    for ntp in store.ntps:
+        for path in ntp.segments:
+            _consume(storage.scan_records(path))
+
+
+def _bench_continuity(store):
+    for ntp in store.ntps:
+        _consume(storage.check_continuity(ntp.segments))
+
+
+def _bench_export(store):
+    for ntp in store.ntps:
+        for path in ntp.segments:
+            storage.export_segment_headers(path)
+
+
+def benchmarks(jobs):
+    """
+    The analyzer modes to benchmark as (name, function taking a Store).
+    """
+    modes = [
+        ("read", _bench_read),
+        ("mmap", _bench_mmap),
+        ("headers", _bench_headers),
+        ("jobs={}".format(jobs), lambda store: _bench_jobs(store, jobs)),
+        ("records", _bench_records),
+        ("continuity", _bench_continuity),
+    ]
+    if storage.np is not None:
+        modes.append(("export", _bench_export))
+    return modes
+
+
+def run_benchmarks(path, jobs, modes=None, repeat=1):
+    """
+    Time each analyzer mode over the data directory at `path` and print the
+    throughput in MB/s. The best of `repeat` runs is reported.
+    """
+    store = storage.Store(path)
+    size = _store_bytes(store)
+    print("{:<12} {:>10} {:>10}".format("mode", "seconds", "MB/s"))
+    for name, bench in benchmarks(jobs):
+        if modes and name.split("=")[0] not in modes:
+            continue
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            bench(store)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        print("{:<12} {:>10.3f} {:>10.1f}".format(name, best,
+                                                  size / best / (1 << 20)))
+
+
+def main():
+    import argparse
+
+    def generate_options():
+        parser = argparse.ArgumentParser(
+            description='Synthetic segment writer and log analyzer benchmark')
+        parser.add_argument(
+            'command',
+            choices=['generate', 'bench'],
+            help='generate a data directory, or benchmark the analyzer modes '
+            'against one (generated in a temporary directory if --path is not '
+            'given)')
+        parser.add_argument('--path',
+                            type=str,
+                            help='Data directory to generate or benchmark')
+        parser.add_argument('--partitions',
+                            type=int,
+                            default=DEFAULT_WORKLOAD.partitions)
+        parser.add_argument('--partition-mb',
+                            type=int,
+                            default=DEFAULT_WORKLOAD.partition_bytes >> 20,
+                            help='Approximate size of each partition')
+        parser.add_argument('--segment-mb',
+                            type=int,
+                            default=DEFAULT_WORKLOAD.segment_bytes >> 20,
+                            help='Size at which segments are rolled')
+        parser.add_argument('--records-per-batch',
+                            type=int,
+                            default=DEFAULT_WORKLOAD.records_per_batch)
+        parser.add_argument('--value-size',
+                            type=int,
+                            default=DEFAULT_WORKLOAD.value_size)
+        parser.add_argument('--key-cardinality',
+                            type=int,
+                            default=DEFAULT_WORKLOAD.key_cardinality,
+                            help='Number of distinct keys, 0 for null keys')
+        parser.add_argument('--compression',
+                            choices=list(CODEC_NAMES.values()),
+                            default=CODEC_NAMES[DEFAULT_WORKLOAD.codec])
+        parser.add_argument('--start-timestamp',
+                            type=int,
+                            default=DEFAULT_WORKLOAD.start_ts)
+        parser.add_argument('--corrupt-every',
+                            type=int,
+                            default=0,
+                            help='Corrupt every Nth batch')
+        parser.add_argument('--gap-every',
+                            type=int,
+                            default=0,
+                            help='Leave an offset gap before every Nth batch')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--jobs',
+                            type=int,
+                            default=os.cpu_count(),
+                            help='Processes used by the parallel benchmark')
+        parser.add_argument('--modes',
+                            nargs='*',
+                            help='Only run these benchmark modes')
+        parser.add_argument('--repeat', type=int, default=1)
+        return parser
+
+    parser = generate_options()
+    options = parser.parse_args()
+    codec = {v: k for k, v in CODEC_NAMES.items()}[options.compression]
+    workload = DEFAULT_WORKLOAD._replace(
+        partitions=options.partitions,
+        partition_bytes=options.partition_mb << 20,
+        segment_bytes=options.segment_mb << 20,
+        records_per_batch=options.records_per_batch,
+        value_size=options.value_size,
+        key_cardinality=options.key_cardinality,
+        codec=codec,
+        start_ts=options.start_timestamp,
+        corrupt_every=options.corrupt_every,
+        gap_every=options.gap_every,
+        seed=options.seed)
+
+    if options.command == "generate":
+        if not options.path:
+            parser.error("generate requires --path")
+        generate_store(options.path, workload)
+        return
+
+    path = options.path
+    tmpdir = None
+    if not path:
+        tmpdir = tempfile.mkdtemp(prefix="storage-bench.")
+        path = tmpdir
+        generate_store(path, workload)
+    try:
+        run_benchmarks(path, options.jobs, options.modes, options.repeat)
+    finally:
+        if tmpdir:
+            shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
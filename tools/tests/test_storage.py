@@ -0,0 +1,778 @@
+# Copyright 2021 Vectorized, Inc.
+#
+# Use of this software is governed by the Business Source License
+# included in the file licenses/BSL.md
+#
+# As of the Change Date specified in that file, in accordance with
+# the Business Source License, use of this software will be governed
+# by the Apache License, Version 2.0
+
+import os
+import sys
+import concurrent.futures
+import re
+import shutil
+import struct
+
+import crc32c
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+import storage
+import storage_bench
+from storage_bench import (SegmentWriter, encode_batch, encode_record,
+                           encode_varint)
+
+
+def write_segment(path, batches):
+    """
+    Write (base offset, record count) batches of small records into a new
+    segment and return the encoded batches.
+    """
+    encoded = []
+    writer = SegmentWriter(str(path), index_step=256)
+    ts = 1000
+    for base_offset, count in batches:
+        records = b"".join(
+            encode_record(i, i, b"key-%d" % i, b"value-%d" % i)
+            for i in range(count))
+        batch = encode_batch(base_offset, records, count, ts, ts + count - 1)
+        writer.append(batch, base_offset, base_offset + count - 1, ts,
+                      ts + count - 1)
+        encoded.append(batch)
+        ts += count
+    writer.close()
+    return encoded
+
+
+def flip_byte(path, position):
+    with open(path, "r+b") as f:
+        f.seek(position)
+        b = f.read(1)
+        f.seek(position)
+        f.write(bytes([b[0] ^ 0xff]))
+
+
+def truncate_tail(path, size):
+    os.truncate(path, os.path.getsize(path) - size)
+
+
+def test_scanner_matches_reader(tmp_path):
+    path = tmp_path / "0-1-v1.log"
+    encoded = write_segment(path, [(0, 3), (3, 1), (4, 5)])
+    with storage.SegmentScanner(str(path)) as scanner, \
+            open(str(path), "rb") as f:
+        batches = list(scanner)
+        assert not scanner.torn
+        assert scanner.position == sum(map(len, encoded))
+        for view in batches:
+            batch = storage.Batch.from_file(f, view.index)
+            assert batch.header == view.header
+            assert bytes(batch.records) == bytes(view.records)
+        assert storage.Batch.from_file(f, 4) is None
+    assert [b.index for b in batches] == [1, 2, 3]
+    assert [b.position for b in batches
+            ] == [0, len(encoded[0]),
+                  len(encoded[0]) + len(encoded[1])]
+    assert [b.last_offset() for b in batches] == [2, 3, 8]
+
+
+@pytest.mark.parametrize("use_mmap", [False, True])
+def test_corrupt_batch(tmp_path, use_mmap):
+    path = tmp_path / "0-1-v1.log"
+    encoded = write_segment(path, [(0, 2), (2, 2), (4, 2)])
+    # a record byte of the second batch
+    position = len(encoded[0]) + len(encoded[1]) - 1
+    flip_byte(str(path), position)
+    with pytest.raises(storage.CorruptBatchError) as e:
+        storage.Segment(str(path)).verify(use_mmap=use_mmap)
+    assert e.value.batch.index == 2
+    assert e.value.batch.header.base_offset == 2
+    report = storage.verify_segment(str(path))
+    assert report.corrupt_index == 2
+    assert report.corrupt_position == len(encoded[0])
+    assert report.batches == 1
+
+
+@pytest.mark.parametrize("use_mmap", [False, True])
+def test_corrupt_header(tmp_path, use_mmap):
+    path = tmp_path / "0-1-v1.log"
+    encoded = write_segment(path, [(0, 2), (2, 2)])
+    # the base offset of the second batch is covered by the header crc
+    flip_byte(str(path), len(encoded[0]) + 8)
+    with pytest.raises(storage.CorruptBatchError) as e:
+        storage.Segment(str(path)).verify(use_mmap=use_mmap)
+    assert e.value.batch.index == 2
+
+
+@pytest.mark.parametrize("use_mmap", [False, True])
+@pytest.mark.parametrize("cut", [1, 40, storage.HEADER_SIZE + 5])
+def test_torn_tail(tmp_path, use_mmap, cut):
+    path = tmp_path / "0-1-v1.log"
+    write_segment(path, [(0, 2), (2, 2), (4, 2)])
+    truncate_tail(str(path), cut)
+    segment = storage.Segment(str(path))
+    segment.verify(use_mmap=use_mmap)
+    assert segment.torn
+    report = storage.verify_segment(str(path))
+    assert report.torn
+    assert report.batches == 2
+    assert report.corrupt_index is None
+
+
+@pytest.mark.parametrize("use_mmap", [False, True])
+def test_preallocated_tail_is_not_torn(tmp_path, use_mmap):
+    path = tmp_path / "0-1-v1.log"
+    write_segment(path, [(0, 2), (2, 2)])
+    for size in (storage.HEADER_SIZE // 2, 4096):
+        with open(str(path), "ab") as f:
+            f.write(bytes(size))
+        segment = storage.Segment(str(path))
+        segment.verify(use_mmap=use_mmap)
+        assert not segment.torn
+
+
+def run_main(monkeypatch, *args):
+    monkeypatch.setattr(sys, "argv", ["storage.py"] + list(args))
+    try:
+        storage.main()
+    except SystemExit as e:
+        return e.code
+    return 0
+
+
+@pytest.mark.parametrize("args", [[], ["--mmap"], ["--jobs", "2"]])
+def test_main_exit_codes(tmp_path, monkeypatch, args):
+    root = str(tmp_path / "store")
+    workload = storage_bench.DEFAULT_WORKLOAD._replace(
+        partitions=2,
+        partition_bytes=32 << 10,
+        segment_bytes=16 << 10,
+        value_size=64)
+    storage_bench.generate_store(root, workload)
+    assert run_main(monkeypatch, "--path", root, *args) == 0
+    ntp = os.path.join(root, "kafka", "bench", "0_1")
+    truncate_tail(storage.list_segments(ntp)[0], 10)
+    assert run_main(monkeypatch, "--path", root, *args) == 1
+    shutil.rmtree(root)
+    storage_bench.generate_store(root, workload._replace(corrupt_every=7))
+    assert run_main(monkeypatch, "--path", root, *args) == 1
+
+
+@pytest.mark.parametrize(
+    "args", [["--mmap", "--jobs", "2"], ["--mmap", "--cache", "c.json"],
+             ["--jobs", "2", "--usage"], ["--usage", "--continuity"]])
+def test_main_rejects_conflicting_options(tmp_path, monkeypatch, args):
+    assert run_main(monkeypatch, "--path", str(tmp_path), *args) == 2
+
+
+def test_verify_segments_pool(tmp_path):
+    storage_bench.generate_store(
+        str(tmp_path),
+        storage_bench.DEFAULT_WORKLOAD._replace(partitions=2,
+                                                partition_bytes=64 << 10,
+                                                segment_bytes=16 << 10))
+    store = storage.Store(str(tmp_path))
+    work = [(path, 0) for ntp in store.ntps for path in ntp.segments]
+    inline = {r.path: r for r in storage.verify_segments(work, 1)}
+    pooled = {r.path: r for r in storage.verify_segments(work, 2)}
+    assert inline == pooled
+    assert len(inline) == len(work)
+    for report in inline.values():
+        assert report.corrupt_index is None
+        assert report.position == os.path.getsize(report.path)
+
+
+def test_record_filters(tmp_path):
+    path = tmp_path / "0-1-v1.log"
+    write_segment(path, [(0, 10), (10, 10), (20, 10)])
+    offsets = [
+        r.offset
+        for r in storage.scan_records(str(path), min_offset=8, max_offset=21)
+    ]
+    assert offsets == list(range(8, 22))
+    # timestamps start at 1000 and advance by one per record
+    offsets = [
+        r.offset
+        for r in storage.scan_records(str(path), min_ts=1015, max_ts=1016)
+    ]
+    assert offsets == [15, 16]
+
+
+@pytest.mark.parametrize("codec", sorted(storage.CODEC_NAMES))
+def test_decode_compressed_records(tmp_path, codec):
+    records = [(i, i * 10, b"key-%d" % i, b"value-%d" % i * 10,
+                [(b"h", b"%d" % i)]) for i in range(20)]
+    section = b"".join(encode_record(*r) for r in records)
+    batch = encode_batch(100, section, len(records), 5000, 5190, codec)
+    path = tmp_path / "100-1-v1.log"
+    path.write_bytes(batch)
+    decompressor = storage.Decompressor()
+    with storage.SegmentScanner(str(path)) as scanner:
+        (view, ) = list(scanner)
+        decoded = list(view.iter_records(decompressor))
+    assert [r.offset for r in decoded] == list(range(100, 120))
+    assert [r.timestamp for r in decoded] == [5000 + i * 10 for i in range(20)]
+    assert [bytes(r.key) for r in decoded] == [r[2] for r in records]
+    assert [bytes(r.value) for r in decoded] == [r[3] for r in records]
+    assert [[(bytes(k), bytes(v)) for k, v in r.headers]
+            for r in decoded] == [r[4] for r in records]
+    if codec != storage.CODEC_NONE:
+        name = storage.CODEC_NAMES[codec]
+        assert decompressor.stats[name][0] == 1
+        assert decompressor.stats[name][2] == len(section)
+
+
+def test_decode_xerial_snappy():
+    section = b"".join(
+        encode_record(i, 0, None, b"x" * 100) for i in range(10))
+    # two xerial blocks
+    blocks = [section[:300], section[300:]]
+    data = storage.XERIAL_SNAPPY_MAGIC + bytes(8) + b"".join(
+        struct.pack(">i", len(c)) + c
+        for c in map(storage.snappy.compress, blocks))
+    header = storage.Header(0, 0, 0, 1, 0, storage.CODEC_SNAPPY, 9, 0, 0, -1,
+                            -1, -1, 10)
+    decoded = storage.Decompressor().records(header, data)
+    assert bytes(decoded) == section
+
+
+def test_index_lookups(tmp_path):
+    path = tmp_path / "0-1-v1.log"
+    batches = [(i * 5, 5) for i in range(200)]
+    write_segment(path, batches)
+    segment = storage.Segment(str(path))
+    index = segment.index
+    assert index is not None
+    assert len(index) > 1
+    assert index.base_offset == 0
+    assert index.max_offset == 999
+    assert index.lookup_offset(-1) is None
+    with storage.SegmentScanner(str(path), verify=False) as scanner:
+        positions = {b.header.base_offset: b.position for b in scanner}
+    for offset in (0, 3, 5, 499, 997):
+        assert segment.seek(offset) == positions[offset - offset % 5]
+        start = index.lookup_offset(offset)
+        assert start is not None and start <= positions[offset - offset % 5]
+    assert segment.seek(1000) is None
+    # record timestamps are 1000 + offset
+    assert segment.seek_time(1000 + 512) == positions[510]
+    assert segment.seek_time(5000) is None
+
+
+def test_index_fallback(tmp_path):
+    path = tmp_path / "0-1-v1.log"
+    write_segment(path, [(i * 5, 5) for i in range(50)])
+    segment = storage.Segment(str(path))
+    with_index = [segment.seek(o) for o in range(0, 250, 7)]
+    flip_byte(segment.index_path, 40)
+    assert storage.SegmentIndex.load(segment.index_path) is None
+    os.remove(segment.index_path)
+    segment = storage.Segment(str(path))
+    assert segment.index is None
+    assert [segment.seek(o) for o in range(0, 250, 7)] == with_index
+
+
+def write_compaction_index(path, keys):
+    entries = bytearray()
+    for offset, key in enumerate(keys):
+        body = bytes([storage.COMPACTION_ENTRY_KEY
+                      ]) + encode_varint(offset) + encode_varint(0) + key
+        entries += storage.COMPACTION_ENTRY_SIZE_STRUCT.pack(len(body)) + body
+    footer = storage.COMPACTION_FOOTER_STRUCT.pack(len(entries), len(keys), 0,
+                                                   crc32c.crc32(entries), 1)
+    with open(path, "wb") as f:
+        f.write(entries + footer)
+
+
+def test_compaction_index(tmp_path):
+    path = str(tmp_path / "0-1-v1.compaction_index")
+    keys = [b"key-%d" % (i % 300) for i in range(1000)]
+    write_compaction_index(path, keys)
+    hll = storage.HyperLogLog()
+    with storage.CompactionIndex(path) as index:
+        index.verify()
+        assert index.footer.keys == len(keys)
+        entries = list(index)
+        for entry in entries:
+            hll.add(entry.key)
+    assert [bytes(e.key) for e in entries] == keys
+    assert [e.offset for e in entries] == list(range(len(keys)))
+    assert abs(hll.cardinality() - 300) < 300 * 0.05
+    report = storage.compaction_report("t", hll, len(keys), len(keys), 10000)
+    assert report.distinct == pytest.approx(300, rel=0.05)
+    assert report.reclaimable_bytes == pytest.approx(7000, rel=0.05)
+
+    flip_byte(path, 3)
+    with storage.CompactionIndex(path) as index:
+        with pytest.raises(storage.CorruptIndexError):
+            index.verify()
+    with open(path, "ab") as f:
+        f.write(b"\0")
+    with pytest.raises(storage.CorruptIndexError):
+        with storage.CompactionIndex(path):
+            pass
+
+
+def test_cache_resume(tmp_path):
+    ntp = tmp_path / "data" / "kafka" / "t" / "0_1"
+    ntp.mkdir(parents=True)
+    path = ntp / "0-1-v1.log"
+    write_segment(path, [(0, 2), (2, 2), (4, 2)])
+    store = storage.Store(str(tmp_path / "data"))
+    cache_path = str(tmp_path / "cache.json")
+
+    # unknown segments are verified from the start
+    cache = storage.VerificationCache(cache_path)
+    assert cache.resume_point(str(path)) == (0, 0)
+    storage.verify_store(store, 1, cache)
+
+    # unchanged segments are skipped
+    cache = storage.VerificationCache(cache_path)
+    assert cache.resume_point(str(path)) is None
+    cache.save()
+
+    # appended segments resume where the last run stopped
+    size = os.path.getsize(str(path))
+    with open(str(path), "ab") as f:
+        f.write(encode_batch(6, encode_record(0, 0, None, b"v"), 1, 0, 0))
+    cache = storage.VerificationCache(cache_path)
+    assert cache.resume_point(str(path)) == (size, 3)
+    report = storage.verify_segment(str(path), size, 3)
+    assert report.batches == 1
+    assert report.total_batches == 4
+    cache.update(report)
+    cache.save()
+
+    # corruption past the resume point is reported with its segment index
+    size = os.path.getsize(str(path))
+    with open(str(path), "ab") as f:
+        f.write(encode_batch(7, encode_record(0, 0, None, b"v"), 1, 0, 0))
+    flip_byte(str(path), os.path.getsize(str(path)) - 1)
+    cache = storage.VerificationCache(cache_path)
+    report = storage.verify_segment(str(path), *cache.resume_point(str(path)))
+    assert report.corrupt_index == 5
+    assert report.corrupt_position == size
+
+    # a replaced file is verified from scratch
+    write_segment(path, [(0, 1)])
+    assert cache.resume_point(str(path)) == (0, 0)
+
+
+def test_cache_torn_tails(tmp_path, monkeypatch):
+    ntp = tmp_path / "data" / "kafka" / "t" / "0_1"
+    ntp.mkdir(parents=True)
+    closed = ntp / "0-1-v1.log"
+    active = ntp / "4-1-v1.log"
+    write_segment(closed, [(0, 2), (2, 2)])
+    batch = encode_batch(4, encode_record(0, 0, None, b"v"), 1, 0, 0)
+    active.write_bytes(batch[:-5])
+    args = ["--path", str(tmp_path / "data"), "--cache", str(tmp_path / "c")]
+
+    # the active segment is still being written, so it is retried
+    for _ in range(2):
+        assert run_main(monkeypatch, *args) == 0
+        cache = storage.VerificationCache(str(tmp_path / "c"))
+        assert cache.entries[str(active)]["torn"]
+    with open(str(active), "ab") as f:
+        f.write(batch[-5:])
+    assert run_main(monkeypatch, *args) == 0
+    entry = storage.VerificationCache(str(tmp_path / "c")).entries[str(active)]
+    assert not entry["torn"]
+    assert entry["batches"] == 1
+
+    # a torn tail on any other segment fails every pass
+    truncate_tail(str(closed), 5)
+    for _ in range(2):
+        assert run_main(monkeypatch, *args) == 1
+    entry = storage.VerificationCache(str(tmp_path / "c")).entries[str(closed)]
+    assert entry["torn"]
+    assert entry["batches"] == 1
+
+
+def test_export_headers_in_offset_order(tmp_path):
+    np = pytest.importorskip("numpy")
+    ntp = tmp_path / "data" / "kafka" / "t" / "0_1"
+    ntp.mkdir(parents=True)
+    encoded = write_segment(ntp / "2-1-v1.log", [(2, 2), (4, 2)])
+    write_segment(ntp / "1000-1-v1.log", [(1000, 2)])
+    write_segment(ntp / "0-1-v1.log", [(0, 2)])
+    storage.export_headers(storage.Store(str(tmp_path / "data")),
+                           str(tmp_path / "out"))
+    archive = np.load(str(tmp_path / "out" / "kafka" / "t" / "0_1.npz"))
+    assert list(archive["headers"]["base_offset"]) == [0, 2, 4, 1000]
+    assert list(archive["segment"]) == [0, 1, 1, 2]
+    assert list(archive["positions"]) == [0, 0, len(encoded[0]), 0]
+    summary = storage.summarize_headers(archive["headers"])
+    assert summary["batches"] == 4
+    assert summary["offset_gaps"] == 1
+
+
+def test_continuity(tmp_path):
+    workload = storage_bench.DEFAULT_WORKLOAD._replace(
+        partitions=1,
+        partition_bytes=64 << 10,
+        segment_bytes=16 << 10,
+        value_size=64,
+        gap_every=5)
+    storage_bench.generate_store(str(tmp_path), workload)
+    store = storage.Store(str(tmp_path))
+    issues = list(storage.check_continuity(store.ntps[0].segments))
+    assert issues
+    assert {i.kind for i in issues} == {storage.HOLE}
+    for issue in issues:
+        assert issue.found - issue.expected == workload.records_per_batch
+
+    ntp = tmp_path / "kafka" / "t" / "0_1"
+    ntp.mkdir(parents=True)
+    write_segment(ntp / "0-2-v1.log", [(0, 5)])
+    write_segment(ntp / "3-1-v1.log", [(3, 5)])
+    issues = list(storage.check_continuity(storage.list_segments(str(ntp))))
+    assert [i.kind
+            for i in issues] == [storage.TERM_REGRESSION, storage.OVERLAP]
+
+
+def test_generate_ntp(tmp_path):
+    workload = storage_bench.DEFAULT_WORKLOAD._replace(
+        partition_bytes=32 << 10,
+        segment_bytes=8 << 10,
+        value_size=64,
+        codec=storage.CODEC_GZIP)
+    batches = storage_bench.generate_ntp(str(tmp_path / "a"), workload)
+    segments = storage.list_segments(str(tmp_path / "a"))
+    assert len(segments) > 1
+    reports = [storage.verify_segment(path) for path in segments]
+    assert sum(r.batches for r in reports) == batches
+    assert all(r.corrupt_index is None and not r.torn for r in reports)
+    offsets = [
+        r.offset for path in segments for r in storage.scan_records(path)
+    ]
+    assert offsets == list(range(batches * workload.records_per_batch))
+
+    storage_bench.generate_ntp(str(tmp_path / "b"),
+                               workload._replace(corrupt_every=3))
+    segments = storage.list_segments(str(tmp_path / "b"))
+    assert storage.verify_segment(segments[0]).corrupt_index == 3
+
+
+@pytest.mark.parametrize("interval", [1, 3, 4096])
+def test_find_divergence(tmp_path, monkeypatch, interval):
+    monkeypatch.setattr(storage, "CHAIN_CHECKPOINT_INTERVAL", interval)
+    a = tmp_path / "a"
+    b = tmp_path / "b"
+    for replica in (a, b):
+        replica.mkdir()
+        write_segment(replica / "0-1-v1.log", [(i * 2, 2) for i in range(10)])
+        write_segment(replica / "20-2-v1.log",
+                      [(20 + i * 2, 2) for i in range(10)])
+    replicas = [storage.LocalReplica(str(a)), storage.LocalReplica(str(b))]
+    assert storage.find_divergence(replicas) == (20, [20, 20])
+
+    write_segment(b / "20-2-v1.log",
+                  [(20 + i * 2, 2) for i in range(4)] + [(28, 1)])
+    replicas = [storage.LocalReplica(str(a)), storage.LocalReplica(str(b))]
+    assert storage.find_divergence(replicas) == (14, [20, 15])
+
+    # every entry matches the one built without checkpoints
+    chain = storage.HashChain(storage.list_segments(str(a)))
+    full = storage.HashChain(storage.list_segments(str(a)), len(chain))
+    assert [chain.entry(i) for i in reversed(range(len(chain)))
+            ] == [full.entry(i) for i in reversed(range(len(full)))]
+    assert len(chain.checkpoints) == -(-len(chain) // interval)
+
+
+def adl_string(s):
+    return struct.pack("<i", len(s)) + s
+
+
+def test_decode_internal_batches():
+    topic = adl_string(b"kafka") + adl_string(b"topic")
+    record = storage.Record(0, 0, 0, topic, b"\x01" + topic, [])
+    entry = storage.decode_controller_command(6, record)
+    assert entry["command"] == "delete_topic"
+    assert entry["key"] == {"ns": "kafka", "topic": "topic"}
+    assert entry["value"] == {"ns": "kafka", "topic": "topic"}
+
+    record = storage.Record(0, 0, 0, b"\x01abc",
+                            b"\x01" + struct.pack("<i", 42), [])
+    assert storage.decode_kvstore_entry(record) == {
+        "command": "kvstore_put",
+        "key_space": "consensus",
+        "key": b"abc".hex(),
+        "value_size": 42
+    }
+    record = storage.Record(0, 0, 0, b"\x02abc", b"\x00", [])
+    assert storage.decode_kvstore_entry(record)["command"] == "kvstore_delete"
+
+    section = encode_record(0, 0, b"\x03k", b"\x01" + struct.pack("<i", 7))
+    data = encode_batch(0,
+                        section,
+                        1,
+                        0,
+                        0,
+                        batch_type=storage.KVSTORE_BATCH_TYPE)
+    scanner = storage.SegmentScanner.from_buffer("kvstore", data)
+    (batch, ) = list(scanner)
+    (entry, ) = list(storage.decode_internal_batch(batch))
+    assert entry["key_space"] == "controller"
+    assert entry["batch_type"] == "kvstore"
+
+
+def read_source(*path):
+    root = os.path.join(os.path.dirname(__file__), "..", "..", "src", "v")
+    with open(os.path.join(root, *path)) as f:
+        return f.read()
+
+
+def parse_enum(source, name):
+    body = re.search(r"enum class %s : \w+ {(.*?)};" % name, source, re.S)
+    return {
+        int(value): key
+        for key, value in re.findall(r"(\w+) = (\d+)", body.group(1))
+    }
+
+
+def test_internal_tables_match_sources():
+    assert storage.BATCH_TYPE_NAMES == parse_enum(
+        read_source("model", "record_batch_types.h"), "record_batch_type")
+    assert storage.KVSTORE_KEY_SPACES == parse_enum(
+        read_source("storage", "kvstore.h"), "key_space")
+
+    source = read_source("cluster", "commands.h")
+    batch_types = {v: k for k, v in storage.BATCH_TYPE_NAMES.items()}
+    command_types = {
+        name: int(value)
+        for name, value in re.findall(
+            r"static constexpr int8_t (\w+)_cmd_type = (\d+);", source)
+    }
+    commands = {(batch_types[batch_type], command_types[name]): name
+                for name, batch_type in re.findall(
+                    r"using (\w+)_cmd = controller_command<[^;]*?"
+                    r"model::record_batch_type::(\w+)>;", source)}
+    assert commands == {
+        k: name
+        for k, (name, _, _) in storage.CONTROLLER_COMMANDS.items()
+    }
+
+
+def test_partition_usage(tmp_path):
+    ntp = tmp_path / "data" / "kafka" / "t" / "0_1"
+    ntp.mkdir(parents=True)
+    path = ntp / "0-1-v1.log"
+    section = b"".join(
+        encode_record(i, 0, None, b"value" * 20) for i in range(10))
+    with open(str(path), "wb") as f:
+        for i, codec in enumerate(
+            (storage.CODEC_NONE, storage.CODEC_GZIP, storage.CODEC_ZSTD)):
+            f.write(encode_batch(i * 10, section, 10, 0, 0, codec))
+        f.write(
+            encode_batch(30,
+                         section,
+                         10,
+                         0,
+                         0,
+                         batch_type=storage.KVSTORE_BATCH_TYPE))
+    # only headers are read unless inflating is asked for
+    decompressor = storage.Decompressor()
+    usage = storage.partition_usage([str(path)], decompressor)
+    assert usage[
+        storage.RAFT_DATA_BATCH_TYPE].to_dict()["compression_ratio"] is None
+    assert not decompressor.stats
+
+    usage = storage.partition_usage([str(path)], decompressor, 1)
+    data = usage[storage.RAFT_DATA_BATCH_TYPE].to_dict()
+    assert data["batches"] == 3
+    assert data["records"] == 30
+    assert data["compression_ratio"] > 1
+    kvstore = usage[storage.KVSTORE_BATCH_TYPE].to_dict()
+    assert kvstore["batches"] == 1
+    assert kvstore["compression_ratio"] is None
+    assert data["bytes"] + kvstore["bytes"] == os.path.getsize(str(path))
+
+    # every second compressed batch, i.e. only the zstd one
+    usage = storage.partition_usage([str(path)], storage.Decompressor(), 2)
+    stats = usage[storage.RAFT_DATA_BATCH_TYPE]
+    assert stats.compressed_bytes == len(
+        encode_batch(20, section, 10, 0, 0,
+                     storage.CODEC_ZSTD)) - storage.HEADER_SIZE
+
+
+def test_follow_active_segment(tmp_path):
+    ntp = tmp_path / "kafka" / "t" / "0_1"
+    ntp.mkdir(parents=True)
+    path = ntp / "0-1-v1.log"
+    encoded = write_segment(path, [(0, 2)])
+    follower = storage.SegmentFollower(storage.Store(str(tmp_path)).ntps[0],
+                                       grace=3600)
+    follower.advance()
+    assert follower.batches == 1
+    assert follower.position == len(encoded[0])
+
+    batch = encode_batch(2, encode_record(0, 0, None, b"v"), 1, 0, 0)
+    with open(str(path), "ab") as f:
+        f.write(batch[:20])
+    follower.advance()
+    assert follower.torn
+    with open(str(path), "ab") as f:
+        f.write(batch[20:])
+    follower.advance()
+    assert not follower.torn
+    assert follower.batches == 2
+
+    # a crc failure at the tail may still be in flight
+    with open(str(path), "ab") as f:
+        f.write(encode_batch(3, encode_record(0, 0, None, b"v"), 1, 0, 0))
+    flip_byte(str(path), os.path.getsize(str(path)) - 1)
+    follower.advance()
+    assert follower.suspect
+    with pytest.raises(storage.CorruptBatchError):
+        follower.advance(final=True)
+
+    # files that don't follow the segment naming scheme are never followed
+    write_segment(ntp / "backup.log", [(0, 1)])
+    follower = storage.SegmentFollower(storage.Store(str(tmp_path)).ntps[0],
+                                       grace=3600)
+    assert follower.path == str(path)
+
+
+class FakeS3:
+    def __init__(self, objects):
+        self.objects = objects
+        self.requests = 0
+
+    def list_objects(self, bucket, prefix=""):
+        for key in sorted(self.objects):
+            if key.startswith(prefix):
+                yield key, len(self.objects[key])
+
+    def get_range(self, bucket, key, start, end):
+        self.requests += 1
+        return self.objects[key][start:end]
+
+
+@pytest.mark.parametrize("headers_only", [False, True])
+def test_verify_remote_segments(tmp_path, monkeypatch, headers_only):
+    monkeypatch.setattr(storage, "S3_PART_SIZE", 4096)
+    storage_bench.generate_store(
+        str(tmp_path),
+        storage_bench.DEFAULT_WORKLOAD._replace(partitions=1,
+                                                partition_bytes=64 << 10,
+                                                segment_bytes=16 << 10,
+                                                value_size=64))
+    store = storage.Store(str(tmp_path))
+    objects = {
+        "kafka/bench/0_1/" + os.path.basename(p): open(p, "rb").read()
+        for p in store.ntps[0].segments
+    }
+    walk = storage.walk_remote_headers if headers_only else \
+        storage.verify_remote_segment
+    with concurrent.futures.ThreadPoolExecutor(4) as executor:
+        for (key, data), path in zip(sorted(objects.items()),
+                                     store.ntps[0].segments):
+            local = storage.verify_segment(path)
+            report = walk(FakeS3(objects), "b", key, len(data), executor, 4)
+            assert report.batches == local.batches
+            assert report.position == local.position
+            assert not report.torn
+
+        key, data = sorted(objects.items())[0]
+        # a byte of the header crc of the third batch
+        third = storage.verify_segment(store.ntps[0].segments[0])
+        with storage.SegmentScanner(store.ntps[0].segments[0]) as scanner:
+            position = [b.position for b in scanner][2]
+        corrupt = bytearray(data)
+        corrupt[position] ^= 0xff
+        objects[key] = bytes(corrupt)
+        report = walk(FakeS3(objects), "b", key, len(data), executor, 4)
+        assert report.corrupt_index == 3
+        assert report.corrupt_position == position
+
+        objects[key] = data[:-10]
+        report = walk(FakeS3(objects), "b", key, len(data) - 10, executor, 4)
+        assert report.torn
+        assert report.batches == third.batches - 1
+
+
+@pytest.mark.parametrize("headers_only", [False, True])
+def test_verify_bucket_torn_tail_is_fatal(tmp_path, headers_only):
+    encoded = write_segment(tmp_path / "0-1-v1.log", [(0, 2), (2, 2)])
+    objects = {"kafka/t/0_1/0-1-v1.log": b"".join(encoded)}
+    storage.verify_bucket(FakeS3(objects), "b", "", 4, headers_only)
+    objects["kafka/t/0_1/0-1-v1.log"] = b"".join(encoded)[:-5]
+    with pytest.raises(SystemExit) as e:
+        storage.verify_bucket(FakeS3(objects), "b", "", 4, headers_only)
+    assert e.value.code == 1
+
+
+def test_remote_readahead_skips_large_batches():
+    data = bytes(range(256)) * 1024
+    client = FakeS3({"k": data})
+    with concurrent.futures.ThreadPoolExecutor(4) as executor:
+        with storage.RemoteReadahead(client, "b", "k", len(data), executor,
+                                     4) as reader:
+            # sequential reads grow the pipeline
+            for pos in range(0, 5 * storage.S3_HEADER_READAHEAD, 61):
+                assert reader.read(pos, 61) == data[pos:pos + 61]
+            # a jump restarts it with a single window
+            requests = client.requests
+            pos = 200 * 1024
+            assert reader.read(pos, 61) == data[pos:pos + 61]
+            assert client.requests == requests + 1
+
+
+def test_repair_plan(tmp_path):
+    ntp = tmp_path / "kafka" / "t" / "0_1"
+    ntp.mkdir(parents=True)
+    write_segment(ntp / "0-1-v1.log", [(0, 2), (2, 2)])
+    second = write_segment(ntp / "4-1-v1.log", [(4, 2), (6, 2), (8, 2)])
+    write_segment(ntp / "10-1-v1.log", [(10, 2)])
+    paths = storage.list_segments(str(ntp))
+    assert storage.plan_repair(paths) == []
+
+    flip_byte(paths[1], len(second[0]) + len(second[1]) - 1)
+    actions = storage.plan_repair(paths)
+    assert actions[0].action == storage.REPAIR_TRUNCATE
+    assert actions[0].path == paths[1]
+    assert actions[0].reason == storage.REPAIR_REASON_CORRUPT
+    assert actions[0].truncate_to == len(second[0])
+    assert actions[0].last_offset == 5
+    assert (storage.REPAIR_REMOVE, storage.REPAIR_REASON_STALE_INDEX) in [
+        (a.action, a.reason) for a in actions
+        if a.path.endswith("4-1-v1.base_index")
+    ]
+    assert (storage.REPAIR_REMOVE, paths[2],
+            storage.REPAIR_REASON_AFTER_TRUNCATION) in [
+                (a.action, a.path, a.reason) for a in actions
+            ]
+
+    copy = tmp_path / "copy"
+    storage.write_repaired_copy(str(ntp), str(copy), actions)
+    copied = storage.list_segments(str(copy))
+    assert [os.path.basename(p)
+            for p in copied] == ["0-1-v1.log", "4-1-v1.log"]
+    assert storage.plan_repair(copied) == []
+    assert os.path.getsize(copied[1]) == len(second[0])
+    # the original is untouched
+    assert os.path.getsize(paths[2]) > 0
+
+    storage.repair_in_place(actions)
+    assert storage.plan_repair(storage.list_segments(str(ntp))) == []
+    assert len(storage.list_segments(str(ntp))) == 2
+
+
+def test_repair_torn_and_empty_segments(tmp_path):
+    ntp = tmp_path / "kafka" / "t" / "0_1"
+    ntp.mkdir(parents=True)
+    write_segment(ntp / "0-1-v1.log", [(0, 2), (2, 2)])
+    truncate_tail(str(ntp / "0-1-v1.log"), 3)
+    (action, *_) = storage.plan_repair(storage.list_segments(str(ntp)))
+    assert action.action == storage.REPAIR_TRUNCATE
+    assert action.reason == storage.REPAIR_REASON_TORN
+
+    # a segment without a single valid batch is removed
+    path = ntp / "0-1-v1.log"
+    write_segment(path, [(0, 2)])
+    flip_byte(str(path), os.path.getsize(str(path)) - 1)
+    (action, *_) = storage.plan_repair(storage.list_segments(str(ntp)))
+    assert action.action == storage.REPAIR_REMOVE
+    assert action.reason == storage.REPAIR_REASON_CORRUPT